@@ -1,5 +1,7 @@
 import streamlit as st
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.generativeai.client import get_default_generative_client
 import os
 import tempfile
 import time
@@ -8,7 +10,44 @@ import arabic_reshaper
 from bidi.algorithm import get_display
 import logging
 import re
+import json
+import hashlib
+import bisect
+import uuid
+import threading
+import glob
+import importlib
+import shutil
+from collections import OrderedDict, namedtuple, deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd # Added for better display formatting
+import requests
+import numpy as np
+from report_export import export_squad_reports, create_report_pool
+from resumable_upload import ResumableUploader, GEMINI_UPLOAD_BASE_URL
+from gemini_scheduler import (
+    SCHEDULER_PRIORITY_INTERACTIVE, SCHEDULER_PRIORITY_BULK, CancellationToken, EvaluationDeadline,
+    EvaluationStopped, FairShareScheduler, is_quota_error,
+)
+from biomechanics import (
+    BIOMECHANICS_METRICS_EN, BIOMECHANICS_LABELS_AR, BIOMECHANICS_LABELS_EN, BIO_VALUE_MAP_AR_TO_EN, NOT_CLEAR_AR,
+    STEP_SIDE_RIGHT, STEP_SIDE_LEFT, STEP_RESPONSE_FIELDS, STEP_MODEL_METRICS_EN,
+    STEP_EXTRA_METRICS_EN, STEP_EXTRA_LABELS_EN, STEP_COLUMN_LABELS_EN, STEP_DERIVED_METRICS,
+    POSE_EXTRA_METRICS_EN, POSE_EXTRA_LABELS_EN,
+    parse_step_series_response, derive_step_metrics, step_series_to_bytes, compute_pose_biomechanics, pose_risk_score,
+)
+from player_history import PlayerHistoryStore, HISTORY_SOURCE_SKILLS, HISTORY_SOURCE_BIOMECHANICS
+try:
+    import cv2 # Optional: frame decoding for near-duplicate video detection
+except ImportError:
+    cv2 = None
+try:
+    import mediapipe as mp # Optional: local CPU pose estimation for the Star page
+except ImportError:
+    mp = None
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -55,71 +94,282 @@ SKILLS_LABELS_AGE_8_PLUS_AR = {
     "Zigzag": "المراوغة (زجزاج)"
 }
 
-# --- Biomechanics Metrics (for Star page) ---
-# Use consistent keys, preferably English for internal use
-BIOMECHANICS_METRICS_EN = [
-    "Right_Knee_Angle_Avg", "Left_Knee_Angle_Avg", "Asymmetry_Avg_Percent",
-    "Contact_Angle_Avg", "Max_Acceleration", "Steps_Count",
-    "Step_Frequency", "Hip_Flexion_Avg", "Trunk_Lean_Avg",
-    "Pelvic_Tilt_Avg", "Thorax_Rotation_Avg", "Risk_Level", "Risk_Score"
-]
-# Arabic labels for display
-BIOMECHANICS_LABELS_AR = {
-    "Right_Knee_Angle_Avg": "متوسط زاوية الركبة اليمنى (°)",
-    "Left_Knee_Angle_Avg": "متوسط زاوية الركبة اليسرى (°)",
-    "Asymmetry_Avg_Percent": "متوسط عدم التماثل (%)",
-    "Contact_Angle_Avg": "متوسط زاوية التلامس (°)",
-    "Max_Acceleration": "أقصى تسارع (قيمة نسبية)",
-    "Steps_Count": "عدد الخطوات",
-    "Step_Frequency": "تردد الخطوات (خطوة/ثانية)",
-    "Hip_Flexion_Avg": "متوسط ثني الورك (°)",
-    "Trunk_Lean_Avg": "متوسط ميل الجذع (°)",
-    "Pelvic_Tilt_Avg": "متوسط إمالة الحوض (°)",
-    "Thorax_Rotation_Avg": "متوسط دوران الصدر (°)",
-    "Risk_Level": "مستوى الخطورة",
-    "Risk_Score": "درجة الخطورة"
-}
-# --- Biomechanics Metrics (English Labels for Star page Display) ---
-BIOMECHANICS_LABELS_EN = {
-    "Right_Knee_Angle_Avg": "Right Knee Angle Avg (°)",
-    "Left_Knee_Angle_Avg": "Left Knee Angle Avg (°)",
-    "Asymmetry_Avg_Percent": "Asymmetry Avg (%)",
-    "Contact_Angle_Avg": "Contact Angle Avg (°)",
-    "Max_Acceleration": "Max Acceleration (Relative)",
-    "Steps_Count": "Steps Count",
-    "Step_Frequency": "Step Frequency (steps/sec)",
-    "Hip_Flexion_Avg": "Hip Flexion Avg (°)",
-    "Trunk_Lean_Avg": "Trunk Lean Avg (°)",
-    "Pelvic_Tilt_Avg": "Pelvic Tilt Avg (°)",
-    "Thorax_Rotation_Avg": "Thorax Rotation Avg (°)",
-    "Risk_Level": "Risk Level",
-    "Risk_Score": "Risk Score"
-}
-NOT_CLEAR_EN = "Not Clear"
-# Mapping from potential Arabic values received from Gemini to English display values
-BIO_VALUE_MAP_AR_TO_EN = {
-    'غير واضح': NOT_CLEAR_EN,
-    'منخفض': 'Low',
-    'متوسط': 'Medium',
-    'مرتفع': 'High'
-    # Add any other potential Arabic text values Gemini might return here
-}
-# Placeholder for non-detected values
-NOT_CLEAR_AR = "غير واضح"
-
 # --- General Constants ---
 MAX_SCORE_PER_SKILL = 5
+GRADE_INCOMPLETE_AR = "غير مكتمل" # All-skills run stopped before every skill was scored: no letter grade
 MODEL_NAME = "models/gemini-1.5-pro" # Make sure this model supports video analysis
+WARM_MODEL_NAMES = [MODEL_NAME] # Model handles created once at process start, shared by all sessions
 
 # --- Analysis Modes (Simplified - Arabic) ---
 MODE_SINGLE_VIDEO_ALL_SKILLS_AR = "تقييم جميع مهارات الفئة العمرية (فيديو واحد)"
 MODE_SINGLE_VIDEO_ONE_SKILL_AR = "تقييم مهارة محددة (فيديو واحد)"
+MODE_VIDEO_QUEUE_ALL_SKILLS_AR = "تقييم قائمة فيديوهات (عدة لاعبين)"
+MODE_LEADERBOARD_AR = "مقارنة لاعبين (لوحة الترتيب)"
+MODE_FULL_REPORT_AR = "تقرير كشفي شامل (المهارات + البيوميكانيكا، فيديو واحد)"
+
+# --- Star Page Input Modes (Arabic) ---
+STAR_MODE_SINGLE_AR = "فيديو واحد"
+STAR_MODE_QUEUE_AR = "قائمة فيديوهات (عدة لاعبين)"
+
+# --- Shared Video Asset Settings (one upload per clip, reused by every page and mode of a session) ---
+VIDEO_ASSET_STATE_TTL_S = 60.0 # A file seen ACTIVE this recently is reused without asking Gemini again
+VIDEO_ASSET_MAX_FILES = 2 # Gemini files a session keeps; the least recently used is deleted beyond this
+
+# --- Video Queue Prefetch Settings ---
+QUEUE_PREFETCH_DEPTH = 2 # Videos uploaded/processed ahead of the one being analysed
+QUEUE_STORAGE_BUDGET_BYTES = 2 * 1024 ** 3 # Max bytes a queue may hold in Gemini storage at once
+
+# --- Player Comparison (Leaderboard) Settings ---
+ANALYSIS_POOL_WORKERS = 4 # Players evaluated at once, shared by all sessions of this server process
+LEADERBOARD_DEFAULT_TOP_K = 10
+LEADERBOARD_RANK_BY_TOTAL = "Total"
+
+# --- Request Hedging Settings (process-wide; toggled under Advanced Gemini Options) ---
+HEDGING_ENABLED_DEFAULT = os.environ.get("SCOUT_EYE_HEDGING", "0") == "1" # Value at server start
+HEDGE_FALLBACK_MODEL_NAME = None # e.g. "models/gemini-1.5-flash"; None sends the duplicate to the same model
+HEDGE_BUDGET_RATIO = 0.1 # At most ~10% of calls may be duplicated
+HEDGE_BUDGET_BURST = 5 # Hedges that may fire back to back before the budget refills
+HEDGE_LATENCY_WINDOW = 200 # Recent latencies per (model, task) used for the p90
+HEDGE_MIN_SAMPLES = 20 # Below this, HEDGE_DEFAULT_DELAY_S is used instead of the p90
+HEDGE_DEFAULT_DELAY_S = 60.0
+HEDGE_MAX_WORKERS = 32
+
+# --- Evaluation Deadline Settings (one end-to-end budget per evaluation, shared by all its stages) ---
+EVALUATION_DEADLINE_S = 900.0 # Upload, processing and every analysis call of one video
+UPLOAD_PROCESSING_TIMEOUT_S = 300.0 # Per-stage caps, each clipped to the time left on the deadline
+SKILL_CALL_TIMEOUT_S = 180.0
+BIOMECHANICS_CALL_TIMEOUT_S = 300.0
+FILE_POLL_INTERVAL_S = 15.0
+
+# --- Fair-Share Gemini Scheduler Settings (every session shares one GEMINI_API_KEY) ---
+SCHEDULER_MAX_CONCURRENT_CALLS = 8 # Analysis calls in flight at once, across all sessions of this server
+SCHEDULER_REQUESTS_PER_MINUTE = float(os.environ.get("SCOUT_EYE_GEMINI_RPM", "60")) # Per-minute quota of the shared key
+SCHEDULER_BURST = 5 # Calls that may start back to back before the per-minute rate applies
+SCHEDULER_QUOTA_COOLDOWN_S = 20.0 # Admission pause after the API reports the quota as exhausted
+SCHEDULER_QUOTA_RETRIES = 3 # A call refused for quota is queued again this many times instead of failing
+
+# --- Resumable Upload Settings (chunked uploads that resume from the last committed byte) ---
+UPLOAD_CHUNK_SIZE_BYTES = int(os.environ.get("SCOUT_EYE_UPLOAD_CHUNK_MB", "8")) * 1024 ** 2 # Multiple of 256 KiB; adjustable under Advanced Gemini Options
+UPLOAD_CHUNK_SIZE_CHOICES_MB = [1, 2, 4, 8, 16, 32, 64]
+UPLOAD_BASE_URL = os.environ.get("SCOUT_EYE_UPLOAD_BASE_URL", GEMINI_UPLOAD_BASE_URL) # e.g. http://127.0.0.1:8765 for upload_server.py
+UPLOAD_MAX_RETRIES = 8 # Per chunk, with exponential backoff
+
+# --- Bulk Report Export Settings ---
+REPORT_EXPORT_WORKERS = max(1, (os.cpu_count() or 2) // 2) # Render processes (matplotlib is CPU-bound)
+REPORT_EXPORT_DIR = os.path.join(tempfile.gettempdir(), "scout_eye_reports")
+REPORT_EXPORT_MAX_AGE_S = 24 * 3600 # Exports left behind by ended sessions are removed at startup after this
+
+# --- Local Pose Estimation Settings (Star page biomechanics measured on this server's CPU) ---
+BIOMECHANICS_BACKEND_LOCAL = "local" # Pose estimation on sampled frames, no Gemini call
+BIOMECHANICS_BACKEND_GEMINI = "gemini"
+BIOMECHANICS_BACKEND_AUTO = "auto" # Local first; Gemini when the pose model is missing or sees too little
+BIOMECHANICS_BACKENDS = (BIOMECHANICS_BACKEND_AUTO, BIOMECHANICS_BACKEND_LOCAL, BIOMECHANICS_BACKEND_GEMINI)
+BIOMECHANICS_BACKEND = os.environ.get("SCOUT_EYE_BIOMECHANICS_BACKEND", BIOMECHANICS_BACKEND_AUTO)
+POSE_ESTIMATOR_NAME = os.environ.get("SCOUT_EYE_POSE_ESTIMATOR", "mediapipe") # Key of POSE_ESTIMATORS
+BIOMECHANICS_BACKEND_LABELS_AR = {
+    BIOMECHANICS_BACKEND_AUTO: "تلقائي (محلي أولاً ثم Gemini)",
+    BIOMECHANICS_BACKEND_LOCAL: "محلي فقط (تقدير الوضعيات على الخادم)",
+    BIOMECHANICS_BACKEND_GEMINI: "Gemini فقط",
+}
+POSE_SAMPLE_FPS = 15.0 # Frames per second of video given to the pose model
+POSE_MAX_FRAMES = 900
+POSE_FRAME_MAX_SIDE = 640 # Frames are downscaled to this before pose estimation
+POSE_MODEL_COMPLEXITY = 1 # MediaPipe: 0 fastest, 2 most accurate
+POSE_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Frames estimated at once, shared by all sessions
+POSE_MIN_DETECTED_SHARE = 0.5 # Clips where fewer sampled frames show a body go to Gemini (auto backend)
+POSE_MIN_STEPS = 2
+POSE_RISK_LEVELS_AR = ((1, "منخفض"), (3, "متوسط"), (5, "مرتفع")) # (highest risk score, level)
+
+# --- Player History Settings (persistent, shared by all sessions of this server process) ---
+HISTORY_DIR = os.environ.get("SCOUT_EYE_HISTORY_DIR", "scout_eye_history")
+HISTORY_AGE_GROUP_CODES = {AGE_GROUP_5_8: "5-8", AGE_GROUP_8_PLUS: "8-plus"} # ASCII partition directory names
+
+# --- Near-Duplicate Video Detection Settings ---
+NEAR_DUP_SAMPLE_INTERVAL_S = 1.0 # One frame hash per second of video
+NEAR_DUP_MAX_FRAMES = 120
+NEAR_DUP_FRAME_MAX_HAMMING = 10 # Of 64 bits: frames this close count as the same frame
+NEAR_DUP_MIN_SIMILARITY = 0.8 # Share of matching frames needed to call two clips near-duplicates
+NEAR_DUP_MIN_DURATION_RATIO = 0.5 # Trimmed copies must keep at least half the duration
+NEAR_DUP_INDEX_PATH = os.environ.get("SCOUT_EYE_NEAR_DUP_INDEX", os.path.join(HISTORY_DIR, "near_duplicates.jsonl")) # Kept with the player history
+NEAR_DUP_MAX_ENTRIES = 5000 # Analysed videos kept; the least recently analysed are forgotten first
+NEAR_DUP_FINGERPRINT_MEMO = 256 # Fingerprints of recent uploads kept in memory, analysed or not
+NEAR_DUP_FINGERPRINT_WORKERS = 2 # Background threads decoding uploads for their fingerprint, shared by all sessions
+NEAR_DUP_POLL_INTERVAL_S = 1.0 # How often the page checks whether a background fingerprint is ready
+NEAR_DUP_PENDING = object() # find_previous_results while the fingerprint is still being computed
+
+# --- Session Video Store Settings (shared by all sessions of this server process) ---
+VIDEO_STORE_MEMORY_BUDGET_BYTES = 512 * 1024 ** 2 # Videos kept in RAM before spilling to disk (Streamlit's own copy held by the uploader widget is not counted)
+VIDEO_STORE_DISK_BUDGET_BYTES = 20 * 1024 ** 3 # Spilled videos kept on disk before LRU deletion
+VIDEO_STORE_DIR = os.path.join(tempfile.gettempdir(), "scout_eye_video_store")
+
+# --- Gemini Backend Settings (set via environment, e.g. SCOUT_EYE_GEMINI_BACKEND=replay) ---
+GEMINI_MODE_LIVE = "live"
+GEMINI_MODE_RECORD = "record"
+GEMINI_MODE_REPLAY = "replay"
+GEMINI_BACKEND_MODES = (GEMINI_MODE_LIVE, GEMINI_MODE_RECORD, GEMINI_MODE_REPLAY)
+GEMINI_BACKEND_MODE = os.environ.get("SCOUT_EYE_GEMINI_BACKEND", GEMINI_MODE_LIVE)
+GEMINI_CASSETTE_PATH = os.environ.get("SCOUT_EYE_GEMINI_CASSETTE", "gemini_cassette.jsonl")
+GEMINI_REPLAY_LATENCY = os.environ.get("SCOUT_EYE_REPLAY_LATENCY", "0") == "1" # Sleep for the recorded latency in replay
+# Stand-in for the Gemini API as "module:factory", called instead of the network in live/record mode
+# (e.g. load_test:FakeGeminiService, which load_test.py sets). Empty: the real API.
+GEMINI_SERVICE = os.environ.get("SCOUT_EYE_GEMINI_SERVICE", "")
+GEMINI_USES_API = GEMINI_BACKEND_MODE != GEMINI_MODE_REPLAY and not GEMINI_SERVICE # False: no call may reach the network
+
+# --- Gemini Client Transport Settings (live/record modes; server-wide, set via SCOUT_EYE_GEMINI_TRANSPORT at start) ---
+GEMINI_TRANSPORT_GRPC = "grpc"
+GEMINI_TRANSPORT_REST = "rest"
+GEMINI_TRANSPORTS = (GEMINI_TRANSPORT_GRPC, GEMINI_TRANSPORT_REST)
+GEMINI_TRANSPORT = os.environ.get("SCOUT_EYE_GEMINI_TRANSPORT", GEMINI_TRANSPORT_GRPC)
+GEMINI_HTTP_POOL_SIZE = 32 # REST keep-alive connections kept open, about one per concurrent call
+GEMINI_WARMUP_ON_START = os.environ.get("SCOUT_EYE_GEMINI_WARMUP", "1") == "1" # Open the connection before the first scout needs it
+GEMINI_TRANSPORT_PROBE_SAMPLES = 5 # Warm round trips per transport when measuring, after one cold call
+GEMINI_TRANSPORT_PROBE_TIMEOUT_S = 10.0
+GEMINI_TRANSPORT_LATENCY_WINDOW = 200 # Recent generate_content latencies kept per (transport, task)
+
+# --- Prompt Compaction Settings (same instructions in fewer input tokens) ---
+# Off until replayed cassettes show the same outputs with and without compaction: prompts are sent as written
+PROMPT_COMPACTION = os.environ.get("SCOUT_EYE_PROMPT_COMPACTION", "0") == "1" # "1" compacts the biomechanics prompts
+PROMPT_COMPACTION_SKILLS = PROMPT_COMPACTION and os.environ.get("SCOUT_EYE_COMPACT_SKILL_PROMPTS", "0") == "1" # Skill prompts need both
+PROMPT_EXAMPLE_HEADER = "**مثال للتنسيق المطلوب:**" # Worked examples start here; dropped where a response schema enforces the format
+
+# --- Gemini Client Layer (transport, pooled connections, warm-up) ---
+def _api_model_name(model_name):
+    return model_name if model_name.startswith("models/") else f"models/{model_name}"
+
+
+class GeminiClientLayer:
+    """
+    Process-wide Gemini client configuration: an explicit gRPC or REST transport, one shared
+    keep-alive connection for every session and thread, a warm-up call so the first scout
+    does not pay for TLS and connection setup, latency samples per transport and token usage per task.
+    gRPC multiplexes every call over one HTTP/2 channel; the REST session gets a connection
+    pool sized for the concurrent calls (requests keeps only 10 connections by default).
+    """
+    def __init__(self, api_key, transport):
+        self.api_key = api_key
+        self.transport = None
+        self.warmups = {} # transport -> {"seconds": float|None, "error": str|None}
+        self._lock = threading.Lock()
+        self._latencies = {} # (transport, task) -> recent generate_content latencies
+        self._tokens = {} # task -> [calls, prompt tokens, output tokens]
+        self.configure(transport)
+
+    def configure(self, transport):
+        """(Re)configures the SDK's shared clients for a transport. Model handles built before keep their old client."""
+        if transport not in GEMINI_TRANSPORTS:
+            raise ValueError(f"Unknown Gemini transport '{transport}'. Use one of {GEMINI_TRANSPORTS}.")
+        genai.configure(api_key=self.api_key, transport=transport)
+        if transport == GEMINI_TRANSPORT_REST:
+            self._pool_rest_session(get_default_generative_client())
+        self.transport = transport
+        logging.info(f"Gemini client configured for {transport} transport.")
+
+    @staticmethod
+    def _pool_rest_session(client):
+        """Mounts a keep-alive pool with room for every concurrent call on a REST client's session."""
+        session = getattr(client.transport, "_session", None)
+        if session is None:
+            logging.warning("Gemini REST client exposes no HTTP session; keeping the default connection pool.")
+            return
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=GEMINI_HTTP_POOL_SIZE))
+
+    def warm_up(self, model_name):
+        """One count_tokens round trip (nothing generated) to open the shared connection; skipped in replay or on a stand-in service."""
+        transport = self.transport
+        if not GEMINI_USES_API:
+            logging.info(f"Gemini {transport} warm-up skipped: {GEMINI_BACKEND_MODE} mode serves responses without the API.")
+            return
+        start_time = time.perf_counter()
+        try:
+            genai.GenerativeModel(model_name).count_tokens("ping")
+            self.warmups[transport] = {"seconds": time.perf_counter() - start_time, "error": None}
+            logging.info(f"Gemini {transport} connection warmed up in {self.warmups[transport]['seconds']:.2f}s.")
+        except Exception as e:
+            self.warmups[transport] = {"seconds": None, "error": str(e)}
+            logging.warning(f"Gemini {transport} warm-up failed: {e}")
+
+    def record(self, task, seconds, usage=None):
+        with self._lock:
+            self._latencies.setdefault((self.transport, task), deque(maxlen=GEMINI_TRANSPORT_LATENCY_WINDOW)).append(seconds)
+            if usage is not None:
+                totals = self._tokens.setdefault(task, [0, 0, 0])
+                totals[0] += 1
+                totals[1] += usage.prompt_token_count
+                totals[2] += usage.candidates_token_count
+
+    def token_rows(self):
+        """Average prompt (video included) and output tokens per generate_content call, per task."""
+        with self._lock:
+            totals_by_task = {task: list(totals) for task, totals in self._tokens.items()}
+        return [
+            {"task": task, "calls": calls, "prompt tokens / call": round(prompt_tokens / calls), "output tokens / call": round(output_tokens / calls, 1)}
+            for task, (calls, prompt_tokens, output_tokens) in sorted(totals_by_task.items())
+        ]
+
+    def latency_rows(self):
+        """Calls, p50 and p90 of recent generate_content latencies per (transport, task)."""
+        with self._lock:
+            samples_by_key = {key: sorted(samples) for key, samples in self._latencies.items()}
+        return [
+            {"transport": transport, "task": task, "calls": len(samples),
+             "p50 s": round(samples[int(0.5 * (len(samples) - 1))], 2), "p90 s": round(samples[int(0.9 * (len(samples) - 1))], 2)}
+            for (transport, task), samples in sorted(samples_by_key.items())
+        ]
+
+    def probe(self, model_name, samples=GEMINI_TRANSPORT_PROBE_SAMPLES):
+        """
+        Times count_tokens round trips on a fresh client per transport: the first (cold) call
+        includes connection and TLS setup, the others reuse the kept-alive connection.
+        Nothing is sent in replay or on a stand-in service; every row then says so.
+        """
+        if not GEMINI_USES_API:
+            return [{"transport": transport, "cold s": None, "warm p50 s": None, "warm max s": None,
+                     "error": "skipped: the backend does not call the Gemini API"} for transport in GEMINI_TRANSPORTS]
+        request = glm.CountTokensRequest(model=_api_model_name(model_name), contents=[glm.Content(parts=[glm.Part(text="ping")])])
+        rows = []
+        for transport in GEMINI_TRANSPORTS:
+            try:
+                client = glm.GenerativeServiceClient(transport=transport, client_options={"api_key": self.api_key})
+                if transport == GEMINI_TRANSPORT_REST:
+                    self._pool_rest_session(client)
+                timings = []
+                for _ in range(samples + 1):
+                    start_time = time.perf_counter()
+                    client.count_tokens(request=request, retry=None, timeout=GEMINI_TRANSPORT_PROBE_TIMEOUT_S)
+                    timings.append(time.perf_counter() - start_time)
+                warm = sorted(timings[1:])
+                rows.append({"transport": transport, "cold s": round(timings[0], 3), "warm p50 s": round(warm[int(0.5 * (len(warm) - 1))], 3),
+                             "warm max s": round(warm[-1], 3), "error": ""})
+            except Exception as e:
+                logging.warning(f"Gemini {transport} transport probe failed: {e}")
+                rows.append({"transport": transport, "cold s": None, "warm p50 s": None, "warm max s": None, "error": str(e)})
+        logging.info(f"Gemini transport probe: {rows}")
+        return rows
+
+
+@st.cache_resource
+def get_gemini_client_layer(api_key):
+    """Configures the Gemini client once per server process and warms it up in the background."""
+    layer = GeminiClientLayer(api_key, GEMINI_TRANSPORT)
+    if GEMINI_WARMUP_ON_START and GEMINI_USES_API:
+        threading.Thread(target=layer.warm_up, args=(MODEL_NAME,), name="scout_gemini_warmup", daemon=True).start()
+    return layer
+
 
 # --- Gemini API Configuration ---
+api_key = None # Also used by the resumable uploader in live/record mode
+gemini_client = None # GeminiClientLayer in live/record mode
 try:
-    api_key = st.secrets["GEMINI_API_KEY"]
-    genai.configure(api_key=api_key)
-    logging.info("Gemini API Key loaded successfully.")
+    if GEMINI_BACKEND_MODE not in GEMINI_BACKEND_MODES:
+        raise ValueError(f"Unknown SCOUT_EYE_GEMINI_BACKEND '{GEMINI_BACKEND_MODE}'. Use one of {GEMINI_BACKEND_MODES}.")
+    if not GEMINI_USES_API:
+        logging.info(f"Gemini {GEMINI_BACKEND_MODE} mode{f' on {GEMINI_SERVICE}' if GEMINI_SERVICE else ''}: responses are served locally, no API key needed.")
+    else:
+        if GEMINI_TRANSPORT not in GEMINI_TRANSPORTS:
+            raise ValueError(f"Unknown SCOUT_EYE_GEMINI_TRANSPORT '{GEMINI_TRANSPORT}'. Use one of {GEMINI_TRANSPORTS}.")
+        api_key = st.secrets["GEMINI_API_KEY"]
+        gemini_client = get_gemini_client_layer(api_key)
+        logging.info("Gemini API Key loaded successfully.")
 except KeyError:
     st.error("❗️ لم يتم العثور على مفتاح Gemini API في أسرار Streamlit. الرجاء إضافة `GEMINI_API_KEY`.")
     st.stop()
@@ -128,59 +378,496 @@ except Exception as e:
     logging.error(f"Gemini API configuration failed: {e}")
     st.stop()
 
+# --- Gemini Backend (live / record / replay) ---
+class ReplayMissError(KeyError):
+    """Raised in replay mode when the cassette has no recording for a request."""
+
+
+class _ReplayFile:
+    """Stand-in for a genai File in replay mode (always ACTIVE)."""
+    def __init__(self, name, display_name):
+        self.name = name
+        self.display_name = display_name
+        self.uri = f"replay://{name}"
+        self.state = SimpleNamespace(name="ACTIVE")
+
+
+class _ReplayResponse:
+    """Stand-in for a GenerateContentResponse (or one streamed chunk) rebuilt from the cassette."""
+    def __init__(self, text, usage=None):
+        self.text = text or ""
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=self.text)]))] if text else []
+        self.usage_metadata = SimpleNamespace(**usage) if usage else None
+        self.prompt_feedback = None
+
+
+def _usage_to_dict(usage_metadata):
+    if not usage_metadata:
+        return None
+    return {field: getattr(usage_metadata, field, 0) for field in ("prompt_token_count", "candidates_token_count", "total_token_count")}
+
+
+def _response_text(response):
+    try:
+        return response.text if response.candidates and response.candidates[0].content.parts else None
+    except Exception:
+        return None # Blocked or empty candidate: record it as an empty response
+
+
+class GeminiBackend:
+    """
+    Single entry point for every Gemini call the app makes.
+    live:   calls the API directly (default).
+    record: calls the API and appends request fingerprint, response text, usage metadata
+            and observed latency to a JSON Lines cassette.
+    replay: serves responses from the cassette with no network, optionally sleeping for the
+            recorded latency so runs can be benchmarked offline.
+    Requests are fingerprinted by model name, generation config, prompt text and the SHA-256
+    of any uploaded video, so recordings survive re-uploads under new file names.
+    Live and record uploads go through the resumable uploader in chunks, reporting progress.
+    service, if given, stands in for the Gemini API in live and record mode: an object with
+    upload_file, get_file, delete_file and generate_content(gemini_model, contents, stream,
+    request_options), like load_test.FakeGeminiService.
+    """
+    def __init__(self, mode, cassette_path, replay_latency=False, uploader=None, service=None):
+        if mode not in GEMINI_BACKEND_MODES:
+            raise ValueError(f"Unknown Gemini backend mode '{mode}'. Use one of {GEMINI_BACKEND_MODES}.")
+        self.mode = mode
+        self.cassette_path = cassette_path
+        self.replay_latency = replay_latency
+        self.uploader = uploader or ResumableUploader()
+        self.service = service
+        self._lock = threading.Lock()
+        self._file_hashes = {} # Gemini file name -> SHA-256 of the uploaded video
+        self._recordings = {} # fingerprint -> [record, ...]
+        self._replay_counters = {} # fingerprint -> next recording to serve
+        if mode in (GEMINI_MODE_RECORD, GEMINI_MODE_REPLAY) and os.path.exists(cassette_path):
+            with open(cassette_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._recordings.setdefault(record["fingerprint"], []).append(record)
+            logging.info(f"Gemini cassette '{cassette_path}' loaded: {sum(len(r) for r in self._recordings.values())} recordings.")
+        if mode == GEMINI_MODE_REPLAY and not self._recordings:
+            logging.warning(f"Replay mode with an empty or missing cassette '{cassette_path}'. Every Gemini call will fail.")
+
+    # --- Cassette helpers ---
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _fingerprint(self, kind, payload):
+        return hashlib.sha256(json.dumps({"kind": kind, **payload}, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+    def _generate_fingerprint(self, gemini_model, contents):
+        parts = []
+        for part in (contents if isinstance(contents, list) else [contents]):
+            if isinstance(part, str):
+                parts.append({"text": part})
+            else: # Uploaded file: identify it by content, not by its per-upload name
+                parts.append({"file_sha256": self._file_hashes.get(part.name, part.name)})
+        return self._fingerprint("generate_content", {
+            "model": gemini_model.model_name,
+            "generation_config": dict(getattr(gemini_model, "_generation_config", None) or {}),
+            "contents": parts,
+        })
+
+    def _append(self, record):
+        with self._lock:
+            self._recordings.setdefault(record["fingerprint"], []).append(record)
+            with open(self.cassette_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _replay(self, fingerprint, description):
+        with self._lock:
+            records = self._recordings.get(fingerprint)
+            if not records:
+                raise ReplayMissError(f"No recording in '{self.cassette_path}' for {description} (fingerprint {fingerprint[:12]}).")
+            index = self._replay_counters.get(fingerprint, 0)
+            self._replay_counters[fingerprint] = index + 1
+            return records[index % len(records)] # Cycle through repeated recordings of the same request
+
+    # --- File API ---
+    def _upload_chunked(self, path, display_name, on_progress, should_stop):
+        if self.service is not None:
+            return self.service.upload_file(path, display_name, on_progress=on_progress, should_stop=should_stop)
+        file_resource = self.uploader.upload(path, display_name, on_progress=on_progress, should_stop=should_stop)
+        return genai.get_file(file_resource["name"])
+
+    def upload_file(self, path, display_name, on_progress=None, should_stop=None):
+        """on_progress(bytes_sent, total_bytes) is called from the uploading thread after each chunk."""
+        if self.mode == GEMINI_MODE_LIVE:
+            return self._upload_chunked(path, display_name, on_progress, should_stop)
+        content_hash = self._hash_file(path)
+        fingerprint = self._fingerprint("upload_file", {"file_sha256": content_hash})
+        if self.mode == GEMINI_MODE_REPLAY:
+            record = self._replay(fingerprint, f"upload of '{display_name}'")
+            if self.replay_latency: time.sleep(record["latency_s"])
+            if on_progress: on_progress(os.path.getsize(path), os.path.getsize(path))
+            replay_file = _ReplayFile(f"files/replay-{content_hash[:16]}", display_name)
+            self._file_hashes[replay_file.name] = content_hash
+            return replay_file
+        start_time = time.time()
+        uploaded_file = self._upload_chunked(path, display_name, on_progress, should_stop)
+        self._file_hashes[uploaded_file.name] = content_hash
+        self._append({"fingerprint": fingerprint, "kind": "upload_file", "latency_s": time.time() - start_time})
+        return uploaded_file
+
+    def get_file(self, name):
+        if self.mode == GEMINI_MODE_REPLAY:
+            return _ReplayFile(name, name)
+        return (self.service or genai).get_file(name)
+
+    def delete_file(self, name):
+        if self.mode == GEMINI_MODE_REPLAY:
+            return # Replay file names are derived from content, so keep the name -> hash mapping
+        (self.service or genai).delete_file(name)
+
+    # --- Generation ---
+    def _generate_live(self, gemini_model, contents, stream, request_options):
+        if self.service is not None:
+            return self.service.generate_content(gemini_model, contents, stream=stream, request_options=request_options)
+        return gemini_model.generate_content(contents, stream=stream, request_options=request_options)
+
+    def generate_content(self, gemini_model, contents, stream=False, request_options=None):
+        if self.mode == GEMINI_MODE_LIVE:
+            return self._generate_live(gemini_model, contents, stream, request_options)
+        fingerprint = self._generate_fingerprint(gemini_model, contents)
+        if self.mode == GEMINI_MODE_REPLAY:
+            record = self._replay(fingerprint, f"generate_content on '{gemini_model.model_name}'")
+            if stream:
+                return self._replay_stream(record)
+            if self.replay_latency: time.sleep(record["latency_s"])
+            return _ReplayResponse("".join(chunk["text"] or "" for chunk in record["chunks"]), record["usage"])
+        start_time = time.time()
+        response = self._generate_live(gemini_model, contents, stream, request_options)
+        if stream:
+            return self._record_stream(fingerprint, gemini_model.model_name, start_time, response)
+        self._append({
+            "fingerprint": fingerprint, "kind": "generate_content", "model": gemini_model.model_name,
+            "chunks": [{"text": _response_text(response), "offset_s": time.time() - start_time}],
+            "usage": _usage_to_dict(response.usage_metadata), "latency_s": time.time() - start_time,
+        })
+        return response
+
+    def _record_stream(self, fingerprint, model_name, start_time, response):
+        chunks, usage = [], None
+        for chunk in response:
+            chunks.append({"text": _response_text(chunk), "offset_s": time.time() - start_time})
+            usage = _usage_to_dict(getattr(chunk, "usage_metadata", None)) or usage
+            yield chunk
+        self._append({
+            "fingerprint": fingerprint, "kind": "generate_content", "model": model_name,
+            "chunks": chunks, "usage": usage, "latency_s": time.time() - start_time,
+        })
+
+    def _replay_stream(self, record):
+        elapsed = 0.0
+        for i, chunk_record in enumerate(record["chunks"]):
+            if self.replay_latency:
+                time.sleep(max(0.0, chunk_record["offset_s"] - elapsed))
+                elapsed = chunk_record["offset_s"]
+            yield _ReplayResponse(chunk_record["text"], record["usage"] if i == len(record["chunks"]) - 1 else None)
+
+
+def load_gemini_service(spec):
+    """Builds the stand-in Gemini service named "module:factory" (GEMINI_SERVICE), or None for the real API."""
+    if not spec:
+        return None
+    module_name, _, factory_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), factory_name)()
+
+
+@st.cache_resource
+def get_gemini_backend():
+    """One Gemini backend (and cassette) per server process."""
+    uploader = ResumableUploader(UPLOAD_BASE_URL, api_key=api_key, chunk_size=UPLOAD_CHUNK_SIZE_BYTES, max_retries=UPLOAD_MAX_RETRIES)
+    backend = GeminiBackend(GEMINI_BACKEND_MODE, GEMINI_CASSETTE_PATH, replay_latency=GEMINI_REPLAY_LATENCY,
+                            uploader=uploader, service=load_gemini_service(GEMINI_SERVICE))
+    logging.info(f"Gemini backend mode: {backend.mode} (cassette: {backend.cassette_path}, service: {GEMINI_SERVICE or 'Gemini API'})")
+    return backend
+
+gemini_backend = get_gemini_backend()
+
+
 # --- Gemini Model Setup ---
 if "model_name" not in st.session_state:
     # Default to your usual model name, e.g. "models/gemini-1.5-pro"
     st.session_state.model_name = "models/gemini-1.5-pro"
     
+DEFAULT_GENERATION_CONFIG = {
+     "temperature": 0.2, # Slightly higher for more descriptive potential but still controlled
+     "top_p": 1,
+     "top_k": 1,
+     "max_output_tokens": 800, # Increased significantly for the list output
+     # "response_mime_type": "application/json", # Could try this for structured output later
+}
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+# Per-task generation profiles (keyed by the task names the hedger and latency stats use).
+# Each keeps DEFAULT_GENERATION_CONFIG's greedy sampling (top_k=1), so bounding the output does not change answers.
+STEP_SERIES_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "steps": {"type": "ARRAY", "items": {
+            "type": "OBJECT",
+            "properties": {"side": {"type": "STRING", "enum": ["R", "L"]}, **{field: {"type": "NUMBER", "nullable": True} for field in STEP_RESPONSE_FIELDS}},
+            "required": ["t", "side"],
+        }},
+        **{key: {"type": "STRING"} for key in STEP_MODEL_METRICS_EN}, # Numbers, or 'غير واضح'
+        "Risk_Level": {"type": "STRING", "enum": ["منخفض", "متوسط", "مرتفع", NOT_CLEAR_AR]},
+    },
+    "required": ["steps", *STEP_MODEL_METRICS_EN],
+}
+GENERATION_PROFILES = {
+    # One digit, constrained to the valid scores
+    "skill": {**DEFAULT_GENERATION_CONFIG, "max_output_tokens": 2, "response_mime_type": "text/x.enum",
+              "response_schema": {"type": "STRING", "enum": [str(score) for score in range(MAX_SCORE_PER_SKILL + 1)]}},
+    # 13 numbered lines, kept as text so each line can be shown as soon as it streams in. Keeps the full
+    # 800-token cap: Arabic tokenizes densely, and a verbose reply cut short would lose Risk_Level/Risk_Score
+    "biomechanics": {**DEFAULT_GENERATION_CONFIG},
+    # Schema-bound JSON; room for ~80 steps (the shared 800-token cap cut long clips short)
+    "biomechanics_steps": {**DEFAULT_GENERATION_CONFIG, "max_output_tokens": 4096, "response_mime_type": "application/json",
+                           "response_schema": STEP_SERIES_RESPONSE_SCHEMA},
+}
+THINKING_MODEL_MARKERS = ("gemini-2.5",) # Their thinking tokens count against max_output_tokens, so tight caps are not applied
+
+
+def generation_config_for(model_name, task):
+    """The generation config for a task on a model (the default config for tasks without a profile)."""
+    config = dict(GENERATION_PROFILES.get(task, DEFAULT_GENERATION_CONFIG))
+    if any(marker in model_name for marker in THINKING_MODEL_MARKERS):
+        config["max_output_tokens"] = max(config["max_output_tokens"], DEFAULT_GENERATION_CONFIG["max_output_tokens"])
+    return config
+
+
+class GeminiModelPool:
+    """
+    Process-wide, thread-safe pool of GenerativeModel handles keyed by (model name, generation config).
+    Handles are immutable once built, so one handle is shared by every session and worker thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._configs = {} # id(handle) -> generation config it was built with
+
+    @staticmethod
+    def _key(model_name, generation_config):
+        return (model_name, json.dumps(generation_config, sort_keys=True, default=str))
+
+    def get(self, model_name, generation_config=None):
+        config = dict(DEFAULT_GENERATION_CONFIG if generation_config is None else generation_config)
+        key = self._key(model_name, config)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=config,
+                    safety_settings=SAFETY_SETTINGS
+                )
+                self._handles[key] = handle
+                self._configs[id(handle)] = config
+                logging.info(f"Gemini Model '{model_name}' handle created with MINIMUM safety settings (BLOCK_NONE). Pool size: {len(self._handles)}")
+        return handle
+
+    def variant(self, handle, model_name):
+        """Returns the pooled handle for another model with the same generation config as `handle`."""
+        with self._lock:
+            config = self._configs.get(id(handle))
+        return self.get(model_name, config)
+
+    def for_task(self, handle, task):
+        """Returns the pooled handle for the same model with the generation profile of `task`."""
+        return self.get(handle.model_name, generation_config_for(handle.model_name, task))
+
+    def warm(self, model_names):
+        for model_name in model_names:
+            try:
+                self.get(model_name)
+                for task in GENERATION_PROFILES:
+                    self.get(model_name, generation_config_for(model_name, task))
+            except Exception as e:
+                logging.warning(f"Could not warm Gemini model handle '{model_name}': {e}")
+
+    def size(self):
+        with self._lock:
+            return len(self._handles)
+
+
 @st.cache_resource
-def load_gemini_model(model_name):
-    """Loads the Gemini model with specific configurations."""
+def get_model_pool():
+    """One model pool per server process, warmed for the configured models."""
+    pool = GeminiModelPool()
+    pool.warm(WARM_MODEL_NAMES)
+    return pool
+
+
+def load_gemini_model(model_name, generation_config=None):
+    """Returns the shared Gemini model handle for this name/config from the process pool."""
     try:
-        # Increased output tokens for biomechanics list
-        generation_config = {
-             "temperature": 0.2, # Slightly higher for more descriptive potential but still controlled
-             "top_p": 1,
-             "top_k": 1,
-             "max_output_tokens": 800, # Increased significantly for the list output
-             # "response_mime_type": "application/json", # Could try this for structured output later
-        }
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ]
-        model = genai.GenerativeModel(
-            model_name=model_name,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        logging.info(f"Gemini Model '{MODEL_NAME}' loaded with MINIMUM safety settings (BLOCK_NONE).")
-        return model
+        return get_model_pool().get(model_name, generation_config)
     except Exception as e:
-        st.error(f"❗️ فشل تحميل نموذج Gemini '{MODEL_NAME}': {e}")
+        st.error(f"❗️ فشل تحميل نموذج Gemini '{model_name}': {e}")
         logging.error(f"Gemini model loading failed: {e}")
         return None
 
-model = load_gemini_model(st.session_state.model_name)
-if not model:
+
+def task_model(gemini_model, task):
+    """The pooled handle for gemini_model's model with the generation profile of task (see GENERATION_PROFILES)."""
+    return get_model_pool().for_task(gemini_model, task)
+
+session_model = load_gemini_model(st.session_state.model_name)
+if not session_model:
     st.stop()
     
-def test_gemini_connection(chosen_model=None):
+# --- Fair-Share Gemini Scheduler (one per server process, used by the hedger and every analysis call) ---
+@st.cache_resource
+def get_gemini_scheduler():
+    """One scheduler per server process: all sessions share the API key's quota."""
+    return FairShareScheduler(SCHEDULER_MAX_CONCURRENT_CALLS, SCHEDULER_REQUESTS_PER_MINUTE, SCHEDULER_BURST,
+                              quota_cooldown_s=SCHEDULER_QUOTA_COOLDOWN_S)
+
+
+# --- Request Hedging (cuts tail latency of generate_content) ---
+class RequestHedger:
     """
-    Test basic Gemini API connectivity with a simple text prompt.
-    chosen_model can override the default if you want.
+    Sends a duplicate generate_content call when the first one has not returned by the
+    observed p90 latency for that model and task, to the same model or a fallback model.
+    The first valid answer wins; a loser that has not started is cancelled, and one already
+    in flight is abandoned (the sync client cannot abort it) with its answer discarded.
+    Hedges are paid from a budget that grows by HEDGE_BUDGET_RATIO per call, capped at
+    HEDGE_BUDGET_BURST, so at most that share of calls is ever duplicated.
+    generate_content runs inside the primary's admitted scheduler call; the duplicate is
+    admitted separately, so it also takes a quota token and a concurrency slot.
     """
-    try:
-        # If you wanted to re-initialize the model with chosen_model:
-        # if chosen_model:
-        #     test_model = genai.GenerativeModel(model_name=chosen_model, ...)
-        # else:
-        #     test_model = model  # use your existing global 'model'
+    def __init__(self, model_pool, scheduler):
+        self.enabled = HEDGING_ENABLED_DEFAULT
+        self.fallback_model_name = HEDGE_FALLBACK_MODEL_NAME # None: hedge to the same model
+        self._model_pool = model_pool
+        self._scheduler = scheduler
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="scout_hedge")
+        self._lock = threading.Lock()
+        self._latencies = {} # (model name, task) -> recent successful latencies
+        self._budget = HEDGE_BUDGET_BURST
+        self.counters = {"calls": 0, "fired": 0, "won": 0, "skipped_budget": 0}
+
+    def hedge_delay(self, model_name, task):
+        """Observed p90 latency for this model and task (a fixed default until enough samples)."""
+        with self._lock:
+            samples = sorted(self._latencies.get((model_name, task), ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_S
+        return samples[int(0.9 * (len(samples) - 1))]
+
+    def _timed_call(self, gemini_model, contents, task, request_options):
+        start_time = time.time()
+        response = gemini_backend.generate_content(gemini_model, contents, request_options=request_options)
+        with self._lock:
+            self._latencies.setdefault((gemini_model.model_name, task), deque(maxlen=HEDGE_LATENCY_WINDOW)).append(time.time() - start_time)
+        if gemini_client:
+            gemini_client.record(task, time.time() - start_time, getattr(response, "usage_metadata", None))
+        return response
+
+    def _take_budget(self):
+        with self._lock:
+            if self._budget >= 1:
+                self._budget -= 1
+                self.counters["fired"] += 1
+                return True
+            self.counters["skipped_budget"] += 1
+            return False
+
+    def _admitted_call(self, hedge_deadline, gemini_model, contents, task, request_options):
+        """The duplicate call, once the scheduler admits it; gives up while queued if its token is cancelled."""
+        ticket = self._scheduler.admit(hedge_deadline, "hedge")
+        try:
+            return self._scheduler.call(ticket, self._timed_call, gemini_model, contents, task, request_options)
+        finally:
+            self._scheduler.release_unless_started(ticket)
+
+    @staticmethod
+    def _is_usable(future, is_valid):
+        return future.exception() is None and is_valid(future.result())
+
+    def generate_content(self, gemini_model, contents, task, request_options=None, is_valid=lambda response: True, deadline=None):
+        """deadline: the calling evaluation's; the hedge queues under its owner and priority and stops with it."""
+        with self._lock:
+            self.counters["calls"] += 1
+            self._budget = min(HEDGE_BUDGET_BURST, self._budget + HEDGE_BUDGET_RATIO)
+        if not self.enabled:
+            return self._timed_call(gemini_model, contents, task, request_options)
+
+        delay_s = self.hedge_delay(gemini_model.model_name, task)
+        primary = self._executor.submit(self._timed_call, gemini_model, contents, task, request_options)
+        done, _ = wait([primary], timeout=delay_s)
+        if done or not self._take_budget():
+            return primary.result() # Fast enough (or failed fast, or no budget): no duplicate
+
+        hedge_model = self._model_pool.variant(gemini_model, self.fallback_model_name) if self.fallback_model_name else gemini_model
+        logging.info(f"Hedging {task} call on '{gemini_model.model_name}' after {delay_s:.1f}s with '{hedge_model.model_name}'.")
+        deadline = deadline or EvaluationDeadline(EVALUATION_DEADLINE_S)
+        hedge_token = CancellationToken() # Own token: the hedge stops when the primary wins, not the evaluation
+        hedge_deadline = EvaluationDeadline(deadline.remaining(), hedge_token, owner=deadline.owner, priority=deadline.priority)
+        parent_handle = deadline.token.register(lambda: hedge_token.cancel("evaluation cancelled"))
+        hedge = self._executor.submit(self._admitted_call, hedge_deadline, hedge_model, contents, task, request_options)
+        pending = {primary: "primary", hedge: "hedge"}
+        try:
+            while True:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    role = pending.pop(future)
+                    if self._is_usable(future, is_valid) or not pending:
+                        for loser in pending:
+                            loser.cancel()
+                        if role == "hedge" and self._is_usable(future, is_valid):
+                            with self._lock:
+                                self.counters["won"] += 1
+                        return future.result() # Raises if both attempts failed
+        finally:
+            hedge_token.cancel("hedge no longer needed") # A hedge still queued for admission leaves the queue
+            if parent_handle is not None:
+                deadline.token.unregister(parent_handle)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+@st.cache_resource
+def get_request_hedger():
+    """One hedger (latency history, budget and counters) per server process."""
+    return RequestHedger(get_model_pool(), get_gemini_scheduler())
+
+request_hedger = get_request_hedger()
+
+
+def _is_valid_skill_response(response):
+    text = _response_text(response)
+    return bool(text and re.search(r'\d+', text))
+
+
+def _is_valid_biomechanics_response(response):
+    text = _response_text(response)
+    return bool(text and any(parse_biomechanics_line(line) for line in text.split('\n')))
+
 
+def test_gemini_connection(gemini_model):
+    """
+    Test basic Gemini API connectivity with a simple text prompt
+    using the given model handle (e.g. the session's current model).
+    """
+    try:
         test_prompt = "Please respond with the number 5 to test API connectivity."
-        test_response = model.generate_content(test_prompt)
+        test_response = gemini_backend.generate_content(gemini_model, test_prompt)
 
         st.success(f"✅ Gemini API test successful. Response: {test_response.text}")
         logging.info(f"API test successful. Raw response: {test_response}")
@@ -210,8 +897,21 @@ st.markdown("""
 
 # =========== Gemini Interaction Functions ============================
 
+# --- Prompt Compaction (Common) ---
+def compact_prompt(prompt, drop_example=False):
+    """
+    The same instructions in fewer tokens: no indentation, blank lines, runs of spaces or bold
+    markers, and '-' bullets. drop_example also cuts the worked example at the end, for
+    prompts whose output format a response schema already enforces.
+    """
+    if drop_example and PROMPT_EXAMPLE_HEADER in prompt:
+        prompt = prompt[:prompt.index(PROMPT_EXAMPLE_HEADER)]
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in prompt.replace("**", "").splitlines())
+    return "\n".join(re.sub(r"^\*\s", "- ", line) for line in lines if line)
+
+
 # --- Prompt function for Skill Evaluation (Legend Page) ---
-def create_prompt_for_skill(skill_key_en, age_group):
+def create_prompt_for_skill(skill_key_en, age_group, compact=PROMPT_COMPACTION_SKILLS):
     # --- (Code from previous step - no changes needed here) ---
     specific_rubric = "لا توجد معايير محددة لهذه المهارة في هذه الفئة العمرية." # Default
     skill_name_ar = skill_key_en # Default
@@ -322,12 +1022,12 @@ def create_prompt_for_skill(skill_key_en, age_group):
 
     هام جدًا: قم بالرد بالدرجة الرقمية الصحيحة فقط (مثال: "3" أو "5"). لا تقم بتضمين أي شروحات أو أوصاف أو أي نص آخر أو رموز إضافية. فقط الرقم.
     """
-    return prompt
+    return compact_prompt(prompt) if compact else prompt
 
 
 # --- Prompt function for Biomechanics Analysis (Star Page) ---
-def create_prompt_for_biomechanics():
-    """Creates the prompt for the biomechanical analysis."""
+def create_prompt_for_biomechanics(compact=PROMPT_COMPACTION):
+    """Creates the prompt for the biomechanical analysis (the example stays: the list is plain text)."""
     prompt = f"""
 مهمتك هي إجراء تحليل بيوميكانيكي لحركة اللاعب في الفيديو المقدم، مع التركيز على مقاطع الجري أو الحركة الرياضية الواضحة.
 استخرج المقاييس الـ 13 التالية وقدمها **كقائمة مرقمة ودقيقة**. لكل مقياس، قدم القيمة الرقمية المقدرة أو الفئة المطلوبة.
@@ -377,29 +1077,137 @@ def create_prompt_for_biomechanics():
 12. مستوى الخطورة: متوسط
 13. درجة الخطورة: 3
 """
-    return prompt
+    return compact_prompt(prompt) if compact else prompt
+
+
+def create_prompt_for_biomechanics_steps(compact=PROMPT_COMPACTION):
+    """Creates the prompt for the extended analysis: measurements for every step, as compact JSON."""
+    prompt = f"""
+مهمتك هي إجراء تحليل بيوميكانيكي لكل خطوة من خطوات اللاعب في الفيديو المقدم، مع التركيز على مقاطع الجري أو الحركة الرياضية الواضحة.
+بدلاً من المتوسطات، قس كل خطوة واضحة على حدة بالترتيب الزمني، وقدم النتيجة **ككائن JSON واحد فقط** بدون أي نص إضافي.
+
+**الحقول المطلوبة لكل خطوة (داخل القائمة "steps"):**
+*   "t": وقت ملامسة القدم للأرض في هذه الخطوة (بالثواني من بداية الفيديو، رقم عشري)
+*   "side": القدم الملامسة للأرض: "R" لليمنى أو "L" لليسرى
+*   "knee": زاوية ركبة القدم الملامسة أثناء مرحلة الدفع أو الوقوف (بالدرجات)
+*   "contact": زاوية القدم/الساق مع الأرض عند أول تلامس (بالدرجات)
+*   "trunk": ميل الجذع للأمام بالنسبة للعمودي في هذه الخطوة (بالدرجات)
+*   "hip": زاوية ثني الورك في هذه الخطوة (بالدرجات)
+
+**حقول عامة للمقطع كله:**
+*   "Max_Acceleration": تقدير نسبي لأعلى قيمة لتغير السرعة، رقم بدون وحدة (> 500,000 خطر، > 250,000 متوسط)
+*   "Pelvic_Tilt_Avg": متوسط إمالة الحوض بالدرجات (إيجابي للأمامية)
+*   "Thorax_Rotation_Avg": متوسط دوران الصدر بالدرجات
+*   "Risk_Level": 'منخفض' أو 'متوسط' أو 'مرتفع' (زاوية الركبة > 145 أو < 110، عدم التماثل > 15%، ميل الجذع > 15، تردد الخطوات < 1.5 أو > 3 تعتبر معايير خطورة)
+*   "Risk_Score": درجة رقمية من 0 إلى 5 (0=لا خطورة واضحة، 5=خطورة عالية جداً)
+
+**هام جداً:**
+*   إذا لم تتمكن من قياس قيمة في خطوة معينة، اكتب null لهذه القيمة فقط، ولا تحذف الخطوة.
+*   إذا لم تتمكن من تقدير حقل عام، اكتب '{NOT_CLEAR_AR}'.
+*   استخدم الأرقام فقط بدون وحدات، ولا تضف أي شرح خارج كائن JSON.
+
+**مثال للتنسيق المطلوب:**
+{{"steps": [{{"t": 0.42, "side": "R", "knee": 148.2, "contact": 22.1, "trunk": 9.5, "hip": 31.0}}, {{"t": 0.81, "side": "L", "knee": 151.0, "contact": null, "trunk": 10.1, "hip": 29.4}}], "Max_Acceleration": 473953, "Pelvic_Tilt_Avg": -1.8, "Thorax_Rotation_Avg": -30.9, "Risk_Level": "متوسط", "Risk_Score": 3}}
+"""
+    return compact_prompt(prompt, drop_example=True) if compact else prompt # STEP_SERIES_RESPONSE_SCHEMA binds the format
+
+
+def measure_prompt_compaction(model_name):
+    """
+    count_tokens of every prompt before and after compaction (text only: the video costs the
+    same either way), next to each task's output cap before and after its generation profile.
+    Empty when the backend does not call the Gemini API (replay or a stand-in service).
+    """
+    if not GEMINI_USES_API: # Replay and stand-in services must not reach the network
+        logging.info(f"Prompt token measurement skipped: {GEMINI_BACKEND_MODE} mode serves responses without the API.")
+        return []
+    counter = genai.GenerativeModel(model_name)
+    prompts = [
+        ("skill", f"{age_group} / {skill_key}", lambda compact, skill_key=skill_key, age_group=age_group: create_prompt_for_skill(skill_key, age_group, compact))
+        for age_group, skill_keys in ((AGE_GROUP_5_8, SKILLS_AGE_5_8_EN), (AGE_GROUP_8_PLUS, SKILLS_AGE_8_PLUS_EN)) for skill_key in skill_keys
+    ]
+    prompts += [("biomechanics", "biomechanics", create_prompt_for_biomechanics), ("biomechanics_steps", "biomechanics_steps", create_prompt_for_biomechanics_steps)]
+    rows = []
+    for task, prompt_name, build_prompt in prompts:
+        before = counter.count_tokens(build_prompt(compact=False)).total_tokens
+        after = counter.count_tokens(build_prompt(compact=True)).total_tokens
+        rows.append({
+            "task": task, "prompt": prompt_name, "input tokens before": before, "input tokens after": after,
+            "saved %": round((before - after) / before * 100, 1) if before else 0.0,
+            "output cap before": DEFAULT_GENERATION_CONFIG["max_output_tokens"],
+            "output cap after": generation_config_for(model_name, task)["max_output_tokens"],
+        })
+    logging.info(f"Prompt compaction on '{model_name}': {sum(row['input tokens before'] for row in rows)} -> "
+                 f"{sum(row['input tokens after'] for row in rows)} input tokens over {len(rows)} prompts.")
+    return rows
+
+
+# --- Fair-Share Gemini Scheduler (Common) ---
+def scheduled_gemini_call(deadline, stage, status_placeholder, fn, *args, **kwargs):
+    """
+    deadline.run(stage, fn, ...) once the fair-share scheduler admits it, showing the queue
+    position meanwhile. A call refused for quota is queued again instead of failing.
+    With stream=True the returned stream holds the call's slot until it is drained or closed.
+    """
+    scheduler = get_gemini_scheduler()
+    shown_position = [None]
+
+    def show_position(position):
+        if position and position != shown_position[0]:
+            shown_position[0] = position
+            status_placeholder.info(f"⏳ بانتظار دورك في حصة Gemini المشتركة ({stage}): ترتيبك في القائمة {position}")
+
+    for attempt in range(SCHEDULER_QUOTA_RETRIES + 1):
+        ticket = scheduler.admit(deadline, stage, on_queued=show_position)
+        try:
+            if kwargs.get("stream"):
+                return deadline.run(stage, scheduler.call_stream, ticket, fn, *args, on_abandon=lambda stream: stream.close(), **kwargs)
+            return deadline.run(stage, scheduler.call, ticket, fn, *args, **kwargs)
+        except Exception as e:
+            if not is_quota_error(e) or attempt == SCHEDULER_QUOTA_RETRIES:
+                raise
+            logging.warning(f"Quota error for '{stage}' (attempt {attempt + 1}); queueing the call again: {e}")
+            status_placeholder.warning(f"⚠️ تم بلوغ حد الاستخدام المشترك لـ Gemini مؤقتاً. أُعيد طلب '{stage}' إلى قائمة الانتظار...")
+            shown_position[0] = None
+        finally:
+            scheduler.release_unless_started(ticket)
 
 
 # --- Video Upload/Processing Function (Common) ---
-def upload_and_wait_gemini(video_path, display_name="video_upload", status_placeholder=st.empty()):
-    # --- (Code from previous step - no changes needed here) ---
+def upload_and_wait_gemini(video_path, display_name="video_upload", status_placeholder=st.empty(), deadline=None):
+    """
+    Uploads a video and waits for it to become ACTIVE, within the evaluation's deadline.
+    Until it is handed back, the file is deleted if the evaluation is cancelled.
+    """
+    deadline = deadline or EvaluationDeadline(EVALUATION_DEADLINE_S)
     uploaded_file = None
+    cleanup_handle = None
     status_placeholder.info(f"⏳ جاري رفع الفيديو '{os.path.basename(display_name)}'...") # Use display name
-    logging.info(f"Starting upload for {display_name}")
+    logging.info(f"Starting upload for {display_name} ({deadline.remaining():.0f}s left on the deadline)")
+    upload_progress = {"sent": 0, "total": 0} # Written by the uploading thread, drawn by this one
+
+    def show_upload_progress():
+        sent, total = upload_progress["sent"], upload_progress["total"]
+        if total:
+            status_placeholder.progress(min(1.0, sent / total), text=f"📤 جاري رفع '{os.path.basename(display_name)}': {sent / 1024 ** 2:.1f} / {total / 1024 ** 2:.1f} MB")
+
     try:
         safe_display_name = f"upload_{int(time.time())}_{os.path.basename(display_name)}"
-        uploaded_file = genai.upload_file(path=video_path, display_name=safe_display_name)
+        uploaded_file = deadline.run(
+            "رفع الفيديو", gemini_backend.upload_file, path=video_path, display_name=safe_display_name,
+            on_progress=lambda sent, total: upload_progress.update(sent=sent, total=total),
+            should_stop=lambda: deadline.token.cancelled or deadline.remaining() <= 0, # Stop sending chunks nobody will use
+            on_abandon=lambda abandoned_file: gemini_backend.delete_file(abandoned_file.name), on_wait=show_upload_progress
+        )
+        uploaded_file_name = uploaded_file.name
+        cleanup_handle = deadline.token.register(lambda: gemini_backend.delete_file(uploaded_file_name))
         status_placeholder.info(f"📤 اكتمل الرفع لـ '{display_name}'. برجاء الانتظار للمعالجة بواسطة Google...")
         logging.info(f"Upload API call successful for {display_name}, file name: {uploaded_file.name}. Waiting for ACTIVE state.")
 
-        timeout = 300
-        start_time = time.time()
+        processing_deadline = deadline.child(UPLOAD_PROCESSING_TIMEOUT_S)
         while uploaded_file.state.name == "PROCESSING":
-            if time.time() - start_time > timeout:
-                logging.error(f"Timeout waiting for file processing for {uploaded_file.name} ({display_name})")
-                raise TimeoutError(f"انتهت مهلة معالجة الفيديو '{display_name}'. حاول مرة أخرى أو استخدم فيديو أقصر.")
-            time.sleep(15) # Check less frequently
-            uploaded_file = genai.get_file(uploaded_file.name)
+            processing_deadline.sleep("معالجة الفيديو", FILE_POLL_INTERVAL_S) # Check less frequently
+            uploaded_file = processing_deadline.run("معالجة الفيديو", gemini_backend.get_file, uploaded_file.name)
             logging.debug(f"File {uploaded_file.name} ({display_name}) state: {uploaded_file.state.name}")
 
         if uploaded_file.state.name == "FAILED":
@@ -409,17 +1217,21 @@ def upload_and_wait_gemini(video_path, display_name="video_upload", status_place
              logging.error(f"Unexpected file state {uploaded_file.state.name} for {uploaded_file.name} ({display_name})")
              raise ValueError(f"حالة ملف فيديو غير متوقعة: {uploaded_file.state.name} لـ '{display_name}'.")
 
+        deadline.token.unregister(cleanup_handle) # The caller owns the file from here on
         status_placeholder.success(f"✅ الفيديو '{display_name}' جاهز للتحليل.")
         logging.info(f"File {uploaded_file.name} ({display_name}) is ACTIVE.")
         return uploaded_file
 
     except Exception as e:
         status_placeholder.error(f"❌ خطأ أثناء رفع/معالجة الفيديو لـ '{display_name}': {e}")
-        logging.error(f"Upload/Wait failed for '{display_name}': {e}", exc_info=True)
+        logging.error(f"Upload/Wait failed for '{display_name}': {e}", exc_info=not isinstance(e, EvaluationStopped))
+        if deadline.token.cancelled:
+            return None # The token's cleanup has already deleted the upload
+        deadline.token.unregister(cleanup_handle)
         if uploaded_file and uploaded_file.state.name != "ACTIVE":
             try:
                 logging.warning(f"Attempting to delete potentially failed/stuck file: {uploaded_file.name} ({display_name})")
-                genai.delete_file(uploaded_file.name)
+                gemini_backend.delete_file(uploaded_file.name)
                 logging.info(f"Cleaned up failed/stuck file: {uploaded_file.name}")
             except Exception as del_e:
                  logging.warning(f"Failed to delete file {uploaded_file.name} after upload error: {del_e}")
@@ -427,8 +1239,9 @@ def upload_and_wait_gemini(video_path, display_name="video_upload", status_place
 
 
 # --- Analysis function for Skill Evaluation (Legend Page) ---
-def analyze_video_with_prompt(gemini_file_obj, skill_key_en, age_group, status_placeholder=st.empty()):
-    # --- (Code from previous step - no changes needed here) ---
+def analyze_video_with_prompt(gemini_model, gemini_file_obj, skill_key_en, age_group, status_placeholder=st.empty(), deadline=None):
+    """Scores one skill (0..MAX_SCORE_PER_SKILL). Raises EvaluationStopped if the evaluation is cancelled or out of time."""
+    deadline = deadline or EvaluationDeadline(EVALUATION_DEADLINE_S)
     score = 0 # Default score
     if age_group == AGE_GROUP_5_8:
         skill_name_ar = SKILLS_LABELS_AGE_5_8_AR.get(skill_key_en, skill_key_en)
@@ -442,8 +1255,12 @@ def analyze_video_with_prompt(gemini_file_obj, skill_key_en, age_group, status_p
     # logging.debug(f"Prompt for {skill_key_en} (Age: {age_group}):\n{prompt}") # Optional prompt logging
 
     try:
-        # Make API call
-        response = model.generate_content([prompt, gemini_file_obj], request_options={"timeout": 180}) # Increased timeout
+        # Make API call (timeout: the per-call cap, or less if the evaluation deadline is closer)
+        stage = f"تحليل مهارة '{skill_name_ar}'"
+        response = scheduled_gemini_call(
+            deadline, stage, status_placeholder, request_hedger.generate_content, task_model(gemini_model, "skill"), [prompt, gemini_file_obj], "skill",
+            request_options={"timeout": deadline.timeout(stage, SKILL_CALL_TIMEOUT_S)}, is_valid=_is_valid_skill_response, deadline=deadline
+        )
 
         # --- Response Checking & Parsing (simplified for brevity, keep full checks from previous step) ---
         if not response.candidates:
@@ -468,6 +1285,8 @@ def analyze_video_with_prompt(gemini_file_obj, skill_key_en, age_group, status_p
              logging.warning(f"Score parsing error for {skill_key_en} (Age: {age_group}): {e_parse}. File: {gemini_file_obj.name}. Response text: {response.text[:100] if hasattr(response, 'text') else 'N/A'}")
              score = 0
 
+    except EvaluationStopped:
+        raise # Stop the whole evaluation, not just this skill
     except Exception as e:
         # Handle API errors, timeouts, etc.
         st.error(f"❌ حدث خطأ أثناء تحليل Gemini لـ '{skill_name_ar}': {e}")
@@ -477,19 +1296,126 @@ def analyze_video_with_prompt(gemini_file_obj, skill_key_en, age_group, status_p
     return score
 
 
+# --- Biomechanics Response Parsing (Star Page) ---
+# Mapping from the Arabic label in the prompt to the English key
+BIO_LABEL_TO_KEY_MAP = {label.split(':')[0].strip(): key for key, label in BIOMECHANICS_LABELS_AR.items()}
+# Add handling for labels potentially without units in the prompt/response mapping
+BIO_LABEL_TO_KEY_MAP_SIMPLE = {label.split('(')[0].strip(): key for key, label in BIOMECHANICS_LABELS_AR.items()}
+# A complete JSON field: "Key": "text" or "Key": 12.5 followed by a delimiter
+BIO_JSON_FIELD_PATTERN = re.compile(r'"(\w+)"\s*:\s*(?:"((?:[^"\\]|\\.)*)"|(-?[\d.]+%?)\s*(?=[,}\n]))')
+
+
+def parse_biomechanics_line(line):
+    """Returns (metric_key_en, value) for one 'N. label: value' line, or None if it does not match."""
+    line = line.strip()
+    # Regex to capture: number, dot, space, LABEL NAME, colon, space, VALUE
+    match = re.match(r"^\d+\.\s+(.+?):\s+(.+)$", line)
+    if not match:
+        return None
+    label_ar_from_response = match.group(1).strip()
+    value = match.group(2).strip()
+
+    # Try to find the corresponding English key
+    metric_key_en = BIO_LABEL_TO_KEY_MAP.get(label_ar_from_response) or BIO_LABEL_TO_KEY_MAP_SIMPLE.get(label_ar_from_response) # Fallback without units
+    if not metric_key_en:
+        logging.warning(f"Unmatched/Unknown label in biomechanics response line: '{label_ar_from_response}' in line: '{line}'")
+        return None
+    # Clean up value slightly (remove potential extra quotes)
+    return metric_key_en, value.strip('\'"')
+
+
+class BiomechanicsStreamParser:
+    """
+    Incremental parser for a streamed biomechanics response.
+    feed() returns the metrics completed by the new text, each metric at most once,
+    from either numbered-list lines or JSON fields.
+    """
+    def __init__(self):
+        self._pending_line = ""
+        self._json_text = ""
+        self._json_scan_pos = 0
+        self.seen = {}
+
+    def _accept(self, parsed, completed):
+        if parsed and parsed[0] in BIOMECHANICS_METRICS_EN and parsed[0] not in self.seen:
+            self.seen[parsed[0]] = parsed[1]
+            completed.append(parsed)
+
+    def feed(self, text):
+        completed = []
+        # Numbered list: a metric is complete once its line ends
+        self._pending_line += text
+        *full_lines, self._pending_line = self._pending_line.split('\n')
+        for line in full_lines:
+            self._accept(parse_biomechanics_line(line), completed)
+        # JSON: a field is complete once its value is closed
+        self._json_text += text
+        for match in BIO_JSON_FIELD_PATTERN.finditer(self._json_text, self._json_scan_pos):
+            value = match.group(2) if match.group(2) is not None else match.group(3)
+            self._accept((match.group(1), value.strip()), completed)
+            self._json_scan_pos = match.end()
+        return completed
+
+    def finish(self):
+        """Flushes the last line, which has no trailing newline."""
+        completed = []
+        self._accept(parse_biomechanics_line(self._pending_line), completed)
+        self._pending_line = ""
+        return completed
+
+
+def format_biomechanics_value(value_raw):
+    """Cleans a raw metric value and translates known Arabic text values to English for display."""
+    value_str = str(value_raw).strip().strip('\'"') # Clean the raw value
+    # If value_str isn't in the map (e.g., it's a number or unexpected text), it is displayed as is.
+    return BIO_VALUE_MAP_AR_TO_EN.get(value_str, value_str)
+
+
 # --- NEW Analysis function for Biomechanics (Star Page) ---
-def analyze_biomechanics_video(gemini_file_obj, status_placeholder=st.empty()):
-    """Analyzes video for biomechanics, parses the list output."""
+def analyze_biomechanics_video(gemini_model, gemini_file_obj, status_placeholder=st.empty(), stream=False, on_metric=None, deadline=None,
+                               video=None, backend=BIOMECHANICS_BACKEND_GEMINI):
+    """
+    Analyzes video for biomechanics, parses the list output.
+    With stream=True the response is read as it is generated and on_metric(key, value)
+    is called as soon as each metric is complete. Stops early if the deadline is cancelled or spent.
+    Given the StoredVideo and a local or auto backend, the local pose backend runs first;
+    the auto backend falls back to Gemini when it cannot measure the clip.
+    """
+    deadline = deadline or EvaluationDeadline(EVALUATION_DEADLINE_S)
+    stage = "تحليل البيوميكانيكا"
     results = {key: NOT_CLEAR_AR for key in BIOMECHANICS_METRICS_EN} # Initialize with "Not Clear"
 
+    if video is not None and backend != BIOMECHANICS_BACKEND_GEMINI:
+        local_results, _ = analyze_biomechanics_local(video, status_placeholder, deadline)
+        if local_results is None and backend == BIOMECHANICS_BACKEND_LOCAL:
+            status_placeholder.warning("⚠️ تعذر التحليل البيوميكانيكي المحلي لهذا الفيديو.")
+            local_results = results
+        if local_results is not None:
+            for metric_key_en in BIOMECHANICS_METRICS_EN:
+                if on_metric: on_metric(metric_key_en, local_results[metric_key_en])
+            return local_results
+    if gemini_file_obj is None:
+        return results
+
     prompt = create_prompt_for_biomechanics()
     status_placeholder.info(f"🧠 Gemini يحلل الآن الفيديو للبيوميكانيكا...")
-    logging.info(f"Requesting biomechanics analysis using file {gemini_file_obj.name}")
+    logging.info(f"Requesting biomechanics analysis using file {gemini_file_obj.name} (stream={stream})")
     # logging.debug(f"Biomechanics Prompt:\n{prompt}") # Optional: log the full prompt
 
+    response = None
     try:
+        parser = BiomechanicsStreamParser()
+        start_time = time.time()
+        first_metric_time = None
         # Make API call with longer timeout for potentially complex analysis
-        response = model.generate_content([prompt, gemini_file_obj], request_options={"timeout": 300})
+        request_options = {"timeout": deadline.timeout(stage, BIOMECHANICS_CALL_TIMEOUT_S)}
+        if stream: # Streams are not hedged: the first chunk already shortens the wait
+            response = scheduled_gemini_call(deadline, stage, status_placeholder, gemini_backend.generate_content, task_model(gemini_model, "biomechanics"), [prompt, gemini_file_obj], stream=True, request_options=request_options)
+        else:
+            response = scheduled_gemini_call(
+                deadline, stage, status_placeholder, request_hedger.generate_content, task_model(gemini_model, "biomechanics"), [prompt, gemini_file_obj], "biomechanics",
+                request_options=request_options, is_valid=_is_valid_biomechanics_response, deadline=deadline
+            )
 
         # --- Optional DEBUG block ---
         # try:
@@ -502,52 +1428,35 @@ def analyze_biomechanics_video(gemini_file_obj, status_placeholder=st.empty()):
         #     logging.warning(f"Error displaying debug info in UI for biomechanics: {debug_e}")
         # --- End Optional DEBUG block ---
 
-        if not response.candidates:
+        # --- Parsing the numbered list (chunk by chunk when streaming) ---
+        raw_chunks = []
+        for chunk in (response if stream else [response]):
+            deadline.check(stage)
+            if not chunk.candidates or not chunk.candidates[0].content.parts:
+                continue
+            raw_chunks.append(chunk.text)
+            completed = parser.feed(chunk.text)
+            if completed and first_metric_time is None:
+                first_metric_time = time.time() - start_time
+            for metric_key_en, value in completed:
+                logging.debug(f"Parsed Biomechanics: {metric_key_en} = {value}")
+                if on_metric: on_metric(metric_key_en, value)
+        for metric_key_en, value in parser.finish():
+            if first_metric_time is None: first_metric_time = time.time() - start_time
+            if on_metric: on_metric(metric_key_en, value)
+        total_time = time.time() - start_time
+
+        if not raw_chunks:
              status_placeholder.warning("⚠️ استجابة Gemini للبيوميكانيكا فارغة.")
              logging.warning(f"Response candidates list empty for biomechanics. File: {gemini_file_obj.name}")
              return results # Return default "Not Clear" results
 
-        raw_text = response.text.strip()
+        raw_text = "".join(raw_chunks).strip()
         logging.info(f"Gemini Raw Response Text for Biomechanics:\n{raw_text}")
-
-        # --- Parsing the numbered list ---
-        parsed_count = 0
-        # Create a mapping from the Arabic label in the prompt to the English key
-        label_to_key_map = {label.split(':')[0].strip(): key for key, label in BIOMECHANICS_LABELS_AR.items()}
-        # Add handling for labels potentially without units in the prompt/response mapping
-        label_to_key_map_simple = {label.split('(')[0].strip(): key for key, label in BIOMECHANICS_LABELS_AR.items()}
-
-
-        lines = raw_text.split('\n')
-        for line in lines:
-            line = line.strip()
-            # Regex to capture: number, dot, space, LABEL NAME, colon, space, VALUE
-            match = re.match(r"^\d+\.\s+(.+?):\s+(.+)$", line)
-            if match:
-                label_ar_from_response = match.group(1).strip()
-                value = match.group(2).strip()
-
-                # Try to find the corresponding English key
-                metric_key_en = None
-                if label_ar_from_response in label_to_key_map:
-                    metric_key_en = label_to_key_map[label_ar_from_response]
-                elif label_ar_from_response in label_to_key_map_simple: # Fallback without units
-                     metric_key_en = label_to_key_map_simple[label_ar_from_response]
-
-
-                if metric_key_en and metric_key_en in results:
-                    # Clean up value slightly (remove potential extra quotes)
-                    value = value.strip('\'"')
-                    results[metric_key_en] = value
-                    parsed_count += 1
-                    logging.debug(f"Parsed Biomechanics: {metric_key_en} = {value}")
-                else:
-                    logging.warning(f"Unmatched/Unknown label in biomechanics response line: '{label_ar_from_response}' in line: '{line}'")
-            # else:
-            #     # Log lines that didn't match the expected format
-            #     if line: # Avoid logging empty lines
-            #         logging.debug(f"Skipping non-matching line in biomechanics response: '{line}'")
-
+        results.update(parser.seen)
+        parsed_count = len(parser.seen)
+        first_metric_text = f"{first_metric_time:.1f}s" if first_metric_time is not None else "N/A"
+        logging.info(f"Biomechanics latency: time to first metric {first_metric_text}, total {total_time:.1f}s (stream={stream}). File: {gemini_file_obj.name}")
 
         if parsed_count > 0:
              status_placeholder.success(f"✅ اكتمل تحليل البيوميكانيكا. تم تحليل {parsed_count} مقياس.")
@@ -563,14 +1472,244 @@ def analyze_biomechanics_video(gemini_file_obj, status_placeholder=st.empty()):
              logging.warning(f"Failed to parse any biomechanics metrics from response. Raw text:\n{raw_text}")
              # Keep results as default "Not Clear"
 
+    except EvaluationStopped as e:
+        status_placeholder.warning(f"⏹️ توقف تحليل البيوميكانيكا: {e}")
+        logging.warning(f"Biomechanics analysis stopped: {e}. File: {gemini_file_obj.name}")
     except Exception as e:
         status_placeholder.error(f"❌ حدث خطأ أثناء تحليل Gemini للبيوميكانيكا: {e}")
         logging.error(f"Gemini biomechanics analysis failed: {e}. File: {gemini_file_obj.name}", exc_info=True)
         # Keep results as default "Not Clear"
+    finally:
+        if stream and response is not None:
+            response.close() # Frees the scheduler slot even if reading stopped part-way
 
     return results
 
 
+def _is_valid_step_series_response(response):
+    try:
+        return parse_step_series_response(_response_text(response) or "")[0].size > 0
+    except ValueError:
+        return False
+
+
+def analyze_biomechanics_steps(gemini_model, gemini_file_obj, status_placeholder=st.empty(), deadline=None):
+    """
+    Extended biomechanics analysis: one Gemini call returns measurements for every step.
+    Returns (results, series): results has every BIOMECHANICS_METRICS_EN key, with averages,
+    asymmetry and step frequency derived locally from the series; series is None on failure.
+    """
+    deadline = deadline or EvaluationDeadline(EVALUATION_DEADLINE_S)
+    stage = "تحليل الخطوات"
+    results = {key: NOT_CLEAR_AR for key in BIOMECHANICS_METRICS_EN}
+    status_placeholder.info("🧠 Gemini يقيس الآن كل خطوة في الفيديو...")
+    logging.info(f"Requesting per-step biomechanics analysis using file {gemini_file_obj.name}")
+    try:
+        response = scheduled_gemini_call(
+            deadline, stage, status_placeholder, request_hedger.generate_content, task_model(gemini_model, "biomechanics_steps"), [create_prompt_for_biomechanics_steps(), gemini_file_obj], "biomechanics_steps",
+            request_options={"timeout": deadline.timeout(stage, BIOMECHANICS_CALL_TIMEOUT_S)}, is_valid=_is_valid_step_series_response, deadline=deadline
+        )
+        raw_text = _response_text(response)
+        if not raw_text:
+            status_placeholder.warning("⚠️ استجابة Gemini لتحليل الخطوات فارغة.")
+            logging.warning(f"Empty per-step biomechanics response. File: {gemini_file_obj.name}")
+            return results, None
+        series, model_metrics = parse_step_series_response(raw_text)
+        results.update({key: str(value) for key, value in model_metrics.items()})
+        results.update(derive_step_metrics(series, [key for key in BIOMECHANICS_METRICS_EN if key in STEP_DERIVED_METRICS]))
+        status_placeholder.success(f"✅ اكتمل تحليل الخطوات. تم قياس {series.size} خطوة.")
+        logging.info(f"Per-step biomechanics analysis successful: {series.size} steps ({series.nbytes} bytes). File: {gemini_file_obj.name}")
+        return results, series
+    except EvaluationStopped as e:
+        status_placeholder.warning(f"⏹️ توقف تحليل الخطوات: {e}")
+        logging.warning(f"Per-step biomechanics analysis stopped: {e}. File: {gemini_file_obj.name}")
+    except ValueError as e:
+        status_placeholder.warning(f"⚠️ لم نتمكن من قراءة قياسات الخطوات من استجابة Gemini: {e}")
+        logging.warning(f"Could not parse per-step biomechanics response: {e}. File: {gemini_file_obj.name}")
+    except Exception as e:
+        status_placeholder.error(f"❌ حدث خطأ أثناء تحليل Gemini للخطوات: {e}")
+        logging.error(f"Gemini per-step biomechanics analysis failed: {e}. File: {gemini_file_obj.name}", exc_info=True)
+    return results, None
+
+
+# --- Local Pose Estimation Backend (Star Page) ---
+class MediaPipePoseEstimator:
+    """
+    CPU pose model giving 33 landmarks per frame. Every pose worker thread gets its own
+    MediaPipe graph (they are not thread-safe), and frames are estimated independently
+    (static_image_mode, no tracking) so they can be spread across threads in any order.
+    """
+    name = "mediapipe"
+
+    def __init__(self, model_complexity=POSE_MODEL_COMPLEXITY):
+        self._model_complexity = model_complexity
+        self._local = threading.local()
+
+    @staticmethod
+    def available():
+        return mp is not None and cv2 is not None
+
+    def _model(self):
+        model = getattr(self._local, "model", None)
+        if model is None:
+            model = mp.solutions.pose.Pose(static_image_mode=True, model_complexity=self._model_complexity)
+            self._local.model = model
+        return model
+
+    def estimate(self, frame_rgb):
+        """
+        (image, world) landmark arrays of shape (33, 3), or None if no body was found.
+        image: x and y in pixels plus visibility; world: x, y, z in metres around the hip centre.
+        """
+        result = self._model().process(frame_rgb)
+        if result.pose_landmarks is None or result.pose_world_landmarks is None:
+            return None
+        height, width = frame_rgb.shape[:2]
+        image = np.array([(lm.x * width, lm.y * height, lm.visibility) for lm in result.pose_landmarks.landmark], dtype=np.float32)
+        world = np.array([(lm.x, lm.y, lm.z) for lm in result.pose_world_landmarks.landmark], dtype=np.float32)
+        return image, world
+
+
+# Estimator name -> class. Another CPU pose model only needs available(), estimate() and an entry here.
+POSE_ESTIMATORS = {MediaPipePoseEstimator.name: MediaPipePoseEstimator}
+
+
+@st.cache_resource
+def get_pose_estimator():
+    """One pose estimator per server process, or None if it cannot run here (biomechanics then uses Gemini)."""
+    estimator_class = POSE_ESTIMATORS.get(POSE_ESTIMATOR_NAME)
+    if estimator_class is None or not estimator_class.available():
+        logging.info(f"Local pose estimator '{POSE_ESTIMATOR_NAME}' is unavailable (needs mediapipe and OpenCV); biomechanics will use Gemini.")
+        return None
+    return estimator_class()
+
+
+@st.cache_resource
+def get_pose_executor():
+    """One pool per server process for pose estimation; its threads keep their pose models between clips."""
+    return ThreadPoolExecutor(max_workers=POSE_WORKERS, thread_name_prefix="scout_pose")
+
+
+def _estimate_frame(estimator, frame_bgr):
+    scale = POSE_FRAME_MAX_SIDE / max(frame_bgr.shape[:2])
+    if scale < 1:
+        frame_bgr = cv2.resize(frame_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return estimator.estimate(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+
+
+def estimate_video_keypoints(video_path, estimator, executor, deadline, stage):
+    """
+    Decodes one frame every 1/POSE_SAMPLE_FPS seconds and estimates the frames in parallel.
+    Decoding stays sequential; at most 2 frames per worker wait in memory at once.
+    Returns (times_s, image_keypoints, world_keypoints) with shapes (F,), (F, 33, 3), (F, 33, 3),
+    NaN where no body was found; None if the video cannot be read.
+    """
+    capture = cv2.VideoCapture(video_path)
+    futures, times = [], []
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        if fps <= 0:
+            return None
+        stride = max(1, int(round(fps / POSE_SAMPLE_FPS)))
+        frame_index = 0
+        while len(futures) < POSE_MAX_FRAMES:
+            if frame_index % stride:
+                ok = capture.grab() # Skipped frames are not decoded
+            else:
+                ok, frame = capture.read()
+                if ok:
+                    deadline.check(stage)
+                    if len(futures) >= 2 * POSE_WORKERS: # Back-pressure on decoding
+                        deadline.wait_for(stage, futures[-2 * POSE_WORKERS])
+                    futures.append(executor.submit(_estimate_frame, estimator, frame))
+                    times.append(frame_index / fps)
+            if not ok:
+                break
+            frame_index += 1
+        if not futures:
+            return None
+        image_keypoints = np.full((len(futures), 33, 3), np.nan, dtype=np.float32)
+        world_keypoints = np.full((len(futures), 33, 3), np.nan, dtype=np.float32)
+        for index, future in enumerate(futures):
+            estimate = deadline.wait_for(stage, future)
+            if estimate is not None:
+                image_keypoints[index], world_keypoints[index] = estimate
+        return np.array(times), image_keypoints, world_keypoints
+    finally:
+        capture.release()
+        for future in futures:
+            future.cancel()
+
+
+def analyze_biomechanics_local(video, status_placeholder=st.empty(), deadline=None):
+    """
+    Star page biomechanics on this server's CPU: pose estimation on sampled frames, then the
+    BIOMECHANICS_METRICS_EN values computed geometrically plus the POSE_EXTRA_METRICS_EN.
+    Returns (results, series) like analyze_biomechanics_steps, or (None, None) when the local
+    backend cannot run or sees too little of the player, so the caller can fall back to Gemini.
+    """
+    estimator = get_pose_estimator()
+    if estimator is None:
+        return None, None
+    deadline = deadline or EvaluationDeadline(EVALUATION_DEADLINE_S)
+    stage = "تقدير الوضعيات محلياً"
+    status_placeholder.info("🦴 يتم تقدير وضعيات الجسم على إطارات الفيديو محلياً...")
+    start_time = time.time()
+    try:
+        with get_video_store().local_copy(video) as local_video_path:
+            keypoints = estimate_video_keypoints(local_video_path, estimator, get_pose_executor(), deadline, stage)
+        if keypoints is None:
+            logging.warning(f"Local pose estimation could not read '{video.name}'.")
+            return None, None
+        times, image_keypoints, world_keypoints = keypoints
+        detected_share = np.isfinite(image_keypoints[:, 0, 0]).mean()
+        series, clip_metrics = compute_pose_biomechanics(times, image_keypoints, world_keypoints)
+    except EvaluationStopped as e:
+        status_placeholder.warning(f"⏹️ توقف التحليل البيوميكانيكي المحلي: {e}")
+        logging.warning(f"Local biomechanics analysis stopped: {e}. Video: {video.name}")
+        return {key: NOT_CLEAR_AR for key in BIOMECHANICS_METRICS_EN}, None
+    except Exception as e:
+        logging.error(f"Local pose estimation failed for '{video.name}': {e}", exc_info=True)
+        return None, None
+    if detected_share < POSE_MIN_DETECTED_SHARE or series.size < POSE_MIN_STEPS:
+        logging.info(f"Local pose estimation too sparse for '{video.name}' (body in {detected_share:.0%} of {times.size} frames, {series.size} steps).")
+        return None, None
+
+    step_keys = [key for key in BIOMECHANICS_METRICS_EN if key in STEP_DERIVED_METRICS]
+    metric_values = {key: STEP_DERIVED_METRICS[key][0](series) for key in step_keys}
+    metric_values.update(clip_metrics)
+    risk_score = pose_risk_score(metric_values)
+    results = {key: NOT_CLEAR_AR for key in BIOMECHANICS_METRICS_EN} # Max_Acceleration and Pelvic_Tilt_Avg have no local equivalent
+    results.update(derive_step_metrics(series, step_keys))
+    results.update({key: f"{value:.1f}" if value is not None else NOT_CLEAR_AR for key, value in clip_metrics.items()})
+    results["Risk_Score"] = str(risk_score)
+    results["Risk_Level"] = next(level for highest, level in POSE_RISK_LEVELS_AR if risk_score <= highest)
+    status_placeholder.success(f"✅ اكتمل التحليل البيوميكانيكي المحلي ({series.size} خطوة، {times.size} إطار).")
+    logging.info(f"Local biomechanics for '{video.name}': {series.size} steps from {times.size} frames "
+                 f"(body in {detected_share:.0%}) in {time.time() - start_time:.1f}s.")
+    return results, series
+
+
+def queue_local_biomechanics(backend):
+    """
+    local_first hook for the Star queue's VideoPrefetchPipeline: the local pose pass on the
+    prefetch thread, so a clip is uploaded only when the auto backend has to fall back to Gemini.
+    None for the Gemini backend.
+    """
+    if backend == BIOMECHANICS_BACKEND_GEMINI:
+        return None
+    if get_pose_estimator() is not None:
+        get_pose_executor() # Created here, on the script thread, before the prefetch threads share it
+
+    def run_local(video, deadline):
+        results, _ = analyze_biomechanics_local(video, _SilentStatus(), deadline)
+        if results is None and backend == BIOMECHANICS_BACKEND_LOCAL:
+            logging.warning(f"Local biomechanics could not measure queued video '{video.name}'; no Gemini fallback (local backend).")
+            return {key: NOT_CLEAR_AR for key in BIOMECHANICS_METRICS_EN}
+        return results
+    return run_local
+
+
 # --- File Deletion Function (Common) ---
 def delete_gemini_file(gemini_file_obj, status_placeholder=st.empty()):
     # --- (Code from previous step - no changes needed here) ---
@@ -579,13 +1718,760 @@ def delete_gemini_file(gemini_file_obj, status_placeholder=st.empty()):
         display_name = gemini_file_obj.display_name # Should contain the unique upload name
         status_placeholder.info(f"🗑️ جاري حذف الملف المرفوع '{display_name}' من التخزين السحابي...")
         logging.info(f"Attempting to delete cloud file: {gemini_file_obj.name} (Display: {display_name})")
-        genai.delete_file(gemini_file_obj.name)
+        gemini_backend.delete_file(gemini_file_obj.name)
         logging.info(f"Cloud file deleted successfully: {gemini_file_obj.name} (Display: {display_name})")
     except Exception as e:
-        st.warning(f"⚠️ لم نتمكن من حذف الملف السحابي {gemini_file_obj.name} (Display: {display_name}): {e}")
+        status_placeholder.warning(f"⚠️ لم نتمكن من حذف الملف السحابي {gemini_file_obj.name} (Display: {display_name}): {e}")
         logging.warning(f"Could not delete cloud file {gemini_file_obj.name} (Display: {display_name}): {e}")
 
 
+# --- Skill Evaluation Loop (Legend Page) ---
+def run_skill_evaluation(gemini_model, gemini_file_obj, skill_keys, age_group, status_container, deadline=None, on_score=None):
+    """
+    Scores each skill in order against one ACTIVE Gemini file, one status line per skill.
+    on_score(scores_so_far) runs after every skill, so results can be shown as they arrive.
+    If the evaluation is cancelled or out of time, returns the skills scored so far.
+    """
+    results_dict = {}
+    start_time = time.time()
+    for skill_key in skill_keys:
+        status_skill_analysis = status_container.empty()
+        try:
+            results_dict[skill_key] = analyze_video_with_prompt(
+                gemini_model, gemini_file_obj, skill_key, age_group, status_skill_analysis, deadline
+            )
+        except EvaluationStopped as e:
+            status_skill_analysis.warning(f"⏹️ توقف تقييم المهارات: {e}")
+            logging.warning(f"Skill evaluation stopped after {len(results_dict)}/{len(skill_keys)} skills: {e}")
+            break
+        if len(results_dict) == 1:
+            logging.info(f"First skill score after {time.time() - start_time:.1f}s ({len(skill_keys)} skills requested).")
+        if on_score:
+            on_score(dict(results_dict))
+        # Add small delay if needed for API rate limits or UI updates
+        # time.sleep(1)
+    return results_dict
+
+
+# --- Spill-to-Disk Video Store (Common) ---
+StoredVideo = namedtuple("StoredVideo", ["content_hash", "name", "size"]) # What a session keeps instead of the bytes
+
+
+class SpillingVideoStore:
+    """
+    Per-process store for uploaded video bytes, deduplicated by SHA-256.
+    Videos live in RAM up to a global memory budget; the least recently used ones
+    spill to disk, and spilled files are deleted LRU-first past the disk budget.
+    Spill victims are chosen under the lock but written outside it (readable from RAM
+    meanwhile), so one session's large write does not stall every other session's store calls.
+    """
+    def __init__(self, memory_budget_bytes, disk_budget_bytes, spill_dir):
+        self._memory_budget_bytes = memory_budget_bytes
+        self._disk_budget_bytes = disk_budget_bytes
+        self._spill_dir = spill_dir
+        os.makedirs(spill_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict() # content_hash -> bytes, oldest first
+        self._disk = OrderedDict() # content_hash -> spill file path, oldest first
+        self._sizes = {}
+        self._names = {} # content_hash -> original file name (for the spill file extension)
+        self._pins = {} # content_hash -> number of callers currently reading the spill file
+        self._spilling = {} # content_hash -> (bytes, Event set when written), being written to disk
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+
+    def put(self, name, data):
+        handle = StoredVideo(hashlib.sha256(data).hexdigest(), name, len(data))
+        spills = []
+        with self._lock:
+            self._names.setdefault(handle.content_hash, name)
+            if handle.content_hash in self._memory:
+                self._memory.move_to_end(handle.content_hash)
+            elif handle.content_hash in self._disk:
+                self._disk.move_to_end(handle.content_hash)
+            elif handle.content_hash in self._spilling:
+                pass
+            elif handle.size > self._memory_budget_bytes:
+                spills.append(self._begin_spill(handle.content_hash, data))
+            else:
+                self._memory[handle.content_hash] = data
+                self._sizes[handle.content_hash] = handle.size
+                self._memory_bytes += handle.size
+                spills = self._evict_memory()
+        self._write_spills(spills)
+        return handle
+
+    def contains(self, handle):
+        with self._lock:
+            return any(handle.content_hash in where for where in (self._memory, self._disk, self._spilling))
+
+    def get_bytes(self, handle):
+        """
+        Returns the video bytes, or None if the video has been evicted from memory and disk.
+        A spilled video is read outside the lock (pinned against eviction meanwhile), so one
+        session reading a large file does not stall every other session's store calls.
+        """
+        with self._lock:
+            if handle.content_hash in self._memory:
+                self._memory.move_to_end(handle.content_hash)
+                return self._memory[handle.content_hash]
+            if handle.content_hash in self._spilling:
+                return self._spilling[handle.content_hash][0]
+            path = self._disk.get(handle.content_hash)
+            if path is None:
+                return None
+            self._disk.move_to_end(handle.content_hash)
+            self._pin(handle.content_hash)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        finally:
+            with self._lock:
+                self._unpin(handle.content_hash)
+
+    @contextmanager
+    def local_copy(self, handle):
+        """Yields a path to the video on local disk (spilling it if needed), protected from eviction while in use."""
+        while True:
+            spill = pending = None
+            with self._lock:
+                if handle.content_hash in self._disk:
+                    self._disk.move_to_end(handle.content_hash)
+                    self._pin(handle.content_hash)
+                    path = self._disk[handle.content_hash]
+                    break
+                pending = self._spilling.get(handle.content_hash)
+                if pending is None:
+                    data = self._memory.get(handle.content_hash)
+                    if data is None:
+                        raise KeyError(f"Video '{handle.name}' ({handle.content_hash[:12]}) is no longer in the video store.")
+                    spill = self._begin_spill(handle.content_hash, data)
+            if pending is not None:
+                pending[1].wait() # Another caller is writing the spill file
+            else:
+                self._write_spills([spill])
+        try:
+            yield path
+        finally:
+            with self._lock:
+                self._unpin(handle.content_hash)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_bytes": self._memory_bytes, "memory_videos": len(self._memory),
+                "memory_budget_bytes": self._memory_budget_bytes,
+                "disk_bytes": self._disk_bytes, "disk_videos": len(self._disk),
+                "disk_budget_bytes": self._disk_budget_bytes,
+            }
+
+    # The helpers below expect self._lock to be held.
+    def _pin(self, content_hash):
+        self._pins[content_hash] = self._pins.get(content_hash, 0) + 1
+
+    def _unpin(self, content_hash):
+        self._pins[content_hash] -= 1
+        if not self._pins[content_hash]:
+            del self._pins[content_hash]
+        self._evict_disk()
+
+    def _begin_spill(self, content_hash, data):
+        """Marks a video as being spilled; returns the (content_hash, path, data) for _write_spills."""
+        name = self._names.get(content_hash, "")
+        self._spilling[content_hash] = (data, threading.Event())
+        return content_hash, os.path.join(self._spill_dir, f"{content_hash}{os.path.splitext(name)[1]}"), data
+
+    def _evict_memory(self):
+        """Drops LRU videos from RAM past the memory budget; returns the spills to write outside the lock."""
+        spills = []
+        while self._memory_bytes > self._memory_budget_bytes and len(self._memory) > 1:
+            content_hash, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+            if content_hash not in self._disk and content_hash not in self._spilling:
+                spills.append(self._begin_spill(content_hash, data))
+        self._evict_disk()
+        return spills
+
+    def _write_spills(self, spills):
+        """Writes spill files without the lock, then adds them to the disk tier. Raises the first write error."""
+        first_error = None
+        for content_hash, path, data in spills:
+            try:
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            except Exception as e:
+                logging.error(f"Video store could not spill {content_hash[:12]} to {path}: {e}")
+                first_error = first_error or e
+                path = None
+            with self._lock:
+                done = self._spilling.pop(content_hash)[1]
+                if path is not None:
+                    self._disk[content_hash] = path
+                    self._sizes[content_hash] = len(data)
+                    self._disk_bytes += len(data)
+                    self._evict_disk()
+                elif content_hash not in self._memory: # Lost: it was only in RAM on its way to disk
+                    self._sizes.pop(content_hash, None)
+                    self._names.pop(content_hash, None)
+            done.set()
+            if path is not None:
+                logging.info(f"Video store spilled {content_hash[:12]} ({len(data)} bytes) to {path}")
+        if first_error is not None:
+            raise first_error
+
+    def _evict_disk(self):
+        for content_hash in list(self._disk):
+            if self._disk_bytes <= self._disk_budget_bytes:
+                break
+            if content_hash in self._pins:
+                continue
+            path = self._disk.pop(content_hash)
+            self._disk_bytes -= self._sizes[content_hash]
+            if content_hash not in self._memory:
+                del self._sizes[content_hash]
+                self._names.pop(content_hash, None)
+            try: os.remove(path)
+            except Exception as e_del: logging.warning(f"Could not delete spilled video {path}: {e_del}")
+            logging.info(f"Video store evicted spilled video {content_hash[:12]} from disk.")
+
+
+@st.cache_resource
+def get_video_store():
+    """One video store per server process."""
+    return SpillingVideoStore(VIDEO_STORE_MEMORY_BUDGET_BYTES, VIDEO_STORE_DISK_BUDGET_BYTES, VIDEO_STORE_DIR)
+
+
+def store_uploaded_video(uploaded_file):
+    """
+    Copies a Streamlit upload into the shared video store (once per upload) and returns its handle.
+    Streamlit itself keeps the uploaded bytes for as long as the file_uploader widget holds the
+    file (until the scout removes it or the session ends). That copy is outside the store's
+    budgets; each file is only bounded by Streamlit's server.maxUploadSize.
+    """
+    upload_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    handle = st.session_state.stored_upload_handles.get(upload_key)
+    if handle is None or not get_video_store().contains(handle):
+        handle = get_video_store().put(uploaded_file.name, uploaded_file.getvalue())
+        st.session_state.stored_upload_handles[upload_key] = handle
+    return handle
+
+
+# --- Shared Video Assets (Legend & Star Pages) ---
+class VideoAssetService:
+    """
+    A session's processed Gemini files, keyed by video content and shared by every page and
+    mode, so scoring skills and then biomechanics on the same clip uploads it once.
+    A file seen ACTIVE within state_ttl_s is reused without a get_file call; older ones are
+    checked once and re-uploaded if Gemini no longer has them. At most max_files are kept,
+    and the least recently used one is deleted from Gemini storage.
+    """
+    def __init__(self, max_files=VIDEO_ASSET_MAX_FILES, state_ttl_s=VIDEO_ASSET_STATE_TTL_S):
+        self.max_files = max_files
+        self.state_ttl_s = state_ttl_s
+        self._assets = OrderedDict() # content_hash -> {"file": Gemini File, "checked_at": monotonic time}
+
+    def ensure_active(self, video, status_placeholder, deadline):
+        """The ACTIVE Gemini file for a stored video, reused when possible and uploaded otherwise. None on failure."""
+        asset = self._assets.get(video.content_hash)
+        if asset:
+            self._assets.move_to_end(video.content_hash)
+            if time.monotonic() - asset["checked_at"] < self.state_ttl_s or self._still_active(asset, deadline):
+                status_placeholder.success(f"✅ الفيديو '{video.name}' مرفوع سابقاً وجاهز للتحليل.")
+                logging.info(f"Reusing ACTIVE Gemini file {asset['file'].name} for '{video.name}'.")
+                return asset["file"]
+            self.discard(video.content_hash)
+        with get_video_store().local_copy(video) as local_video_path:
+            gemini_file = upload_and_wait_gemini(local_video_path, video.name, status_placeholder, deadline)
+        if gemini_file:
+            self._assets[video.content_hash] = {"file": gemini_file, "checked_at": time.monotonic()}
+            while len(self._assets) > self.max_files:
+                self.discard(next(iter(self._assets)))
+        return gemini_file
+
+    def _still_active(self, asset, deadline):
+        try:
+            remote_file = deadline.run("التحقق من الفيديو المرفوع سابقاً", gemini_backend.get_file, asset["file"].name)
+        except EvaluationStopped:
+            raise
+        except Exception as e:
+            logging.warning(f"Could not check Gemini file {asset['file'].name}: {e}. Re-uploading.")
+            return False
+        if remote_file.state.name != "ACTIVE":
+            logging.warning(f"Gemini file {asset['file'].name} is no longer ACTIVE ({remote_file.state.name}). Re-uploading.")
+            return False
+        asset["checked_at"] = time.monotonic()
+        return True
+
+    def discard(self, content_hash):
+        asset = self._assets.pop(content_hash, None)
+        if asset:
+            delete_gemini_file(asset["file"], _SilentStatus())
+
+    def clear(self):
+        for content_hash in list(self._assets):
+            self.discard(content_hash)
+
+
+# --- Perceptual Near-Duplicate Detection (Legend & Star Pages) ---
+def compute_video_fingerprint(video_path):
+    """
+    Perceptual fingerprint of a video: a 64-bit difference hash (dHash) of one frame every
+    NEAR_DUP_SAMPLE_INTERVAL_S seconds, plus the duration. dHash survives re-encoding,
+    rescaling and renaming. Returns None if OpenCV is missing or the video is unreadable.
+    """
+    if cv2 is None:
+        return None
+    capture = cv2.VideoCapture(video_path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+        if fps <= 0 or frame_count <= 0:
+            return None
+        duration_s = frame_count / fps
+        hashes = []
+        for sample_time_s in np.arange(0, duration_s, NEAR_DUP_SAMPLE_INTERVAL_S)[:NEAR_DUP_MAX_FRAMES]:
+            capture.set(cv2.CAP_PROP_POS_MSEC, sample_time_s * 1000)
+            ok, frame = capture.read()
+            if not ok:
+                continue
+            small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+            hashes.append(np.packbits(small[:, 1:] > small[:, :-1]).view(">u8")[0])
+    finally:
+        capture.release()
+    if not hashes:
+        return None
+    return {"hashes": np.array(hashes, dtype=np.uint64), "duration_s": duration_s}
+
+
+def fingerprint_similarity(fingerprint_a, fingerprint_b):
+    """Share of the shorter clip's frames that have a near-identical frame in the other clip (0..1)."""
+    short, long = sorted((fingerprint_a, fingerprint_b), key=lambda fp: fp["duration_s"])
+    if long["duration_s"] <= 0 or short["duration_s"] / long["duration_s"] < NEAR_DUP_MIN_DURATION_RATIO:
+        return 0.0
+    xor = np.bitwise_xor(short["hashes"][:, None], long["hashes"][None, :]) # All frame pairs at once
+    hamming = np.unpackbits(xor.view(np.uint8).reshape(len(short["hashes"]), len(long["hashes"]), 8), axis=2).sum(axis=2)
+    return float((hamming.min(axis=1) <= NEAR_DUP_FRAME_MAX_HAMMING).mean())
+
+
+class NearDuplicateIndex:
+    """
+    Process-wide index of analysed videos by perceptual fingerprint, with the results
+    stored per analysis type (e.g. "skills:<age group>", "biomechanics"). Entries are
+    appended to a JSON Lines file so they survive restarts; the last line per video wins.
+    At most max_entries videos are kept (least recently analysed dropped first), and the
+    file is rewritten without superseded lines once they outnumber the live entries.
+    Lookups only compare clips whose durations could match (see fingerprint_similarity).
+    """
+    def __init__(self, path, max_entries=NEAR_DUP_MAX_ENTRIES):
+        self._path = path
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # content_hash -> {"name", "duration_s", "hashes", "results"}, oldest first
+        self._by_duration = [] # Sorted (duration_s, content_hash) of self._entries
+        self._fingerprints = OrderedDict() # content_hash -> fingerprint (LRU memo, also for unanalysed uploads)
+        self._pending = {} # content_hash -> Future of a fingerprint being computed in the background
+        self._file_lines = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entry["hashes"] = np.array([int(h, 16) for h in entry["hashes"]], dtype=np.uint64)
+                        self._entries.pop(entry["content_hash"], None)
+                        self._entries[entry["content_hash"]] = entry
+                        self._file_lines += 1
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+            self._by_duration = sorted((entry["duration_s"], content_hash) for content_hash, entry in self._entries.items())
+            if self._file_lines > 2 * len(self._entries):
+                self._rewrite()
+            logging.info(f"Near-duplicate index loaded {len(self._entries)} analysed videos from {path}")
+
+    def fingerprint(self, video_store, video):
+        """The video's fingerprint (None if it cannot be read), computed now unless memoised or already under way."""
+        with self._lock:
+            if video.content_hash in self._fingerprints:
+                self._fingerprints.move_to_end(video.content_hash)
+                return self._fingerprints[video.content_hash]
+            pending = self._pending.get(video.content_hash)
+        if pending is not None:
+            return pending.result()
+        return self._compute_fingerprint(video_store, video)
+
+    def fingerprint_in_background(self, video_store, video, executor):
+        """(ready, fingerprint) without waiting: a memoised fingerprint, or (False, None) while executor computes it."""
+        with self._lock:
+            if video.content_hash in self._fingerprints:
+                self._fingerprints.move_to_end(video.content_hash)
+                return True, self._fingerprints[video.content_hash]
+            if video.content_hash not in self._pending:
+                self._pending[video.content_hash] = executor.submit(self._compute_fingerprint, video_store, video)
+        return False, None
+
+    def _compute_fingerprint(self, video_store, video):
+        try:
+            with video_store.local_copy(video) as local_video_path:
+                fingerprint = compute_video_fingerprint(local_video_path)
+        except Exception as e:
+            logging.warning(f"Could not fingerprint video '{video.name}': {e}")
+            fingerprint = None
+        with self._lock:
+            self._fingerprints[video.content_hash] = fingerprint
+            self._pending.pop(video.content_hash, None)
+            while len(self._fingerprints) > NEAR_DUP_FINGERPRINT_MEMO:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def find(self, fingerprint, result_key):
+        """Best previously analysed video with results for result_key: (entry, similarity) or None."""
+        if fingerprint is None:
+            return None
+        shortest_s = fingerprint["duration_s"] * NEAR_DUP_MIN_DURATION_RATIO
+        longest_s = fingerprint["duration_s"] / NEAR_DUP_MIN_DURATION_RATIO
+        candidates = []
+        with self._lock:
+            for position in range(bisect.bisect_left(self._by_duration, (shortest_s, "")), len(self._by_duration)):
+                duration_s, content_hash = self._by_duration[position]
+                if duration_s > longest_s:
+                    break
+                if result_key in self._entries[content_hash]["results"]:
+                    candidates.append(self._entries[content_hash])
+        best = max(((entry, fingerprint_similarity(fingerprint, entry)) for entry in candidates), key=lambda pair: pair[1], default=None)
+        if best and best[1] >= NEAR_DUP_MIN_SIMILARITY:
+            return best
+        return None
+
+    def record(self, video, fingerprint, result_key, results):
+        if fingerprint is None:
+            return
+        with self._lock:
+            entry = self._entries.get(video.content_hash)
+            if entry is None:
+                entry = self._entries[video.content_hash] = {
+                    "content_hash": video.content_hash, "name": video.name, "duration_s": fingerprint["duration_s"],
+                    "hashes": fingerprint["hashes"], "results": {},
+                }
+                bisect.insort(self._by_duration, (entry["duration_s"], video.content_hash))
+                while len(self._entries) > self._max_entries:
+                    _, evicted = self._entries.popitem(last=False)
+                    del self._by_duration[bisect.bisect_left(self._by_duration, (evicted["duration_s"], evicted["content_hash"]))]
+            self._entries.move_to_end(video.content_hash)
+            entry["results"][result_key] = results
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(self._entry_line(entry))
+            self._file_lines += 1
+            if self._file_lines > 2 * self._max_entries:
+                self._rewrite()
+
+    # The helpers below expect self._lock to be held (or the index not yet shared).
+    @staticmethod
+    def _entry_line(entry):
+        return json.dumps({**entry, "hashes": [f"{int(h):016x}" for h in entry["hashes"]]}, ensure_ascii=False) + "\n"
+
+    def _rewrite(self):
+        """Replaces the file with one line per kept video, oldest first."""
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for entry in self._entries.values():
+                f.write(self._entry_line(entry))
+        os.replace(temp_path, self._path)
+        self._file_lines = len(self._entries)
+
+
+@st.cache_resource
+def get_near_duplicate_index():
+    """One near-duplicate index per server process."""
+    return NearDuplicateIndex(NEAR_DUP_INDEX_PATH)
+
+
+@st.cache_resource
+def get_fingerprint_executor():
+    """One pool per server process for decoding uploads into fingerprints off the script thread."""
+    return ThreadPoolExecutor(max_workers=NEAR_DUP_FINGERPRINT_WORKERS, thread_name_prefix="scout_fingerprint")
+
+
+def find_previous_results(video, result_key):
+    """
+    Previously stored results for a near-duplicate of this video: (entry, similarity) or None.
+    Never waits for the fingerprint: returns NEAR_DUP_PENDING while it is computed in the background.
+    """
+    index = get_near_duplicate_index()
+    ready, fingerprint = index.fingerprint_in_background(get_video_store(), video, get_fingerprint_executor())
+    return index.find(fingerprint, result_key) if ready else NEAR_DUP_PENDING
+
+
+def render_previous_results_offer(video, result_key, key, on_reuse):
+    """
+    Offers the stored results of a near-duplicate of an already analysed clip; on_reuse(results)
+    applies them. The offer is a fragment that polls until the background fingerprint is ready,
+    so the upload interaction itself never waits for the frame decoding.
+    """
+    started_pending = find_previous_results(video, result_key) is NEAR_DUP_PENDING
+
+    @st.fragment(run_every=NEAR_DUP_POLL_INTERVAL_S if started_pending else None)
+    def offer():
+        previous_match = find_previous_results(video, result_key)
+        if previous_match is NEAR_DUP_PENDING:
+            st.caption("🔎 جاري البحث عن فيديو مشابه تم تحليله سابقاً...")
+            return
+        if started_pending:
+            st.rerun() # Fingerprint ready: one full rerun shows the outcome and stops the polling
+        if previous_match:
+            previous_entry, similarity = previous_match
+            st.info(f"🔁 هذا الفيديو يشبه '{previous_entry['name']}' الذي تم تحليله سابقاً (تشابه {similarity:.0%}). يمكنك استخدام النتائج السابقة بدون رفع أو تحليل جديد.")
+            if st.button("♻️ استخدام النتائج السابقة", key=key):
+                on_reuse(previous_entry["results"][result_key])
+                st.rerun() # The results are shown outside this fragment
+
+    offer()
+
+
+def remember_results(video, result_key, results):
+    """Stores analysis results under this video's fingerprint for future near-duplicates."""
+    index = get_near_duplicate_index()
+    index.record(video, index.fingerprint(get_video_store(), video), result_key, results)
+
+
+# --- Player History: Columnar Store with Incremental Aggregates (Legend & Star Pages) ---
+@st.cache_resource
+def get_player_history_store():
+    """One history store per server process (appends are serialised by its lock)."""
+    return PlayerHistoryStore(HISTORY_DIR, HISTORY_AGE_GROUP_CODES)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_player_history(player, evaluations_count):
+    """Cached per player; evaluations_count is part of the key so a new evaluation refreshes it."""
+    return get_player_history_store().load_player(player)
+
+
+def record_player_history(player, age_group, video_name, source, results):
+    """Appends results to the player history; a storage error is logged, never shown as an analysis failure."""
+    if not results or not player:
+        return
+    if source == HISTORY_SOURCE_SKILLS and results.get("grade") == GRADE_INCOMPLETE_AR:
+        # A stopped run's partial total is not comparable with full evaluations, so it stays out of the history
+        logging.info(f"Player history: skipped incomplete skills evaluation of '{player}' ({video_name}).")
+        return
+    try:
+        get_player_history_store().append(player, age_group, video_name, source, results)
+    except Exception as e:
+        logging.warning(f"Could not record {source} history for '{player}': {e}", exc_info=True)
+
+
+def history_player_name(player_name_input, video_name):
+    """Player name typed by the scout, or the video's file name without extension."""
+    return (player_name_input or "").strip() or os.path.splitext(os.path.basename(video_name))[0]
+
+
+# --- Player Comparison: Shared Worker Pool and Incremental Ranking (Legend Page) ---
+@st.cache_resource
+def get_analysis_executor():
+    """One bounded worker pool per server process for batched player evaluations."""
+    return ThreadPoolExecutor(max_workers=ANALYSIS_POOL_WORKERS, thread_name_prefix="scout_analysis")
+
+
+def evaluate_player_clip(gemini_model, video_store, video, skill_keys, age_group, batch_deadline):
+    """
+    Worker task: uploads one player's clip, scores all skills, and deletes the cloud file.
+    The clip gets its own deadline from when the worker picks it up, cancelled with the batch.
+    None if the clip could not be fully evaluated.
+    """
+    deadline = batch_deadline.child(EVALUATION_DEADLINE_S)
+    deadline.check(f"تقييم اللاعب '{video.name}'") # Cancelled while waiting for a worker
+    with video_store.local_copy(video) as local_video_path:
+        gemini_file_obj = upload_and_wait_gemini(local_video_path, video.name, _SilentStatus(), deadline)
+    if not gemini_file_obj:
+        return None
+    try:
+        scores_dict = run_skill_evaluation(gemini_model, gemini_file_obj, skill_keys, age_group, _SilentStatus(), deadline)
+        if len(scores_dict) < len(skill_keys):
+            return None # Stopped part-way: do not rank an incomplete evaluation
+        return evaluate_final_grade_from_individual_scores(scores_dict)
+    finally:
+        delete_gemini_file(gemini_file_obj, _SilentStatus())
+
+
+class Leaderboard:
+    """
+    Players of one age group ranked incrementally: a sorted index on total score plus
+    one per skill. Adding a player is a binary-search insert, so nothing is re-sorted
+    on reruns and reading the top k is a slice.
+    """
+    def __init__(self, skill_keys):
+        self.skill_keys = list(skill_keys)
+        self._players = {} # video content hash -> (player name, evaluation dict)
+        self._indexes = {LEADERBOARD_RANK_BY_TOTAL: []} # rank key -> sorted [(-score, content hash)]
+        for skill_key in self.skill_keys:
+            self._indexes[skill_key] = []
+
+    def __len__(self):
+        return len(self._players)
+
+    @staticmethod
+    def _score(evaluation, rank_by):
+        if rank_by == LEADERBOARD_RANK_BY_TOTAL:
+            return evaluation["total_score"]
+        return evaluation["scores"].get(rank_by, 0)
+
+    def add(self, content_hash, player_name, evaluation):
+        """
+        Inserts (or replaces) a clip's evaluation in every index. Entries are keyed by the
+        video's content hash, so two different clips uploaded under the same file name both
+        stay on the board; the name is only shown.
+        """
+        if content_hash in self._players:
+            _, previous = self._players.pop(content_hash)
+            for rank_by, index in self._indexes.items():
+                del index[bisect.bisect_left(index, (-self._score(previous, rank_by), content_hash))]
+        self._players[content_hash] = (player_name, evaluation)
+        for rank_by, index in self._indexes.items():
+            bisect.insort(index, (-self._score(evaluation, rank_by), content_hash))
+
+    def top(self, k, rank_by=LEADERBOARD_RANK_BY_TOTAL):
+        """Returns [(rank, player name, evaluation)] for the best k players by total or by one skill."""
+        return [(rank, *self._players[content_hash])
+                for rank, (_, content_hash) in enumerate(self._indexes[rank_by][:k], start=1)]
+
+
+def build_leaderboard_frame(leaderboard, k, rank_by, skills_labels_ar):
+    """Leaderboard rows for display (Arabic headers), best first."""
+    rows = []
+    for rank, player_name, evaluation in leaderboard.top(k, rank_by):
+        row = {"الترتيب": rank, "اللاعب": os.path.splitext(player_name)[0]}
+        row["المجموع"] = f"{evaluation['total_score']} / {evaluation['max_score']}"
+        row["التقدير"] = evaluation["grade"]
+        for skill_key in leaderboard.skill_keys:
+            row[skills_labels_ar.get(skill_key, skill_key)] = evaluation["scores"].get(skill_key, 0)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# --- Video Queue Prefetch Pipeline (Legend & Star Pages) ---
+class _SilentStatus:
+    """Stand-in for a Streamlit placeholder in background threads (no script context there)."""
+    def info(self, *args, **kwargs): pass
+    success = warning = error = progress = info
+    def empty(self): return self
+
+
+class VideoPrefetchPipeline:
+    """
+    Uploads and processes queued videos ahead of the one currently being analysed.
+    At most `depth` videos are prepared ahead, and a new upload only starts while the
+    bytes held in Gemini storage stay under `storage_budget_bytes` (back-pressure).
+    Consumed files are deleted from Gemini storage as soon as the caller moves on.
+    Each video gets its own deadline, started with its prefetch and cancelled with the queue's.
+    An optional local_first(video, deadline) runs before the upload; when it returns a result
+    the video is never uploaded, so only the clips it cannot handle use Gemini storage.
+    """
+    def __init__(self, videos, deadline, depth=QUEUE_PREFETCH_DEPTH, storage_budget_bytes=QUEUE_STORAGE_BUDGET_BYTES, local_first=None):
+        self._videos = list(videos) # [StoredVideo, ...] from the shared video store
+        self._deadline = deadline
+        self._local_first = local_first
+        self._video_store = get_video_store()
+        self._depth = max(1, depth)
+        self._storage_budget_bytes = storage_budget_bytes
+        self._executor = ThreadPoolExecutor(max_workers=self._depth, thread_name_prefix="scout_prefetch")
+        self._lock = threading.Lock()
+        self._futures = {} # index -> Future, for started and not yet released videos
+        self._deadlines = {} # index -> EvaluationDeadline of that video
+        self._sizes = {}
+        self._next_to_start = 0
+        self._bytes_held = 0
+
+    def __len__(self):
+        return len(self._videos)
+
+    def _fill(self):
+        with self._lock:
+            while self._next_to_start < len(self._videos):
+                size = self._videos[self._next_to_start].size
+                held = len(self._futures)
+                if held > self._depth: # The current video plus `depth` ahead
+                    break
+                if held > 0 and self._bytes_held + size > self._storage_budget_bytes:
+                    logging.info(f"Prefetch paused by storage budget ({self._bytes_held + size} > {self._storage_budget_bytes} bytes).")
+                    break
+                index = self._next_to_start
+                self._deadlines[index] = self._deadline.child(EVALUATION_DEADLINE_S)
+                self._futures[index] = self._executor.submit(self._prepare, index, self._deadlines[index])
+                self._sizes[index] = size
+                self._bytes_held += size
+                self._next_to_start += 1
+
+    def _prepare(self, index, deadline):
+        """(local_result, gemini_file): the local result when local_first handled the video, else the uploaded file."""
+        video = self._videos[index]
+        if self._local_first is not None:
+            local_result = self._local_first(video, deadline)
+            if local_result is not None:
+                with self._lock: # Nothing goes to Gemini storage for this video
+                    self._bytes_held -= self._sizes.pop(index, 0)
+                return local_result, None
+        deadline.check(f"رفع الفيديو '{video.name}'")
+        logging.info(f"Prefetching queued video {index + 1}/{len(self._videos)}: {video.name}")
+        with self._video_store.local_copy(video) as local_video_path:
+            return None, upload_and_wait_gemini(local_video_path, video.name, _SilentStatus(), deadline)
+
+    def _release(self, index, gemini_file_obj):
+        if gemini_file_obj:
+            delete_gemini_file(gemini_file_obj, _SilentStatus())
+        with self._lock:
+            self._futures.pop(index, None)
+            self._deadlines.pop(index, None)
+            self._bytes_held -= self._sizes.pop(index, 0)
+
+    def stream(self):
+        """
+        Yields (index, display_name, gemini_file_or_None, deadline, local_result_or_None) in queue
+        order; the file is deleted on the next step. Raises EvaluationStopped once the queue is
+        cancelled or out of time.
+        """
+        for index, video in enumerate(self._videos):
+            display_name = video.name
+            self._deadline.check(f"قائمة الفيديوهات ({index + 1}/{len(self._videos)})")
+            self._fill()
+            local_result, gemini_file_obj = None, None
+            try:
+                local_result, gemini_file_obj = self._deadline.wait_for(f"رفع الفيديو '{display_name}'", self._futures[index])
+            except Exception as e:
+                self._deadline.check(f"قائمة الفيديوهات ({index + 1}/{len(self._videos)})") # Stop if the whole queue was stopped, not just this video
+                logging.error(f"Prefetch failed for queued video '{display_name}': {e}", exc_info=True)
+            try:
+                yield index, display_name, gemini_file_obj, self._deadlines[index], local_result
+            finally:
+                self._release(index, gemini_file_obj)
+
+    def close(self):
+        """
+        Cancels uploads not yet started and, without waiting, deletes files prepared but never
+        consumed once their in-flight upload finishes (an interrupted run is not held up by them).
+        """
+        with self._lock:
+            pending = list(self._futures.items())
+            self._futures.clear()
+            self._deadlines.clear()
+            self._sizes.clear()
+            self._bytes_held = 0
+        for index, future in pending:
+            if not future.cancel():
+                future.add_done_callback(lambda finished, index=index: self._discard_leftover(index, finished))
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _discard_leftover(index, future):
+        """Done-callback (on the prefetch thread): deletes a file prepared after the queue was closed."""
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logging.warning(f"Ignoring failed prefetch for queued video #{index + 1} on close: {future.exception()}")
+        elif future.result()[1]:
+            delete_gemini_file(future.result()[1], _SilentStatus())
+
+
 # =========== Grading and Plotting Functions =================
 
 def evaluate_final_grade_from_individual_scores(scores_dict):
@@ -602,6 +2488,35 @@ def evaluate_final_grade_from_individual_scores(scores_dict):
     else: grade = 'ضعيف (F)'
     return {"scores": scores_dict, "total_score": total, "grade": grade, "max_score": max_possible}
 
+def provisional_evaluation(scores_dict, skill_keys):
+    """Evaluation of the skills scored so far; flagged provisional until every skill in skill_keys has a score."""
+    evaluation = evaluate_final_grade_from_individual_scores(scores_dict)
+    evaluation["provisional"] = len(scores_dict) < len(skill_keys)
+    return evaluation
+
+
+def incomplete_evaluation(scores_dict, skill_keys):
+    """Result of an all-skills run that stopped part-way: no letter grade, total out of every skill in skill_keys."""
+    return {"scores": scores_dict, "grade": GRADE_INCOMPLETE_AR, "total_score": sum(scores_dict.values()), "max_score": len(skill_keys) * MAX_SCORE_PER_SKILL}
+
+
+def render_skill_progress(scores_dict, skill_keys, skills_labels_ar):
+    """Live results of an all-skills run: provisional grade, a row per skill (pending ones marked) and the chart."""
+    evaluation = provisional_evaluation(scores_dict, skill_keys)
+    st.markdown("### 🏆 نتائج تقييم المهارات (تتحدث مع كل مهارة) 🏆")
+    res_col1, res_col2 = st.columns(2)
+    with res_col1: st.metric("🎯 التقدير المؤقت" if evaluation["provisional"] else "🎯 التقدير العام", evaluation["grade"])
+    with res_col2: st.metric("📊 مجموع النقاط حتى الآن", f"{evaluation['total_score']} / {evaluation['max_score']}")
+    st.caption(f"⏳ تم تقييم {len(scores_dict)} من {len(skill_keys)} مهارات. التقدير مؤقت حتى اكتمال جميع المهارات.")
+    st.dataframe(pd.DataFrame({
+        "المهارة": [skills_labels_ar.get(key, key) for key in skill_keys],
+        "الدرجة": [f"{scores_dict[key]} / {MAX_SCORE_PER_SKILL}" if key in scores_dict else "⏳" for key in skill_keys],
+    }), use_container_width=True, hide_index=True)
+    if scores_dict:
+        plot_fig = plot_results(evaluation, skills_labels_ar)
+        st.pyplot(plot_fig); plt.close(plot_fig)
+
+
 def plot_results(results, skills_labels_ar):
     # --- (Code from previous step - no changes needed here) ---
     if not results or 'scores' not in results or not results['scores']:
@@ -620,7 +2535,9 @@ def plot_results(results, skills_labels_ar):
         reshaped_labels = [get_display(arabic_reshaper.reshape(skills_labels_ar[key_en])) for key_en in valid_keys_en]
         scores = [scores_dict[key_en] for key_en in valid_keys_en]
         grade_display = results.get('grade', 'N/A')
-        if grade_display != 'N/A' and grade_display != 'غير مكتمل':
+        if results.get('provisional') and grade_display != 'N/A':
+            plot_title_text = f"تقييم مؤقت ({len(valid_keys_en)} مهارات) - التقدير: {grade_display} ({results.get('total_score', 0)}/{results.get('max_score', 0)})"
+        elif grade_display != 'N/A' and grade_display != GRADE_INCOMPLETE_AR:
             plot_title_text = f"التقييم النهائي - التقدير: {grade_display} ({results.get('total_score', 0)}/{results.get('max_score', 0)})"
         else:
             plot_title_text = "نتيجة المهارة";  # Default or single skill
@@ -650,6 +2567,133 @@ def plot_results(results, skills_labels_ar):
     plt.tight_layout(); return fig
 
 
+# =========== Bulk Report Export ===============================================
+
+def build_report_jobs(players, skills_labels_ar):
+    """
+    Turns [(player name, skill evaluation or None, biomechanics results or None), ...]
+    into plain-data jobs for the report worker processes.
+    """
+    jobs = []
+    for index, (player_name, evaluation, biomechanics) in enumerate(players, start=1):
+        player_stem = os.path.splitext(player_name)[0]
+        safe_stem = re.sub(r'[^\w-]+', '_', player_stem)
+        jobs.append({
+            "player": player_stem,
+            "file_stem": f"{index:03d}_{safe_stem}",
+            "evaluation": evaluation,
+            "skills_labels_ar": skills_labels_ar,
+            "biomechanics": [(BIOMECHANICS_LABELS_EN.get(key_en, key_en), format_biomechanics_value(biomechanics.get(key_en, NOT_CLEAR_AR)))
+                             for key_en in BIOMECHANICS_METRICS_EN]
+                            + [(POSE_EXTRA_LABELS_EN[key_en], format_biomechanics_value(biomechanics[key_en]))
+                               for key_en in POSE_EXTRA_METRICS_EN if key_en in biomechanics] if biomechanics else None,
+        })
+    return jobs
+
+
+@st.cache_resource
+def sweep_report_exports():
+    """Once per server process: deletes export folders older than REPORT_EXPORT_MAX_AGE_S (left by ended sessions)."""
+    cutoff = time.time() - REPORT_EXPORT_MAX_AGE_S
+    removed = 0
+    for export_dir in glob.glob(os.path.join(REPORT_EXPORT_DIR, "export_*")):
+        try:
+            if os.path.getmtime(export_dir) < cutoff:
+                shutil.rmtree(export_dir)
+                removed += 1
+        except OSError as e_sweep:
+            logging.warning(f"Could not remove old report export '{export_dir}': {e_sweep}")
+    if removed:
+        logging.info(f"Removed {removed} old report export folder(s) from {REPORT_EXPORT_DIR}.")
+    return removed
+
+
+@st.cache_resource
+def get_report_pool():
+    """One report process pool per server process, so an export does not pay the worker spawn and imports."""
+    return create_report_pool(REPORT_EXPORT_WORKERS)
+
+
+def discard_report_export():
+    """Deletes this session's last export (zip and rendered reports) from disk."""
+    zip_path = st.session_state.get("report_export_path")
+    st.session_state.report_export_path = None
+    if zip_path:
+        shutil.rmtree(os.path.dirname(zip_path), ignore_errors=True)
+
+
+def render_report_export(players, skills_labels_ar, key):
+    """Export button: renders all reports in worker processes into one zip on disk, then offers it for download."""
+    if st.button(f"📦 تصدير تقارير اللاعبين ({len(players)}) + تقرير الفريق", key=f"export_reports_{key}"):
+        discard_report_export() # Only the newest export per session is kept on disk
+        os.makedirs(REPORT_EXPORT_DIR, exist_ok=True)
+        export_dir = tempfile.mkdtemp(prefix="export_", dir=REPORT_EXPORT_DIR)
+        zip_path = os.path.join(export_dir, "scout_eye_reports.zip")
+        with st.spinner(f"🖨️ جاري إنشاء التقارير ({REPORT_EXPORT_WORKERS} عملية متوازية)..."):
+            try:
+                export_squad_reports(
+                    build_report_jobs(players, skills_labels_ar), export_dir,
+                    executor=get_report_pool(), zip_path=zip_path, max_score_per_skill=MAX_SCORE_PER_SKILL
+                )
+                st.session_state.report_export_path = zip_path
+            except BrokenProcessPool as e_export: # A worker died: the next export starts a fresh pool
+                get_report_pool.clear()
+                st.error(f"❌ فشل إنشاء التقارير: {e_export}")
+                logging.error(f"Report process pool broke during export: {e_export}", exc_info=True)
+            except Exception as e_export:
+                st.error(f"❌ فشل إنشاء التقارير: {e_export}")
+                logging.error(f"Bulk report export failed: {e_export}", exc_info=True)
+    if st.session_state.report_export_path and os.path.exists(st.session_state.report_export_path):
+        with open(st.session_state.report_export_path, "rb") as zip_file:
+            st.download_button("⬇️ تحميل التقارير (ZIP)", zip_file, file_name="scout_eye_reports.zip", mime="application/zip", key=f"download_reports_{key}")
+
+
+def render_biomechanics_metrics(results_bio):
+    """One line per biomechanics metric: English label and value (Arabic text values translated)."""
+    for key_en in BIOMECHANICS_METRICS_EN: # Iterate in defined order
+        value_raw = results_bio.get(key_en, NOT_CLEAR_AR) # Default to original Arabic constant if key missing
+        st.write(f"**{BIOMECHANICS_LABELS_EN.get(key_en, key_en)}:** {format_biomechanics_value(value_raw)}")
+    for key_en in POSE_EXTRA_METRICS_EN: # Only present when the local pose backend measured the clip
+        if key_en in results_bio:
+            st.write(f"**{POSE_EXTRA_LABELS_EN[key_en]}:** {format_biomechanics_value(results_bio[key_en])}")
+
+
+def render_player_history(key):
+    """Player progress section: running aggregates first, then one player's rows read from their partitions only."""
+    st.markdown("---")
+    if not st.checkbox("📜 عرض سجل تقدم اللاعب", key=f"show_history_{key}"):
+        return
+    store = get_player_history_store()
+    players = store.players()
+    if not players:
+        st.info("لا توجد تقييمات محفوظة بعد. ستظهر هنا نتائج كل لاعب بعد تحليلها.")
+        return
+    player = st.selectbox("اختر اللاعب:", players, key=f"history_player_{key}")
+    summary = store.summary(player)
+    col_evaluations, col_grade, col_risk = st.columns(3)
+    col_evaluations.metric("📅 عدد التقييمات", summary["evaluations"])
+    col_grade.metric("🏅 أفضل تقدير", summary["best_grade"] or "N/A")
+    risk_trend = summary["risk_trend_per_30_days"]
+    col_risk.metric(
+        "⚠️ آخر درجة خطورة", summary["risk"]["last"] if summary["risk"]["last"] is not None else "N/A",
+        delta=f"{risk_trend:+.2f} / 30 يوم" if risk_trend is not None else None, delta_color="inverse"
+    )
+
+    history = load_player_history(player, summary["evaluations"])
+    for metric, caption in (("Total_Score", "Total skill score over time"), ("Risk_Score", "Risk Score over time")):
+        metric_rows = history[history["metric"] == metric].dropna(subset=["value"])
+        if not metric_rows.empty:
+            st.caption(caption)
+            st.line_chart(metric_rows.set_index("recorded_at")["value"])
+    with st.expander("عرض السجل الكامل"):
+        metric_labels = {**SKILLS_LABELS_AGE_5_8_AR, **SKILLS_LABELS_AGE_8_PLUS_AR, **BIOMECHANICS_LABELS_EN, **STEP_EXTRA_LABELS_EN, **POSE_EXTRA_LABELS_EN}
+        st.dataframe(
+            history.pivot_table(index=["recorded_at", "season", "age_group", "video"], columns="metric", values="text", aggfunc="first")
+                   .rename(columns=metric_labels),
+            use_container_width=True
+        )
+
+
 # =========== Streamlit App Layout (Arabic) ====================================
 
 # Initialize session state variables
@@ -659,20 +2703,62 @@ if 'biomechanics_results' not in st.session_state: st.session_state.biomechanics
 if 'analysis_mode' not in st.session_state: st.session_state.analysis_mode = MODE_SINGLE_VIDEO_ALL_SKILLS_AR # Default for Legend
 if 'selected_skill_key' not in st.session_state: st.session_state.selected_skill_key = None
 if 'selected_age_group' not in st.session_state: st.session_state.selected_age_group = AGE_GROUP_8_PLUS # Default age for Legend
-if 'uploaded_file_state' not in st.session_state: st.session_state.uploaded_file_state = None # Can hold file for any page temporarily
-if 'gemini_file_object' not in st.session_state: st.session_state.gemini_file_object = None # Can hold processed file for any page
+if 'uploaded_file_state' not in st.session_state: st.session_state.uploaded_file_state = None # StoredVideo handle for any page (bytes live in the video store)
+if 'stored_upload_handles' not in st.session_state: st.session_state.stored_upload_handles = {} # Streamlit upload id -> StoredVideo
+if 'video_assets' not in st.session_state: st.session_state.video_assets = VideoAssetService() # Processed Gemini files, shared by every page
+if 'queued_files_state' not in st.session_state: st.session_state.queued_files_state = [] # StoredVideo handles waiting in a queue
+if 'leaderboards' not in st.session_state: st.session_state.leaderboards = {} # Age group -> Leaderboard, kept for the whole trial day
+if 'report_export_path' not in st.session_state: st.session_state.report_export_path = None # Last bulk report zip on this server
+if 'queue_results' not in st.session_state: st.session_state.queue_results = None # Per-video results of a queued run (Legend or Star)
+if 'biomechanics_steps' not in st.session_state: st.session_state.biomechanics_steps = None # STEP_SERIES_DTYPE array of the last extended Star run
+if 'biomechanics_timing' not in st.session_state: st.session_state.biomechanics_timing = None # Time to first metric / total latency of the last Star run
+if 'star_input_mode' not in st.session_state: st.session_state.star_input_mode = STAR_MODE_SINGLE_AR
+if 'biomechanics_backend' not in st.session_state: st.session_state.biomechanics_backend = BIOMECHANICS_BACKEND # Local pose, Gemini, or local with Gemini fallback
+if 'active_evaluation' not in st.session_state: st.session_state.active_evaluation = None # EvaluationDeadline of the evaluation this session is running
+if 'scheduler_owner' not in st.session_state: st.session_state.scheduler_owner = uuid.uuid4().hex # This session's identity in the fair-share scheduler
+sweep_report_exports() # Once per server process: drop exports left by sessions of earlier runs
+
+# --- Evaluation lifecycle (at most one running evaluation per session) ---
+def cancel_active_evaluation(reason):
+    """Stops this session's running evaluation: pending calls are dropped and its in-flight upload deleted."""
+    if st.session_state.active_evaluation:
+        st.session_state.active_evaluation.token.cancel(reason)
+        st.session_state.active_evaluation = None
+
+
+def start_evaluation(budget_s=EVALUATION_DEADLINE_S, priority=SCHEDULER_PRIORITY_BULK):
+    """New submission: cancels the previous evaluation and starts a deadline with a countdown line."""
+    cancel_active_evaluation("new submission")
+    deadline = EvaluationDeadline(budget_s, countdown=st.empty(), owner=st.session_state.scheduler_owner, priority=priority)
+    st.session_state.active_evaluation = deadline
+    return deadline
+
+
+def finish_evaluation(deadline):
+    deadline.close()
+    if st.session_state.active_evaluation is deadline:
+        st.session_state.active_evaluation = None
+
 
 # --- Helper to clear state on page change ---
 def clear_page_specific_state():
+    cancel_active_evaluation("page switch")
     st.session_state.evaluation_results = None
     st.session_state.biomechanics_results = None
+    st.session_state.biomechanics_steps = None
+    st.session_state.biomechanics_timing = None
     st.session_state.uploaded_file_state = None
-    # Keep gemini_file_object? Maybe clear it too for simplicity, forcing re-upload on page switch
-    # If we clear it, add cleanup here:
-    if 'gemini_file_object' in st.session_state and st.session_state.gemini_file_object:
-         logging.info(f"Clearing Gemini file object {st.session_state.gemini_file_object.name} due to page switch.")
-         # delete_gemini_file(st.session_state.gemini_file_object, st.empty()) # Add deletion on page switch if desired
-         st.session_state.gemini_file_object = None
+    st.session_state.queued_files_state = []
+    st.session_state.queue_results = None
+    discard_report_export()
+    # Processed Gemini files stay in st.session_state.video_assets, so the other page can reuse them
+
+
+def switch_page(page):
+    """Leaving a page cancels its running evaluation and clears its state."""
+    if st.session_state.page != page:
+        clear_page_specific_state()
+    st.session_state.page = page
 
 
 # --- Page config, CSS, etc. is still above here ---
@@ -697,13 +2783,13 @@ with col_b2:
     c1, c2, c3 = st.columns(3)
     with c1:
         if st.button("✔️ الشخص المناسب", key="btn_person"):
-            st.session_state.page = PAGE_PERSON
+            switch_page(PAGE_PERSON)
     with c2:
         if st.button("⭐ نجم لا يغيب", key="btn_star"):
-            st.session_state.page = PAGE_STAR
+            switch_page(PAGE_STAR)
     with c3:
         if st.button("⚽ إسطورة الغد", key="btn_legend"):
-            st.session_state.page = PAGE_LEGEND
+            switch_page(PAGE_LEGEND)
 
 
 # --- Conditional Page Content ---
@@ -739,7 +2825,7 @@ if st.session_state.page == PAGE_LEGEND:
 
     # --- Analysis Mode Selection ---
     st.markdown("<h3 style='text-align: center;'>2. اختر طريقة التحليل</h3>", unsafe_allow_html=True)
-    analysis_options = [MODE_SINGLE_VIDEO_ALL_SKILLS_AR, MODE_SINGLE_VIDEO_ONE_SKILL_AR]
+    analysis_options = [MODE_SINGLE_VIDEO_ALL_SKILLS_AR, MODE_SINGLE_VIDEO_ONE_SKILL_AR, MODE_FULL_REPORT_AR, MODE_VIDEO_QUEUE_ALL_SKILLS_AR, MODE_LEADERBOARD_AR]
     st.session_state.analysis_mode = st.radio(
         "طريقة التحليل:", options=analysis_options,
         index=analysis_options.index(st.session_state.analysis_mode),
@@ -786,17 +2872,61 @@ if st.session_state.page == PAGE_LEGEND:
                 key="upload_legend_one" # Page specific key
                 )
 
+    elif st.session_state.analysis_mode == MODE_FULL_REPORT_AR:
+        st.markdown(f"<p style='text-align: center; font-size: 1.1em;'>تقييم جميع مهارات فئة '{st.session_state.selected_age_group}' والتحليل البيوميكانيكي معاً من رفع واحد للفيديو</p>", unsafe_allow_html=True)
+        uploaded_file_legend = st.file_uploader(
+            "📂 ارفع فيديو اللاعب:", type=["mp4", "avi", "mov", "mkv", "webm"],
+            key="upload_legend_full" # Page specific key
+            )
+
+    elif st.session_state.analysis_mode == MODE_VIDEO_QUEUE_ALL_SKILLS_AR:
+        st.markdown(f"<p style='text-align: center; font-size: 1.1em;'>لتقييم جميع مهارات فئة '{st.session_state.selected_age_group}' لعدة لاعبين (فيديو لكل لاعب)، يتم رفع الفيديوهات التالية أثناء تحليل الحالي</p>", unsafe_allow_html=True)
+        queued_files_legend = st.file_uploader(
+            "📂 ارفع فيديوهات اللاعبين بالترتيب:", type=["mp4", "avi", "mov", "mkv", "webm"],
+            accept_multiple_files=True,
+            key="upload_legend_queue" # Page specific key
+            )
+        st.session_state.queued_files_state = [store_uploaded_video(f) for f in queued_files_legend or []]
+
+    elif st.session_state.analysis_mode == MODE_LEADERBOARD_AR:
+        st.markdown(f"<p style='text-align: center; font-size: 1.1em;'>لمقارنة لاعبي فئة '{st.session_state.selected_age_group}' وترتيبهم (فيديو لكل لاعب، اسم الملف = اسم اللاعب)</p>", unsafe_allow_html=True)
+        player_files_legend = st.file_uploader(
+            "📂 ارفع فيديوهات اللاعبين:", type=["mp4", "avi", "mov", "mkv", "webm"],
+            accept_multiple_files=True,
+            key="upload_legend_leaderboard" # Page specific key
+            )
+        st.session_state.queued_files_state = [store_uploaded_video(f) for f in player_files_legend or []]
+
+    if st.session_state.selected_age_group not in st.session_state.leaderboards:
+        st.session_state.leaderboards[st.session_state.selected_age_group] = Leaderboard(current_skills_en)
+    current_leaderboard = st.session_state.leaderboards[st.session_state.selected_age_group]
+
     # Store the Streamlit uploaded file object in session state
     if uploaded_file_legend:
-        st.session_state.uploaded_file_state = uploaded_file_legend
+        st.session_state.uploaded_file_state = store_uploaded_video(uploaded_file_legend)
     # Don't automatically clear if None, user might just be switching modes
 
+    # --- Player name for the history store (queued and leaderboard videos are named after their files) ---
+    player_name_legend = ""
+    if st.session_state.analysis_mode in (MODE_SINGLE_VIDEO_ALL_SKILLS_AR, MODE_SINGLE_VIDEO_ONE_SKILL_AR, MODE_FULL_REPORT_AR):
+        player_name_legend = st.text_input("👤 اسم اللاعب (اختياري، لحفظ النتائج في سجل تقدمه):", key="legend_player_name")
+
     # Determine if ready to analyze
     ready_to_analyze_legend = False
-    if st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ALL_SKILLS_AR:
+    if st.session_state.analysis_mode in (MODE_SINGLE_VIDEO_ALL_SKILLS_AR, MODE_FULL_REPORT_AR):
         ready_to_analyze_legend = st.session_state.uploaded_file_state is not None
     elif st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ONE_SKILL_AR:
         ready_to_analyze_legend = st.session_state.uploaded_file_state is not None and skill_to_analyze_key_en is not None
+    elif st.session_state.analysis_mode in (MODE_VIDEO_QUEUE_ALL_SKILLS_AR, MODE_LEADERBOARD_AR):
+        ready_to_analyze_legend = len(st.session_state.queued_files_state) > 0
+
+    # --- Offer stored results for a near-duplicate of an already analysed clip ---
+    if st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ALL_SKILLS_AR and st.session_state.uploaded_file_state:
+        def reuse_legend_results(results):
+            st.session_state.evaluation_results = results
+        render_previous_results_offer(
+            st.session_state.uploaded_file_state, f"skills:{st.session_state.selected_age_group}", "reuse_legend_results", reuse_legend_results
+        )
 
     st.markdown("---")
 
@@ -804,71 +2934,126 @@ if st.session_state.page == PAGE_LEGEND:
     st.markdown("<h3 style='text-align: center;'>4. ابدأ التحليل</h3>", unsafe_allow_html=True)
     button_col1, button_col2, button_col3 = st.columns([1, 2, 1])
     with button_col2:
-        if st.button("🚀 بدء تحليل المهارات", key="start_legend_eval", disabled=not ready_to_analyze_legend, use_container_width=True):
+        if st.session_state.analysis_mode == MODE_LEADERBOARD_AR:
+            if st.button("🏁 بدء تقييم اللاعبين وترتيبهم", key="start_legend_leaderboard_eval", disabled=not ready_to_analyze_legend, use_container_width=True):
+                st.session_state.evaluation_results = None
+                players_to_evaluate = st.session_state.queued_files_state
+                st.info(f"سيتم تقييم {len(players_to_evaluate)} لاعب ({ANALYSIS_POOL_WORKERS} في نفس الوقت كحد أقصى)...")
+                leaderboard_progress = st.progress(0.0, text=f"0 / {len(players_to_evaluate)}")
+                live_leaderboard_placeholder = st.empty()
+                batch_deadline = start_evaluation(EVALUATION_DEADLINE_S * len(players_to_evaluate))
+                executor = get_analysis_executor()
+                video_store = get_video_store()
+                future_to_video = {
+                    executor.submit(evaluate_player_clip, session_model, video_store, video,
+                                    current_skills_en, st.session_state.selected_age_group, batch_deadline): video
+                    for video in players_to_evaluate
+                }
+                try:
+                    for done_count, future in enumerate(batch_deadline.as_completed("تقييم اللاعبين", future_to_video), start=1):
+                        video = future_to_video[future]
+                        try:
+                            player_evaluation = future.result()
+                        except Exception as e_player:
+                            player_evaluation = None
+                            logging.error(f"Leaderboard evaluation failed for '{video.name}': {e_player}", exc_info=True)
+                        if player_evaluation:
+                            current_leaderboard.add(video.content_hash, video.name, player_evaluation)
+                            record_player_history(history_player_name("", video.name), st.session_state.selected_age_group, video.name, HISTORY_SOURCE_SKILLS, player_evaluation)
+                            live_leaderboard_placeholder.dataframe(
+                                build_leaderboard_frame(current_leaderboard, LEADERBOARD_DEFAULT_TOP_K, LEADERBOARD_RANK_BY_TOTAL, current_skills_labels_ar),
+                                use_container_width=True
+                            )
+                        else:
+                            st.error(f"❌ فشل تقييم اللاعب '{video.name}'.")
+                        leaderboard_progress.progress(done_count / len(players_to_evaluate), text=f"{done_count} / {len(players_to_evaluate)}")
+                except EvaluationStopped as e_stopped:
+                    batch_deadline.token.cancel(str(e_stopped)) # Players not yet evaluated are dropped
+                    st.warning(f"⏹️ توقف تقييم اللاعبين: {e_stopped}")
+                except BaseException: # Streamlit stopped this run (the user moved on): drop the remaining players
+                    batch_deadline.token.cancel("run interrupted")
+                    raise
+                else:
+                    st.success("🎉 اكتمل تقييم اللاعبين وتحديث لوحة الترتيب!")
+                finally:
+                    finish_evaluation(batch_deadline)
+                live_leaderboard_placeholder.empty() # The leaderboard section below takes over
+
+        elif st.session_state.analysis_mode == MODE_VIDEO_QUEUE_ALL_SKILLS_AR:
+            if st.button("🚀 بدء تحليل قائمة الفيديوهات", key="start_legend_queue_eval", disabled=not ready_to_analyze_legend, use_container_width=True):
+                st.session_state.evaluation_results = None
+                st.session_state.queue_results = []
+                queue_deadline = start_evaluation(EVALUATION_DEADLINE_S * len(st.session_state.queued_files_state))
+                pipeline = VideoPrefetchPipeline(st.session_state.queued_files_state, queue_deadline)
+                queue_progress = st.progress(0.0, text=f"0 / {len(pipeline)}")
+                try:
+                    for index, video_name, gemini_file_to_use, video_deadline, _ in pipeline.stream():
+                        st.markdown(f"#### 🎬 {index + 1}. {video_name}")
+                        if not gemini_file_to_use:
+                            st.error(f"❌ فشل رفع/معالجة الفيديو '{video_name}'. سيتم الانتقال للفيديو التالي.")
+                            st.session_state.queue_results.append({"video": video_name, "results": None})
+                        else:
+                            results_dict = run_skill_evaluation(
+                                session_model, gemini_file_to_use, current_skills_en,
+                                st.session_state.selected_age_group, st.container(), video_deadline
+                            )
+                            if len(results_dict) < len(current_skills_en): # Deadline or cancellation stopped it part-way
+                                video_results = incomplete_evaluation(results_dict, current_skills_en)
+                                st.warning(f"⚠️ {video_name}: تم تحليل {len(results_dict)} من {len(current_skills_en)} مهارات فقط، لذلك لا يوجد تقدير نهائي.")
+                            else:
+                                video_results = evaluate_final_grade_from_individual_scores(results_dict)
+                            st.session_state.queue_results.append({"video": video_name, "results": video_results})
+                            record_player_history(history_player_name("", video_name), st.session_state.selected_age_group, video_name, HISTORY_SOURCE_SKILLS, video_results)
+                            st.success(f"🎯 {video_name}: {video_results['grade']} ({video_results['total_score']}/{video_results['max_score']})")
+                        queue_progress.progress((index + 1) / len(pipeline), text=f"{index + 1} / {len(pipeline)}")
+                except EvaluationStopped as e_stopped:
+                    st.warning(f"⏹️ توقف تحليل قائمة الفيديوهات: {e_stopped}")
+                except BaseException: # Streamlit stopped this run (the user moved on): drop the rest of the queue
+                    queue_deadline.token.cancel("run interrupted")
+                    raise
+                else:
+                    st.success("🎉 اكتمل تحليل جميع الفيديوهات في القائمة!")
+                finally:
+                    pipeline.close()
+                    finish_evaluation(queue_deadline)
+
+        elif st.button("🚀 بدء تحليل المهارات", key="start_legend_eval", disabled=not ready_to_analyze_legend, use_container_width=True):
             st.session_state.evaluation_results = None # Clear previous skill results
-            local_temp_file_path = None
             analysis_error = False
             gemini_file_to_use = None
+            evaluation_deadline = start_evaluation( # One deadline for upload, processing and every skill
+                priority=SCHEDULER_PRIORITY_INTERACTIVE if st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ONE_SKILL_AR else SCHEDULER_PRIORITY_BULK
+            )
 
-            # --- Check/Upload Video ---
-            # Check if existing Gemini file object corresponds to the current upload
-            should_upload = True
-            current_upload_name = st.session_state.uploaded_file_state.name if st.session_state.uploaded_file_state else None
-            if st.session_state.gemini_file_object and current_upload_name and st.session_state.gemini_file_object.display_name.endswith(current_upload_name):
-                 try:
-                      status_check_placeholder = st.empty()
-                      status_check_placeholder.info("🔄 التحقق من حالة الفيديو المرفوع سابقاً...")
-                      check_file = genai.get_file(st.session_state.gemini_file_object.name)
-                      if check_file.state.name == "ACTIVE":
-                           status_check_placeholder.success("✅ الفيديو المرفوع سابقاً لا يزال جاهزاً.")
-                           should_upload = False
-                           gemini_file_to_use = st.session_state.gemini_file_object
-                           logging.info(f"Reusing existing ACTIVE Gemini file for Legend: {gemini_file_to_use.name}")
-                           time.sleep(1) # Brief pause for user to see message
-                           status_check_placeholder.empty()
-                      else:
-                           status_check_placeholder.warning(f"⚠️ الفيديو المرفوع سابقاً لم يعد صالحاً (الحالة: {check_file.state.name}). سيتم إعادة الرفع.")
-                           logging.warning(f"Previous Gemini file {st.session_state.gemini_file_object.name} no longer ACTIVE (State: {check_file.state.name}). Re-uploading.")
-                           st.session_state.gemini_file_object = None # Clear invalid reference
-                           time.sleep(2)
-                           status_check_placeholder.empty()
-                 except Exception as e_check:
-                      status_check_placeholder.warning(f"⚠️ فشل التحقق من الفيديو السابق ({e_check}). سيتم إعادة الرفع.")
-                      logging.warning(f"Failed to check status of previous Gemini file {st.session_state.gemini_file_object.name}: {e_check}. Re-uploading.")
-                      st.session_state.gemini_file_object = None
-                      time.sleep(2)
-                      status_check_placeholder.empty()
-
-            if should_upload and st.session_state.uploaded_file_state:
-                st.session_state.gemini_file_object = None # Ensure old object is cleared
-                status_placeholder_upload = st.empty()
-                try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(st.session_state.uploaded_file_state.name)[1]) as tmp_file:
-                        tmp_file.write(st.session_state.uploaded_file_state.getvalue())
-                        local_temp_file_path = tmp_file.name
-                    gemini_file_to_use = upload_and_wait_gemini(
-                        local_temp_file_path, st.session_state.uploaded_file_state.name, status_placeholder_upload
-                    )
-                    if gemini_file_to_use:
-                        st.session_state.gemini_file_object = gemini_file_to_use # Store successfully uploaded file
-                    else:
-                        analysis_error = True
-                except Exception as e_upload:
-                    status_placeholder_upload.error(f"❌ حدث خطأ فادح أثناء تحضير الفيديو: {e_upload}")
-                    logging.error(f"Fatal error during Legend video prep/upload: {e_upload}", exc_info=True)
-                    analysis_error = True
-                finally:
-                     if local_temp_file_path and os.path.exists(local_temp_file_path):
-                         try: os.remove(local_temp_file_path); logging.info(f"Deleted local temp file: {local_temp_file_path}")
-                         except Exception as e_del: logging.warning(f"Could not delete local temp file {local_temp_file_path}: {e_del}")
-
-            # --- Analyze Skills ---
+            # --- Upload Video (or reuse the session's processed file for this clip) ---
+            status_placeholder_upload = st.empty()
+            try:
+                gemini_file_to_use = st.session_state.video_assets.ensure_active(st.session_state.uploaded_file_state, status_placeholder_upload, evaluation_deadline)
+                analysis_error = gemini_file_to_use is None
+            except Exception as e_upload:
+                status_placeholder_upload.error(f"❌ حدث خطأ فادح أثناء تحضير الفيديو: {e_upload}")
+                logging.error(f"Fatal error during Legend video prep/upload: {e_upload}", exc_info=True)
+                analysis_error = True
+
+            # --- Analyze Skills (the full report also runs biomechanics alongside, on the same file) ---
+            all_skills_mode = st.session_state.analysis_mode in (MODE_SINGLE_VIDEO_ALL_SKILLS_AR, MODE_FULL_REPORT_AR)
+            biomechanics_future = None
+            if not analysis_error and gemini_file_to_use and st.session_state.analysis_mode == MODE_FULL_REPORT_AR:
+                st.session_state.biomechanics_results = None
+                # Its own thread, not the shared analysis pool: other sessions' player evaluations
+                # must not delay it into this run's deadline (Gemini calls are still admitted by the scheduler)
+                biomechanics_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scout_report_biomechanics")
+                biomechanics_future = biomechanics_executor.submit(
+                    analyze_biomechanics_video, session_model, gemini_file_to_use, _SilentStatus(), deadline=evaluation_deadline,
+                    video=st.session_state.uploaded_file_state, backend=st.session_state.biomechanics_backend
+                )
+                biomechanics_executor.shutdown(wait=False) # The thread ends once this one task is done
             if not analysis_error and gemini_file_to_use:
                 results_dict = {}
                 with st.spinner("🧠 Gemini يحلل المهارات المطلوبة..."):
                     analysis_status_container = st.container()
                     skills_to_process_keys = []
-                    if st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ALL_SKILLS_AR:
+                    if all_skills_mode:
                         skills_to_process_keys = current_skills_en
                     elif st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ONE_SKILL_AR:
                         if skill_to_analyze_key_en: skills_to_process_keys = [skill_to_analyze_key_en]
@@ -877,25 +3062,33 @@ if st.session_state.page == PAGE_LEGEND:
                          st.error("لم يتم تحديد مهارات للتحليل."); analysis_error = True
                     else:
                          st.info(f"سيتم تحليل {len(skills_to_process_keys)} مهارة...")
-                         for skill_key in skills_to_process_keys:
-                             status_skill_analysis = analysis_status_container.empty()
-                             score = analyze_video_with_prompt(
-                                 gemini_file_to_use, skill_key,
-                                 st.session_state.selected_age_group, status_skill_analysis
-                             )
-                             results_dict[skill_key] = score
-                             # Add small delay if needed for API rate limits or UI updates
-                             # time.sleep(1)
+                         # Live results: redrawn in place after every skill, then replaced by the final results below.
+                         # A placeholder, not an st.fragment: a fragment only reruns between script runs, and this
+                         # run is busy scoring, so the placeholder is what can change while the skills arrive.
+                         live_results_placeholder = st.empty()
+
+                         def show_skill_progress(scores_so_far):
+                             with live_results_placeholder.container():
+                                 render_skill_progress(scores_so_far, skills_to_process_keys, current_skills_labels_ar)
+                         if all_skills_mode:
+                             show_skill_progress({})
+                         results_dict = run_skill_evaluation(
+                             session_model, gemini_file_to_use, skills_to_process_keys,
+                             st.session_state.selected_age_group, analysis_status_container, evaluation_deadline,
+                             on_score=show_skill_progress if all_skills_mode else None
+                         )
+                         live_results_placeholder.empty()
 
                          # --- Calculate Final Grade ---
-                         if st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ALL_SKILLS_AR:
+                         if all_skills_mode:
                              if len(results_dict) == len(current_skills_en):
                                  st.session_state.evaluation_results = evaluate_final_grade_from_individual_scores(results_dict)
+                                 remember_results(st.session_state.uploaded_file_state, f"skills:{st.session_state.selected_age_group}", st.session_state.evaluation_results)
                                  st.success("🎉 تم حساب التقييم النهائي للمهارات بنجاح!")
                                  st.balloons()
                              else:
                                  st.warning(f"لم يتم تحليل جميع المهارات المتوقعة ({len(current_skills_en)}). النتائج قد تكون غير مكتملة.")
-                                 st.session_state.evaluation_results = {"scores": results_dict, "grade": "غير مكتمل", "total_score": sum(results_dict.values()), "max_score": len(current_skills_en) * MAX_SCORE_PER_SKILL}
+                                 st.session_state.evaluation_results = incomplete_evaluation(results_dict, current_skills_en)
                          elif st.session_state.analysis_mode == MODE_SINGLE_VIDEO_ONE_SKILL_AR:
                              if results_dict:
                                   st.session_state.evaluation_results = {"scores": results_dict, "grade": "N/A", "total_score": sum(results_dict.values()), "max_score": MAX_SCORE_PER_SKILL}
@@ -904,7 +3097,38 @@ if st.session_state.page == PAGE_LEGEND:
                              else:
                                   st.error("فشل تحليل المهارة المحددة."); analysis_error = True
 
-            # Note: Cleanup of Gemini file happens on next run check or page switch
+            if st.session_state.evaluation_results:
+                record_player_history(
+                    history_player_name(player_name_legend, st.session_state.uploaded_file_state.name),
+                    st.session_state.selected_age_group, st.session_state.uploaded_file_state.name,
+                    HISTORY_SOURCE_SKILLS, st.session_state.evaluation_results
+                )
+
+            # --- Full report: collect the biomechanics analysis that ran alongside the skills ---
+            if biomechanics_future:
+                biomechanics_status = st.empty()
+                biomechanics_status.info("🔬 بانتظار اكتمال التحليل البيوميكانيكي...")
+                try:
+                    biomechanics_results = evaluation_deadline.wait_for("التحليل البيوميكانيكي", biomechanics_future)
+                except EvaluationStopped as e_stopped:
+                    biomechanics_status.warning(f"⏹️ توقف التحليل البيوميكانيكي: {e_stopped}")
+                except BaseException: # Streamlit stopped this run: stop the biomechanics call too
+                    evaluation_deadline.token.cancel("run interrupted")
+                    raise
+                else:
+                    if any(value != NOT_CLEAR_AR for value in biomechanics_results.values()):
+                        st.session_state.biomechanics_results = biomechanics_results
+                        biomechanics_status.success("✅ اكتمل التحليل البيوميكانيكي.")
+                        remember_results(st.session_state.uploaded_file_state, "biomechanics", biomechanics_results)
+                        record_player_history(
+                            history_player_name(player_name_legend, st.session_state.uploaded_file_state.name),
+                            st.session_state.selected_age_group, st.session_state.uploaded_file_state.name,
+                            HISTORY_SOURCE_BIOMECHANICS, biomechanics_results
+                        )
+                    else:
+                        biomechanics_status.error("❌ فشل التحليل البيوميكانيكي أو لم يتم التعرف على أي مقاييس.")
+            finish_evaluation(evaluation_deadline)
+            # Note: The Gemini file stays in video_assets for reuse; it is deleted once the session holds VIDEO_ASSET_MAX_FILES newer ones
 
     # --- Display Stored Skill Evaluation Results ---
     if st.session_state.evaluation_results:
@@ -913,7 +3137,7 @@ if st.session_state.page == PAGE_LEGEND:
         st.markdown("---")
         st.markdown("### 🏆 نتائج تقييم المهارات 🏆")
         plot_labels_ar = current_skills_labels_ar
-        if 'grade' in results and results['grade'] != "N/A" and results['grade'] != "غير مكتمل":
+        if 'grade' in results and results['grade'] != "N/A" and results['grade'] != GRADE_INCOMPLETE_AR:
             res_col1, res_col2 = st.columns(2)
             with res_col1: st.metric("🎯 التقدير العام", results['grade'])
             with res_col2: st.metric("📊 مجموع النقاط", f"{results.get('total_score', '0')} / {results.get('max_score', '0')}")
@@ -943,6 +3167,58 @@ if st.session_state.page == PAGE_LEGEND:
                     #     for key, score in results.get('scores', {}).items(): st.write(f"- {plot_labels_ar.get(key, key)}: {score}/{MAX_SCORE_PER_SKILL}")
         else: st.warning("لم يتم العثور على نتائج لعرضها.")
 
+    # --- Display Full Report Biomechanics (next to the skill results above) ---
+    if st.session_state.analysis_mode == MODE_FULL_REPORT_AR and st.session_state.biomechanics_results:
+        st.markdown("---")
+        st.markdown("### 📊 نتائج التحليل البيوميكانيكي 📊")
+        render_biomechanics_metrics(st.session_state.biomechanics_results)
+
+    # --- Display Queued Run Results (one row per player video) ---
+    if st.session_state.analysis_mode == MODE_VIDEO_QUEUE_ALL_SKILLS_AR and st.session_state.queue_results:
+        st.markdown("---")
+        st.markdown("### 🏆 نتائج قائمة الفيديوهات 🏆")
+        queue_rows = []
+        for entry in st.session_state.queue_results:
+            row = {"الفيديو": entry["video"]}
+            if entry["results"]:
+                for key, score in entry["results"]["scores"].items():
+                    row[current_skills_labels_ar.get(key, key)] = score
+                row["المجموع"] = f"{entry['results']['total_score']} / {entry['results']['max_score']}"
+                row["التقدير"] = entry["results"]["grade"]
+            else:
+                row["التقدير"] = "فشل التحليل"
+            queue_rows.append(row)
+        st.dataframe(pd.DataFrame(queue_rows), use_container_width=True)
+        render_report_export(
+            [(entry["video"], entry["results"], None) for entry in st.session_state.queue_results],
+            current_skills_labels_ar, key="legend_queue"
+        )
+
+    # --- Display Leaderboard (persists across reruns and runs for this age group) ---
+    if st.session_state.analysis_mode == MODE_LEADERBOARD_AR and len(current_leaderboard) > 0:
+        st.markdown("---")
+        st.markdown(f"### 🥇 لوحة ترتيب اللاعبين - {st.session_state.selected_age_group} ({len(current_leaderboard)} لاعب) 🥇")
+        rank_col, top_k_col, clear_col = st.columns([2, 2, 1])
+        with rank_col:
+            rank_by = st.selectbox(
+                "الترتيب حسب:", options=[LEADERBOARD_RANK_BY_TOTAL] + current_skills_en,
+                format_func=lambda key: "المجموع الكلي" if key == LEADERBOARD_RANK_BY_TOTAL else current_skills_labels_ar.get(key, key),
+                key="leaderboard_rank_by"
+            )
+        with top_k_col:
+            top_k = st.number_input("عدد اللاعبين المعروضين:", min_value=1, value=LEADERBOARD_DEFAULT_TOP_K, step=1, key="leaderboard_top_k")
+        with clear_col:
+            if st.button("🗑️ مسح اللوحة", key="clear_leaderboard"):
+                st.session_state.leaderboards[st.session_state.selected_age_group] = Leaderboard(current_skills_en)
+                st.rerun()
+        st.dataframe(build_leaderboard_frame(current_leaderboard, int(top_k), rank_by, current_skills_labels_ar), use_container_width=True, hide_index=True)
+        render_report_export(
+            [(player_name, evaluation, None) for _, player_name, evaluation in current_leaderboard.top(len(current_leaderboard))],
+            current_skills_labels_ar, key="legend_leaderboard"
+        )
+
+    render_player_history("legend")
+
 # ==================================
 # ==      نجم لا يغيب Page       ==
 # ==================================
@@ -953,16 +3229,57 @@ elif st.session_state.page == PAGE_STAR:
 
     # --- File Upload ---
     st.markdown("<h3 style='text-align: center;'>1. ارفع فيديو الحركة (يفضل الجري)</h3>", unsafe_allow_html=True)
-    uploaded_file_star = st.file_uploader(
-        "📂 ارفع فيديو واحد للتحليل البيوميكانيكي:", type=["mp4", "avi", "mov", "mkv", "webm"],
-        key="upload_star_biomechanics" # Page specific key
+    star_input_options = [STAR_MODE_SINGLE_AR, STAR_MODE_QUEUE_AR]
+    st.session_state.star_input_mode = st.radio(
+        "عدد الفيديوهات:", options=star_input_options,
+        index=star_input_options.index(st.session_state.star_input_mode),
+        key="star_input_mode_radio", horizontal=True
     )
 
-    if uploaded_file_star:
-        st.session_state.uploaded_file_state = uploaded_file_star
-    # Don't clear if None immediately
+    if st.session_state.star_input_mode == STAR_MODE_QUEUE_AR:
+        queued_files_star = st.file_uploader(
+            "📂 ارفع فيديوهات اللاعبين بالترتيب (يتم رفع التالي أثناء تحليل الحالي):", type=["mp4", "avi", "mov", "mkv", "webm"],
+            accept_multiple_files=True,
+            key="upload_star_queue" # Page specific key
+        )
+        st.session_state.queued_files_state = [store_uploaded_video(f) for f in queued_files_star or []]
+        ready_to_analyze_star = len(st.session_state.queued_files_state) > 0
+    else:
+        uploaded_file_star = st.file_uploader(
+            "📂 ارفع فيديو واحد للتحليل البيوميكانيكي:", type=["mp4", "avi", "mov", "mkv", "webm"],
+            key="upload_star_biomechanics" # Page specific key
+        )
 
-    ready_to_analyze_star = st.session_state.uploaded_file_state is not None
+        if uploaded_file_star:
+            st.session_state.uploaded_file_state = store_uploaded_video(uploaded_file_star)
+        # Don't clear if None immediately
+
+        ready_to_analyze_star = st.session_state.uploaded_file_state is not None
+        player_name_star = st.text_input("👤 اسم اللاعب (اختياري، لحفظ النتائج في سجل تقدمه):", key="star_player_name")
+
+        # --- Offer stored results for a near-duplicate of an already analysed clip ---
+        if st.session_state.uploaded_file_state:
+            def reuse_star_results(results):
+                st.session_state.biomechanics_results = results
+                st.session_state.biomechanics_steps = None
+                st.session_state.biomechanics_timing = None
+            render_previous_results_offer(st.session_state.uploaded_file_state, "biomechanics", "reuse_star_results", reuse_star_results)
+
+    star_age_options = [AGE_GROUP_5_8, AGE_GROUP_8_PLUS]
+    st.session_state.selected_age_group = st.radio(
+        "الفئة العمرية (لسجل اللاعب):", options=star_age_options,
+        index=star_age_options.index(st.session_state.selected_age_group),
+        key="star_age_group_radio", horizontal=True
+    )
+    st.session_state.biomechanics_backend = st.radio(
+        "محرك التحليل البيوميكانيكي:", options=list(BIOMECHANICS_BACKENDS),
+        index=BIOMECHANICS_BACKENDS.index(st.session_state.biomechanics_backend),
+        format_func=BIOMECHANICS_BACKEND_LABELS_AR.get, key="star_biomechanics_backend_radio", horizontal=True
+    )
+    if st.session_state.biomechanics_backend != BIOMECHANICS_BACKEND_GEMINI and get_pose_estimator() is None:
+        st.caption("ℹ️ تقدير الوضعيات المحلي غير متاح على هذا الخادم (يتطلب mediapipe و OpenCV)، لذلك سيتم استخدام Gemini.")
+    step_series_mode = st.checkbox("👣 قياس كل خطوة على حدة (تحليل موسع: التباين والإجهاد عبر الخطوات)", value=False, key="star_step_series")
+    stream_biomechanics = st.checkbox("⚡ عرض المقاييس فور وصولها (بث مباشر)", value=True, key="star_stream_metrics", disabled=step_series_mode) and not step_series_mode
 
     st.markdown("---")
 
@@ -970,61 +3287,130 @@ elif st.session_state.page == PAGE_STAR:
     st.markdown("<h3 style='text-align: center;'>2. ابدأ التحليل البيوميكانيكي</h3>", unsafe_allow_html=True)
     button_col1_star, button_col2_star, button_col3_star = st.columns([1, 2, 1])
     with button_col2_star:
-        if st.button("🔬 بدء تحليل البيوميكانيكا", key="start_star_eval", disabled=not ready_to_analyze_star, use_container_width=True):
+        if st.session_state.star_input_mode == STAR_MODE_QUEUE_AR:
+            if st.button("🔬 بدء تحليل قائمة الفيديوهات", key="start_star_queue_eval", disabled=not ready_to_analyze_star, use_container_width=True):
+                st.session_state.biomechanics_results = None
+                st.session_state.queue_results = []
+                queue_deadline = start_evaluation(EVALUATION_DEADLINE_S * len(st.session_state.queued_files_state))
+                pipeline = VideoPrefetchPipeline(
+                    st.session_state.queued_files_state, queue_deadline,
+                    local_first=queue_local_biomechanics(st.session_state.biomechanics_backend)
+                )
+                queue_progress = st.progress(0.0, text=f"0 / {len(pipeline)}")
+                try:
+                    for index, video_name, gemini_file_to_use, video_deadline, local_results in pipeline.stream():
+                        st.markdown(f"#### 🎬 {index + 1}. {video_name}")
+                        if local_results is None and not gemini_file_to_use:
+                            st.error(f"❌ فشل رفع/معالجة الفيديو '{video_name}'. سيتم الانتقال للفيديو التالي.")
+                            st.session_state.queue_results.append({"video": video_name, "results": None})
+                        else:
+                            video_results = local_results or analyze_biomechanics_video(
+                                session_model, gemini_file_to_use, st.empty(), deadline=video_deadline
+                            )
+                            st.session_state.queue_results.append({"video": video_name, "results": video_results})
+                            if any(value != NOT_CLEAR_AR for value in video_results.values()):
+                                record_player_history(history_player_name("", video_name), st.session_state.selected_age_group, video_name, HISTORY_SOURCE_BIOMECHANICS, video_results)
+                            st.success(f"🔬 {video_name}: {BIOMECHANICS_LABELS_EN['Risk_Level']} = {format_biomechanics_value(video_results['Risk_Level'])}, {BIOMECHANICS_LABELS_EN['Risk_Score']} = {format_biomechanics_value(video_results['Risk_Score'])}")
+                        queue_progress.progress((index + 1) / len(pipeline), text=f"{index + 1} / {len(pipeline)}")
+                except EvaluationStopped as e_stopped:
+                    st.warning(f"⏹️ توقف تحليل قائمة الفيديوهات: {e_stopped}")
+                except BaseException: # Streamlit stopped this run (the user moved on): drop the rest of the queue
+                    queue_deadline.token.cancel("run interrupted")
+                    raise
+                else:
+                    st.success("🎉 اكتمل تحليل جميع الفيديوهات في القائمة!")
+                finally:
+                    pipeline.close()
+                    finish_evaluation(queue_deadline)
+
+        elif st.button("🔬 بدء تحليل البيوميكانيكا", key="start_star_eval", disabled=not ready_to_analyze_star, use_container_width=True):
             st.session_state.biomechanics_results = None # Clear previous biomechanics results
-            local_temp_file_path = None
+            st.session_state.biomechanics_steps = None
             analysis_error = False
             gemini_file_to_use = None
-
-            # --- Check/Upload Video (Similar logic as Legend page) ---
-            should_upload = True
-            current_upload_name = st.session_state.uploaded_file_state.name if st.session_state.uploaded_file_state else None
-            if st.session_state.gemini_file_object and current_upload_name and st.session_state.gemini_file_object.display_name.endswith(current_upload_name):
-                 try:
-                      status_check_placeholder = st.empty()
-                      status_check_placeholder.info("🔄 التحقق من حالة الفيديو المرفوع سابقاً...")
-                      check_file = genai.get_file(st.session_state.gemini_file_object.name)
-                      if check_file.state.name == "ACTIVE":
-                           status_check_placeholder.success("✅ الفيديو المرفوع سابقاً لا يزال جاهزاً.")
-                           should_upload = False
-                           gemini_file_to_use = st.session_state.gemini_file_object
-                           logging.info(f"Reusing existing ACTIVE Gemini file for Star: {gemini_file_to_use.name}")
-                           time.sleep(1); status_check_placeholder.empty()
-                      else:
-                           status_check_placeholder.warning(f"⚠️ الفيديو السابق لم يعد صالحاً ({check_file.state.name}). سيتم الرفع."); logging.warning(f"Prev file {st.session_state.gemini_file_object.name} invalid ({check_file.state.name}). Re-uploading."); st.session_state.gemini_file_object = None; time.sleep(2); status_check_placeholder.empty()
-                 except Exception as e_check:
-                      status_check_placeholder.warning(f"⚠️ فشل التحقق ({e_check}). سيتم الرفع."); logging.warning(f"Failed check prev file {st.session_state.gemini_file_object.name}: {e_check}. Re-uploading."); st.session_state.gemini_file_object = None; time.sleep(2); status_check_placeholder.empty()
-
-            if should_upload and st.session_state.uploaded_file_state:
-                st.session_state.gemini_file_object = None
+            evaluation_deadline = start_evaluation(priority=SCHEDULER_PRIORITY_INTERACTIVE) # One deadline for upload, processing and analysis
+
+            # --- Local pose estimation first: no upload and no Gemini call when it can measure the clip ---
+            analysis_status_placeholder = st.empty()
+            if st.session_state.biomechanics_backend != BIOMECHANICS_BACKEND_GEMINI:
+                with st.spinner("🦴 تقدير وضعيات الجسم على الخادم..."):
+                    bio_start_time = time.time()
+                    local_results, local_steps = analyze_biomechanics_local(st.session_state.uploaded_file_state, analysis_status_placeholder, evaluation_deadline)
+                    if local_results is None and st.session_state.biomechanics_backend == BIOMECHANICS_BACKEND_LOCAL:
+                        local_results = {key: NOT_CLEAR_AR for key in BIOMECHANICS_METRICS_EN}
+                    if local_results is not None:
+                        st.session_state.biomechanics_results = local_results
+                        st.session_state.biomechanics_steps = local_steps if step_series_mode else None
+                        bio_total_s = time.time() - bio_start_time
+                        st.session_state.biomechanics_timing = {"first_metric_s": bio_total_s, "total_s": bio_total_s}
+                    elif st.session_state.biomechanics_backend == BIOMECHANICS_BACKEND_AUTO and get_pose_estimator() is not None:
+                        analysis_status_placeholder.info("ℹ️ لم يكفِ التحليل المحلي لهذا الفيديو، سيتم التحليل بواسطة Gemini.")
+
+            # --- Upload Video (or reuse the file the Legend page already processed) ---
+            if st.session_state.biomechanics_results is None:
                 status_placeholder_upload = st.empty()
                 try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(st.session_state.uploaded_file_state.name)[1]) as tmp_file:
-                        tmp_file.write(st.session_state.uploaded_file_state.getvalue()); local_temp_file_path = tmp_file.name
-                    gemini_file_to_use = upload_and_wait_gemini(local_temp_file_path, st.session_state.uploaded_file_state.name, status_placeholder_upload)
-                    if gemini_file_to_use: st.session_state.gemini_file_object = gemini_file_to_use
-                    else: analysis_error = True
+                    gemini_file_to_use = st.session_state.video_assets.ensure_active(st.session_state.uploaded_file_state, status_placeholder_upload, evaluation_deadline)
+                    analysis_error = gemini_file_to_use is None
                 except Exception as e_upload:
                     status_placeholder_upload.error(f"❌ خطأ فادح أثناء تحضير الفيديو: {e_upload}"); logging.error(f"Fatal error during Star video prep/upload: {e_upload}", exc_info=True); analysis_error = True
-                finally:
-                     if local_temp_file_path and os.path.exists(local_temp_file_path):
-                         try: os.remove(local_temp_file_path); logging.info(f"Deleted local temp file: {local_temp_file_path}")
-                         except Exception as e_del: logging.warning(f"Could not delete local temp file {local_temp_file_path}: {e_del}")
 
-            # --- Analyze Biomechanics ---
+            # --- Analyze Biomechanics with Gemini ---
             if not analysis_error and gemini_file_to_use:
                 with st.spinner("🔬 Gemini يحلل المقاييس البيوميكانيكية..."):
-                    analysis_status_placeholder = st.empty()
-                    st.session_state.biomechanics_results = analyze_biomechanics_video(
-                        gemini_file_to_use,
-                        analysis_status_placeholder
-                    )
-                    if not st.session_state.biomechanics_results or all(v == NOT_CLEAR_AR for v in st.session_state.biomechanics_results.values()):
-                         # If results are empty or all are "Not Clear", maybe indicate failure more strongly
-                         analysis_status_placeholder.error("❌ فشل تحليل البيوميكانيكا أو لم يتم التعرف على أي مقاييس.")
-                    # No balloons for this one? Or maybe if Risk is Low?
-
-            # Note: Cleanup handled implicitly
+                    # Live view: one placeholder per metric, filled in as each metric arrives
+                    live_metrics_container = st.container()
+                    live_metric_placeholders = {}
+                    if stream_biomechanics:
+                        with live_metrics_container:
+                            for key_en in BIOMECHANICS_METRICS_EN:
+                                live_metric_placeholders[key_en] = st.empty()
+                                live_metric_placeholders[key_en].write(f"**{BIOMECHANICS_LABELS_EN.get(key_en, key_en)}:** …")
+                    bio_start_time = time.time()
+                    bio_timing = {"first_metric_s": None, "total_s": None}
+
+                    def show_live_metric(key_en, value_raw):
+                        if bio_timing["first_metric_s"] is None:
+                            bio_timing["first_metric_s"] = time.time() - bio_start_time
+                        live_metric_placeholders[key_en].write(f"**{BIOMECHANICS_LABELS_EN.get(key_en, key_en)}:** {format_biomechanics_value(value_raw)}")
+
+                    if step_series_mode:
+                        st.session_state.biomechanics_results, st.session_state.biomechanics_steps = analyze_biomechanics_steps(
+                            session_model, gemini_file_to_use, analysis_status_placeholder, deadline=evaluation_deadline
+                        )
+                    else:
+                        st.session_state.biomechanics_results = analyze_biomechanics_video(
+                            session_model, gemini_file_to_use,
+                            analysis_status_placeholder,
+                            stream=stream_biomechanics,
+                            on_metric=show_live_metric if stream_biomechanics else None,
+                            deadline=evaluation_deadline
+                        )
+                    bio_timing["total_s"] = time.time() - bio_start_time
+                    if bio_timing["first_metric_s"] is None and not stream_biomechanics:
+                        bio_timing["first_metric_s"] = bio_timing["total_s"] # Everything arrives at once without streaming
+                    st.session_state.biomechanics_timing = bio_timing
+                    live_metrics_container.empty() # The full results section below replaces the live view
+
+            # --- Check and store the results (local or Gemini) ---
+            if st.session_state.biomechanics_results is not None:
+                if all(v == NOT_CLEAR_AR for v in st.session_state.biomechanics_results.values()):
+                     # If results are empty or all are "Not Clear", maybe indicate failure more strongly
+                     analysis_status_placeholder.error("❌ فشل تحليل البيوميكانيكا أو لم يتم التعرف على أي مقاييس.")
+                else:
+                     remember_results(st.session_state.uploaded_file_state, "biomechanics", st.session_state.biomechanics_results)
+                     history_metrics = dict(st.session_state.biomechanics_results)
+                     if st.session_state.biomechanics_steps is not None:
+                         history_metrics.update(derive_step_metrics(st.session_state.biomechanics_steps, STEP_EXTRA_METRICS_EN))
+                     record_player_history(
+                         history_player_name(player_name_star, st.session_state.uploaded_file_state.name),
+                         st.session_state.selected_age_group, st.session_state.uploaded_file_state.name,
+                         HISTORY_SOURCE_BIOMECHANICS, history_metrics
+                     )
+                # No balloons for this one? Or maybe if Risk is Low?
+
+            finish_evaluation(evaluation_deadline)
+            # Note: The Gemini file stays in video_assets, so the Legend page can reuse it
 
     # --- Display Biomechanics Results ---
     # --- Display Biomechanics Results ---
@@ -1042,26 +3428,33 @@ elif st.session_state.page == PAGE_STAR:
         # --- KEEP ARABIC HEADER ---
         st.markdown("### 📊 نتائج التحليل البيوميكانيكي 📊") # Fallback
 
+        if st.session_state.biomechanics_timing:
+            bio_timing = st.session_state.biomechanics_timing
+            first_metric_text = f"{bio_timing['first_metric_s']:.1f}s" if bio_timing['first_metric_s'] is not None else "N/A"
+            st.caption(f"⏱️ Time to first metric: {first_metric_text} | Total latency: {bio_timing['total_s']:.1f}s")
+
         st.markdown("---") # Add a visual separator
 
         # --- Display metric data in ENGLISH using st.write ---
-        for key_en in BIOMECHANICS_METRICS_EN: # Iterate in defined order
-
-            # Get ENGLISH Label
-            display_label_en = BIOMECHANICS_LABELS_EN.get(key_en, key_en) # Use English labels dict
-
-            # Get raw value (potentially numeric or Arabic text like 'غير واضح', 'منخفض')
-            value_raw = results_bio.get(key_en, NOT_CLEAR_AR) # Default to original Arabic constant if key missing
-            value_str = str(value_raw).strip().strip('\'"') # Clean the raw value
-
-            # --- Translate known Arabic text values to ENGLISH for display ---
-            display_value_en = BIO_VALUE_MAP_AR_TO_EN.get(value_str, value_str)
-            # If value_str wasn't in the map (e.g., it's a number or unexpected text),
-            # display_value_en will remain as the original cleaned value_str.
-
-            # --- Display using simple st.write (LTR formatting is default/fine for English) ---
-            # Use markdown for bolding the label
-            st.write(f"**{display_label_en}:** {display_value_en}")
+        render_biomechanics_metrics(results_bio)
+
+        # --- Per-step series (extended mode): extra metrics derived locally from the stored arrays ---
+        step_series = st.session_state.biomechanics_steps
+        if step_series is not None and step_series.size:
+            st.markdown("---")
+            st.markdown("### 👣 تحليل الخطوات 👣")
+            for key_en, value_raw in derive_step_metrics(step_series, STEP_EXTRA_METRICS_EN).items():
+                st.write(f"**{STEP_EXTRA_LABELS_EN[key_en]}:** {format_biomechanics_value(value_raw)}")
+            steps_frame = pd.DataFrame(step_series)
+            steps_frame["side"] = steps_frame["side"].map({STEP_SIDE_RIGHT: "R", STEP_SIDE_LEFT: "L"}).fillna("?")
+            st.caption("Knee angle per step (°)")
+            st.line_chart(steps_frame.pivot_table(index="time_s", columns="side", values="knee_angle"))
+            with st.expander("عرض قياسات كل خطوة"):
+                st.dataframe(steps_frame.rename(columns=STEP_COLUMN_LABELS_EN), use_container_width=True)
+            st.download_button(
+                "⬇️ تحميل سلسلة الخطوات (.npy)", data=step_series_to_bytes(step_series),
+                file_name="biomechanics_steps.npy", key="download_star_steps"
+            )
 
         # --- Display Risk Level and Score (Optionally, using st.metric with English Labels) ---
         # st.markdown("---") # Optional separator
@@ -1080,6 +3473,27 @@ elif st.session_state.page == PAGE_STAR:
         #      # Use English label for metric
         #     st.metric("🔢 Risk Score", risk_score_display_en)
 
+    # --- Display Queued Run Results (one row per player video, English data) ---
+    if st.session_state.star_input_mode == STAR_MODE_QUEUE_AR and st.session_state.queue_results:
+        st.markdown("---")
+        st.markdown("### 📊 نتائج قائمة الفيديوهات 📊")
+        queue_rows = []
+        for entry in st.session_state.queue_results:
+            row = {"Video": entry["video"]}
+            for key_en in BIOMECHANICS_METRICS_EN:
+                row[BIOMECHANICS_LABELS_EN.get(key_en, key_en)] = format_biomechanics_value((entry["results"] or {}).get(key_en, NOT_CLEAR_AR))
+            for key_en in POSE_EXTRA_METRICS_EN: # Empty cell for clips analysed by Gemini
+                if key_en in (entry["results"] or {}):
+                    row[POSE_EXTRA_LABELS_EN[key_en]] = format_biomechanics_value(entry["results"][key_en])
+            queue_rows.append(row)
+        st.dataframe(pd.DataFrame(queue_rows), use_container_width=True)
+        render_report_export(
+            [(entry["video"], None, entry["results"]) for entry in st.session_state.queue_results],
+            {}, key="star_queue"
+        )
+
+    render_player_history("star")
+
 # ==================================
 # ==    الشخص المناسب Page (Placeholder) ==
 # ==================================
@@ -1095,6 +3509,16 @@ st.caption("AI League - Scout Eye v1.3 (Gemini Powered - عربي) | بدعم م
 
 
 
+# --- Server-wide setting widgets (Advanced Gemini Options) ---
+def server_setting_widget(widget, key, current_value, apply, *args, **kwargs):
+    """
+    Renders a keyed widget showing the current value of a process-wide setting. Only an explicit
+    change by this scout calls apply(new value), so reruns of other sessions never overwrite it.
+    """
+    st.session_state[key] = current_value
+    return widget(*args, key=key, on_change=lambda: apply(st.session_state[key]), **kwargs)
+
+
 # Put a small checkbox at the bottom-left
 col_left, col_spacer, col_right = st.columns([1,4,1])
 with col_left:
@@ -1121,11 +3545,75 @@ if show_advanced:
         index=default_index
     )
 
+    st.caption(f"Gemini backend: {gemini_backend.mode} (cassette: {gemini_backend.cassette_path})")
+
+    # Request hedging (server-wide setting and counters)
+    server_setting_widget(
+        st.checkbox, "hedging_enabled_setting", request_hedger.enabled, lambda enabled: setattr(request_hedger, "enabled", enabled),
+        "Hedge slow Gemini calls (duplicate after observed p90 latency)"
+    )
+    hedge_stats = request_hedger.stats()
+    st.caption(
+        f"Hedging — calls: {hedge_stats['calls']}, fired: {hedge_stats['fired']}, won: {hedge_stats['won']}, "
+        f"skipped (budget): {hedge_stats['skipped_budget']}, fallback model: {request_hedger.fallback_model_name or 'same model'}, "
+        f"skill p90: {request_hedger.hedge_delay(st.session_state.model_name, 'skill'):.1f}s"
+    )
+
+    # Gemini client transport (server-wide, fixed at start by SCOUT_EYE_GEMINI_TRANSPORT) and per-transport latency
+    if gemini_client:
+        st.caption(f"Gemini transport: {gemini_client.transport} (server-wide; set SCOUT_EYE_GEMINI_TRANSPORT to {' or '.join(GEMINI_TRANSPORTS)} and restart to change)")
+        warmup = gemini_client.warmups.get(gemini_client.transport)
+        if warmup:
+            warmup_text = f"{warmup['seconds']:.2f}s" if warmup["seconds"] is not None else f"failed ({warmup['error']})"
+            st.caption(f"Warm-up ({gemini_client.transport}): {warmup_text}")
+        latency_rows = gemini_client.latency_rows()
+        if latency_rows:
+            st.dataframe(pd.DataFrame(latency_rows), hide_index=True)
+        if st.button("Measure gRPC vs REST latency"):
+            with st.spinner("Measuring..."):
+                st.dataframe(pd.DataFrame(gemini_client.probe(st.session_state.model_name)), hide_index=True)
+        token_rows = gemini_client.token_rows()
+        if token_rows:
+            st.caption("Average tokens per Gemini call since server start (prompt includes the video)")
+            st.dataframe(pd.DataFrame(token_rows), hide_index=True)
+        if st.button("Measure prompt tokens (before / after compaction)"):
+            with st.spinner("Counting tokens..."):
+                try:
+                    st.dataframe(pd.DataFrame(measure_prompt_compaction(st.session_state.model_name)), hide_index=True)
+                except Exception as e_count:
+                    st.error(f"count_tokens failed: {e_count}")
+
+    # Fair-share scheduler occupancy (shared by all sessions)
+    scheduler_stats = get_gemini_scheduler().stats()
+    st.caption(
+        f"Gemini scheduler — in flight: {scheduler_stats['in_flight']} / {SCHEDULER_MAX_CONCURRENT_CALLS}, "
+        f"queued: {scheduler_stats['queued'][SCHEDULER_PRIORITY_INTERACTIVE]} interactive + {scheduler_stats['queued'][SCHEDULER_PRIORITY_BULK]} bulk, "
+        f"quota: {SCHEDULER_REQUESTS_PER_MINUTE:.0f}/min, admitted: {scheduler_stats['admitted']} "
+        f"(waited: {scheduler_stats['waited']}, longest wait: {scheduler_stats['max_wait_s']:.1f}s), quota errors: {scheduler_stats['quota_errors']}"
+    )
+
+    # Resumable upload chunk size (server-wide setting)
+    chunk_size_mb = server_setting_widget(
+        st.select_slider, "upload_chunk_size_setting",
+        min(UPLOAD_CHUNK_SIZE_CHOICES_MB, key=lambda mb: abs(mb * 1024 ** 2 - gemini_backend.uploader.chunk_size)),
+        lambda mb: setattr(gemini_backend.uploader, "chunk_size", mb * 1024 ** 2),
+        "Upload chunk size (MB, resumable uploads)", options=UPLOAD_CHUNK_SIZE_CHOICES_MB
+    )
+    st.caption(f"Uploads go to {gemini_backend.uploader.base_url} in {chunk_size_mb} MB chunks, resuming after up to {gemini_backend.uploader.max_retries} failures per chunk.")
+
+    # Server-wide video store occupancy (shared by all sessions)
+    store_stats = get_video_store().stats()
+    st.caption(
+        f"Video store — memory: {store_stats['memory_bytes'] / 1024 ** 2:.1f} / {store_stats['memory_budget_bytes'] / 1024 ** 2:.0f} MB "
+        f"({store_stats['memory_videos']} videos), disk: {store_stats['disk_bytes'] / 1024 ** 2:.1f} / {store_stats['disk_budget_bytes'] / 1024 ** 2:.0f} MB "
+        f"({store_stats['disk_videos']} videos)"
+    )
+
     # Optionally, a "Test" button if you want to test the currently loaded model first
     if st.button("Test Current Model"):
-        test_gemini_connection()
+        test_gemini_connection(session_model)
 
     # Button to *switch* the entire app to the newly chosen model
     if st.button("Use This Model"):
         st.session_state.model_name = chosen_model
-        st.experimental_rerun()  # force a reload so the new model is loaded
+        st.rerun()  # rerun this session so it picks up the pooled handle for the new model
@@ -0,0 +1,338 @@
+"""
+Biomechanics metric definitions, the per-step time series maths and the local pose maths for the Star page.
+
+Kept free of Streamlit and Gemini so it can be imported by tests and tools: app.py gets the raw
+model answers or pose keypoints and calls the parsing and derivation functions here.
+"""
+import io
+import json
+import warnings
+
+import numpy as np
+
+# --- Biomechanics Metrics (for Star page) ---
+# Use consistent keys, preferably English for internal use
+BIOMECHANICS_METRICS_EN = [
+    "Right_Knee_Angle_Avg", "Left_Knee_Angle_Avg", "Asymmetry_Avg_Percent",
+    "Contact_Angle_Avg", "Max_Acceleration", "Steps_Count",
+    "Step_Frequency", "Hip_Flexion_Avg", "Trunk_Lean_Avg",
+    "Pelvic_Tilt_Avg", "Thorax_Rotation_Avg", "Risk_Level", "Risk_Score"
+]
+# Arabic labels for display
+BIOMECHANICS_LABELS_AR = {
+    "Right_Knee_Angle_Avg": "متوسط زاوية الركبة اليمنى (°)",
+    "Left_Knee_Angle_Avg": "متوسط زاوية الركبة اليسرى (°)",
+    "Asymmetry_Avg_Percent": "متوسط عدم التماثل (%)",
+    "Contact_Angle_Avg": "متوسط زاوية التلامس (°)",
+    "Max_Acceleration": "أقصى تسارع (قيمة نسبية)",
+    "Steps_Count": "عدد الخطوات",
+    "Step_Frequency": "تردد الخطوات (خطوة/ثانية)",
+    "Hip_Flexion_Avg": "متوسط ثني الورك (°)",
+    "Trunk_Lean_Avg": "متوسط ميل الجذع (°)",
+    "Pelvic_Tilt_Avg": "متوسط إمالة الحوض (°)",
+    "Thorax_Rotation_Avg": "متوسط دوران الصدر (°)",
+    "Risk_Level": "مستوى الخطورة",
+    "Risk_Score": "درجة الخطورة"
+}
+# --- Biomechanics Metrics (English Labels for Star page Display) ---
+BIOMECHANICS_LABELS_EN = {
+    "Right_Knee_Angle_Avg": "Right Knee Angle Avg (°)",
+    "Left_Knee_Angle_Avg": "Left Knee Angle Avg (°)",
+    "Asymmetry_Avg_Percent": "Asymmetry Avg (%)",
+    "Contact_Angle_Avg": "Contact Angle Avg (°)",
+    "Max_Acceleration": "Max Acceleration (Relative)",
+    "Steps_Count": "Steps Count",
+    "Step_Frequency": "Step Frequency (steps/sec)",
+    "Hip_Flexion_Avg": "Hip Flexion Avg (°)",
+    "Trunk_Lean_Avg": "Trunk Lean Avg (°)",
+    "Pelvic_Tilt_Avg": "Pelvic Tilt Avg (°)",
+    "Thorax_Rotation_Avg": "Thorax Rotation Avg (°)",
+    "Risk_Level": "Risk Level",
+    "Risk_Score": "Risk Score"
+}
+NOT_CLEAR_EN = "Not Clear"
+# Mapping from potential Arabic values received from Gemini to English display values
+BIO_VALUE_MAP_AR_TO_EN = {
+    'غير واضح': NOT_CLEAR_EN,
+    'منخفض': 'Low',
+    'متوسط': 'Medium',
+    'مرتفع': 'High'
+    # Add any other potential Arabic text values Gemini might return here
+}
+# Placeholder for non-detected values
+NOT_CLEAR_AR = "غير واضح"
+
+# --- Per-Step Biomechanics Time Series (Star page, extended mode) ---
+# One row per step; float32/int8 columns keep a long clip's series to a few KB
+STEP_SERIES_DTYPE = np.dtype([
+    ("time_s", np.float32), ("side", np.int8), ("knee_angle", np.float32),
+    ("contact_angle", np.float32), ("trunk_lean", np.float32), ("hip_flexion", np.float32),
+])
+STEP_SIDE_RIGHT, STEP_SIDE_LEFT, STEP_SIDE_UNKNOWN = 0, 1, -1
+STEP_SIDE_CODES = {"R": STEP_SIDE_RIGHT, "L": STEP_SIDE_LEFT}
+# Short JSON field names in the model's answer -> series columns (short names keep the output small)
+STEP_RESPONSE_FIELDS = {"t": "time_s", "knee": "knee_angle", "contact": "contact_angle", "trunk": "trunk_lean", "hip": "hip_flexion"}
+# Metrics that cannot be derived from the steps and are still estimated by the model
+STEP_MODEL_METRICS_EN = ["Max_Acceleration", "Pelvic_Tilt_Avg", "Thorax_Rotation_Avg", "Risk_Level", "Risk_Score"]
+# Extra metrics only the step series can give (computed locally, no extra Gemini call)
+STEP_EXTRA_METRICS_EN = ["Knee_Angle_Std", "Knee_Angle_Trend", "Step_Interval_CV_Percent", "Trunk_Lean_Drift"]
+STEP_EXTRA_LABELS_EN = {
+    "Knee_Angle_Std": "Knee Angle Variability (SD, °)",
+    "Knee_Angle_Trend": "Knee Angle Trend (°/min)",
+    "Step_Interval_CV_Percent": "Step Interval Variability (CV %)",
+    "Trunk_Lean_Drift": "Trunk Lean Drift, Last vs First Third (°)",
+}
+# Metrics only the local pose backend measures, in units of their own: not comparable with the
+# model's Max_Acceleration (a relative scale) or Pelvic_Tilt_Avg (anterior tilt), which stay "غير واضح" locally
+POSE_EXTRA_METRICS_EN = ["Hip_Peak_Acceleration_BL", "Pelvic_Lateral_Tilt_Avg"]
+POSE_EXTRA_LABELS_EN = {
+    "Hip_Peak_Acceleration_BL": "Hip Peak Acceleration (body lengths/s²)",
+    "Pelvic_Lateral_Tilt_Avg": "Pelvic Lateral Tilt Avg (°, right hip lower +)",
+}
+STEP_COLUMN_LABELS_EN = {
+    "time_s": "Time (s)", "side": "Side", "knee_angle": "Knee Angle (°)",
+    "contact_angle": "Contact Angle (°)", "trunk_lean": "Trunk Lean (°)", "hip_flexion": "Hip Flexion (°)",
+}
+
+
+# --- Per-Step Biomechanics Time Series (Star Page) ---
+def parse_step_series_response(text):
+    """
+    Parses the extended JSON answer into (series, model_metrics).
+    series is a STEP_SERIES_DTYPE array sorted by time (NaN where a step value was not clear);
+    model_metrics holds the clip-level fields of STEP_MODEL_METRICS_EN as raw values.
+    Raises ValueError if no JSON object with a steps list is found.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("No JSON object in the per-step biomechanics response.")
+    payload = json.loads(text[start:end + 1])
+    steps = payload.get("steps")
+    if not isinstance(steps, list):
+        raise ValueError("The per-step biomechanics response has no 'steps' list.")
+
+    def as_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+    column_fields = {column: field for field, column in STEP_RESPONSE_FIELDS.items()}
+    rows = []
+    for step in steps:
+        if not isinstance(step, dict):
+            continue
+        side = STEP_SIDE_CODES.get(str(step.get("side", "")).strip().upper()[:1], STEP_SIDE_UNKNOWN)
+        rows.append(tuple(side if column == "side" else as_float(step.get(column_fields[column])) for column in STEP_SERIES_DTYPE.names))
+    series = np.array(rows, dtype=STEP_SERIES_DTYPE)
+    series = series[np.argsort(series["time_s"], kind="stable")] # NaN times sort last
+    model_metrics = {key: payload[key] for key in STEP_MODEL_METRICS_EN if payload.get(key) not in (None, "")}
+    return series, model_metrics
+
+
+def _finite_mean(values):
+    values = values[np.isfinite(values)]
+    return float(values.mean()) if values.size else None
+
+
+def _side_mean(series, column, side):
+    return _finite_mean(series[column][series["side"] == side])
+
+
+def _knee_asymmetry_percent(series):
+    right, left = _side_mean(series, "knee_angle", STEP_SIDE_RIGHT), _side_mean(series, "knee_angle", STEP_SIDE_LEFT)
+    if right is None or left is None or right + left == 0:
+        return None
+    return abs(right - left) / ((right + left) / 2) * 100
+
+
+def _step_times(series):
+    times = series["time_s"]
+    return times[np.isfinite(times)]
+
+
+def _step_frequency(series):
+    times = _step_times(series)
+    duration = times[-1] - times[0] if times.size > 1 else 0
+    return float((times.size - 1) / duration) if duration > 0 else None
+
+
+def _step_interval_cv_percent(series):
+    intervals = np.diff(_step_times(series))
+    intervals = intervals[intervals > 0]
+    return float(intervals.std() / intervals.mean() * 100) if intervals.size > 1 else None
+
+
+def _knee_angle_trend_per_min(series):
+    """Least-squares slope of knee angle over time; a falling angle late in a run can point to fatigue."""
+    mask = np.isfinite(series["time_s"]) & np.isfinite(series["knee_angle"])
+    times, angles = series["time_s"][mask].astype(np.float64), series["knee_angle"][mask].astype(np.float64)
+    if times.size < 3 or np.ptp(times) == 0:
+        return None
+    times = times - times.mean()
+    return float((times * (angles - angles.mean())).sum() / (times ** 2).sum() * 60)
+
+
+def _knee_angle_std(series):
+    angles = series["knee_angle"][np.isfinite(series["knee_angle"])]
+    return float(angles.std(ddof=1)) if angles.size > 1 else None
+
+
+def _trunk_lean_drift(series):
+    thirds = np.array_split(series["trunk_lean"], 3)
+    first, last = _finite_mean(thirds[0]), _finite_mean(thirds[-1])
+    return last - first if series.size >= 3 and first is not None and last is not None else None
+
+
+# Derived metric key -> (function of the step series returning a number or None, display format).
+# New metrics only need an entry here: they are computed from stored series, with no new Gemini call.
+STEP_DERIVED_METRICS = {
+    "Right_Knee_Angle_Avg": (lambda series: _side_mean(series, "knee_angle", STEP_SIDE_RIGHT), "{:.1f}"),
+    "Left_Knee_Angle_Avg": (lambda series: _side_mean(series, "knee_angle", STEP_SIDE_LEFT), "{:.1f}"),
+    "Asymmetry_Avg_Percent": (_knee_asymmetry_percent, "{:.1f}%"),
+    "Contact_Angle_Avg": (lambda series: _finite_mean(series["contact_angle"]), "{:.1f}"),
+    "Steps_Count": (lambda series: series.size or None, "{:d}"),
+    "Step_Frequency": (_step_frequency, "{:.2f}"),
+    "Hip_Flexion_Avg": (lambda series: _finite_mean(series["hip_flexion"]), "{:.1f}"),
+    "Trunk_Lean_Avg": (lambda series: _finite_mean(series["trunk_lean"]), "{:.1f}"),
+    "Knee_Angle_Std": (_knee_angle_std, "{:.1f}"),
+    "Knee_Angle_Trend": (_knee_angle_trend_per_min, "{:+.1f}"),
+    "Step_Interval_CV_Percent": (_step_interval_cv_percent, "{:.1f}%"),
+    "Trunk_Lean_Drift": (_trunk_lean_drift, "{:+.1f}"),
+}
+
+
+def derive_step_metrics(series, keys=None):
+    """Computes derived metrics from a step series as display strings ('غير واضح' where not computable)."""
+    derived = {}
+    for key in (keys or STEP_DERIVED_METRICS):
+        compute, value_format = STEP_DERIVED_METRICS[key]
+        value = compute(series) if series.size else None
+        derived[key] = value_format.format(value) if value is not None else NOT_CLEAR_AR
+    return derived
+
+
+def step_series_to_bytes(series):
+    """Serialises a step series to .npy bytes (dtype included) for download or storage."""
+    buffer = io.BytesIO()
+    np.save(buffer, series, allow_pickle=False)
+    return buffer.getvalue()
+
+
+# --- Local Pose Biomechanics (Star Page) ---
+POSE_MIN_VISIBILITY = 0.5 # Landmarks below this visibility count as missing
+POSE_STANCE_BAND = 0.25 # A foot is in stance while its heel is within this share of its range from the lowest point
+POSE_MIN_STEP_INTERVAL_S = 0.2 # Two strikes of the same foot closer than this are one step
+POSE_SMOOTHING_FRAMES = 5
+# MediaPipe Pose landmark indices per joint as (right, left), matching STEP_SIDE_RIGHT / STEP_SIDE_LEFT
+POSE_LANDMARKS = {"shoulder": (12, 11), "hip": (24, 23), "knee": (26, 25), "ankle": (28, 27), "heel": (30, 29), "toe": (32, 31)}
+
+
+def _joint_angle(a, b, c):
+    """Angle ABC in degrees over (..., 2) point arrays; 180 is a straight joint, NaN where a point is missing."""
+    ba, bc = a - b, c - b
+    cross = ba[..., 0] * bc[..., 1] - ba[..., 1] * bc[..., 0]
+    return np.degrees(np.abs(np.arctan2(cross, (ba * bc).sum(axis=-1))))
+
+
+def _smooth(values, frames=POSE_SMOOTHING_FRAMES):
+    """Centred moving average along the first axis that skips missing frames (which stay NaN)."""
+    finite = np.isfinite(values)
+    kernel = np.ones(frames)
+    convolve = lambda column: np.convolve(column, kernel, mode="same")
+    sums = np.apply_along_axis(convolve, 0, np.where(finite, values, 0.0))
+    counts = np.apply_along_axis(convolve, 0, finite.astype(np.float64))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(finite, sums / counts, np.nan)
+
+
+def _segment_means(values, segments, mask, count):
+    """Mean of values per segment id (0..count-1) over masked finite frames; NaN for empty segments."""
+    keep = mask & np.isfinite(values) & (segments >= 0)
+    sums = np.bincount(segments[keep], values[keep], minlength=count)
+    counts = np.bincount(segments[keep], minlength=count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def compute_pose_biomechanics(times, image_keypoints, world_keypoints):
+    """
+    Biomechanics from keypoint arrays, every per-frame angle computed at once for all frames.
+    Returns (series, clip_metrics): a STEP_SERIES_DTYPE array with one row per foot strike
+    (a heel reaching its lowest band), and numbers for the metrics the steps cannot give
+    (Thorax_Rotation_Avg and the POSE_EXTRA_METRICS_EN, None where not measurable).
+    """
+    points = image_keypoints[..., :2].astype(np.float64)
+    points[image_keypoints[..., 2] < POSE_MIN_VISIBILITY] = np.nan
+    world = world_keypoints.astype(np.float64)
+    world[image_keypoints[..., 2] < POSE_MIN_VISIBILITY] = np.nan
+    joint = {name: points[:, list(indices)] for name, indices in POSE_LANDMARKS.items()} # (F, 2 sides, 2)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # All-NaN frames and sides
+        shoulder_mid, hip_mid = np.nanmean(joint["shoulder"], axis=1), np.nanmean(joint["hip"], axis=1)
+        foot = joint["toe"] - joint["heel"]
+        facing = -1.0 if np.nanmedian(foot[..., 0]) < 0 else 1.0 # +1 when facing the right of the frame
+
+        knee = _joint_angle(joint["hip"], joint["knee"], joint["ankle"]) # (F, 2)
+        hip_flexion = 180 - _joint_angle(shoulder_mid[:, None], joint["hip"], joint["knee"])
+        trunk = shoulder_mid - hip_mid
+        trunk_lean = np.degrees(np.arctan2(trunk[:, 0] * facing, -trunk[:, 1])) # Forward of vertical is positive
+        contact = np.degrees(np.arctan2(-foot[..., 1], foot[..., 0] * facing)) # Toes up at heel strike is positive
+
+        # Foot strikes: the first frame of each stance, i.e. the heel entering its lowest band (image y grows down)
+        heel_y = _smooth(joint["heel"][..., 1])
+        lowest, highest = np.nanmax(heel_y, axis=0), np.nanmin(heel_y, axis=0)
+        stance = heel_y >= lowest - POSE_STANCE_BAND * (lowest - highest)
+        strike = np.zeros_like(stance)
+        strike[1:] = stance[1:] & ~stance[:-1] & np.isfinite(heel_y[:-1])
+        frames, sides = np.nonzero(strike)
+        order = np.argsort(times[frames], kind="stable")
+        frames, sides = frames[order], sides[order]
+        for side in (STEP_SIDE_RIGHT, STEP_SIDE_LEFT): # Drop a strike too soon after the same foot's previous one
+            own = np.flatnonzero(sides == side)
+            too_soon = own[1:][np.diff(times[frames[own]]) < POSE_MIN_STEP_INTERVAL_S]
+            frames, sides = np.delete(frames, too_soon), np.delete(sides, too_soon)
+
+        # Knee angle and trunk lean averaged over each step's stance, up to the same foot's next strike
+        series = np.zeros(frames.size, dtype=STEP_SERIES_DTYPE)
+        series["time_s"], series["side"] = times[frames], sides
+        series["contact_angle"] = contact[frames, sides]
+        series["hip_flexion"] = hip_flexion[frames, sides]
+        for side in (STEP_SIDE_RIGHT, STEP_SIDE_LEFT):
+            own = np.flatnonzero(sides == side)
+            segments = np.searchsorted(frames[own], np.arange(times.size), side="right") - 1
+            series["knee_angle"][own] = _segment_means(knee[:, side], segments, stance[:, side], own.size)
+            series["trunk_lean"][own] = _segment_means(trunk_lean, segments, stance[:, side], own.size)
+
+        # Peak acceleration of the hip centre, in body lengths (shoulders to heels) per s²
+        body_length = np.nanmedian(np.linalg.norm(shoulder_mid - np.nanmean(joint["heel"], axis=1), axis=1))
+        body_length = body_length if body_length > 0 else np.nan
+        velocity = np.gradient(_smooth(hip_mid / body_length), times, axis=0)
+        acceleration = np.linalg.norm(np.gradient(_smooth(velocity), times, axis=0), axis=1)
+
+        # The pose model has no pelvis landmarks for anterior tilt, so the hip line's lateral tilt
+        # (positive with the right hip lower) is its own metric; thorax rotation is the shoulder line's
+        # rotation against the hip line about the vertical axis. Both from metric world landmarks.
+        hips = world[:, POSE_LANDMARKS["hip"][0]] - world[:, POSE_LANDMARKS["hip"][1]]
+        shoulders = world[:, POSE_LANDMARKS["shoulder"][0]] - world[:, POSE_LANDMARKS["shoulder"][1]]
+        pelvic_tilt = np.degrees(np.arctan2(hips[:, 1], np.hypot(hips[:, 0], hips[:, 2])))
+        rotation = np.arctan2(shoulders[:, 2], shoulders[:, 0]) - np.arctan2(hips[:, 2], hips[:, 0])
+        thorax_rotation = np.degrees(np.angle(np.exp(1j * rotation))) # Wrapped to [-180, 180]
+
+        clip_metrics = {
+            "Hip_Peak_Acceleration_BL": np.nanmax(acceleration) if np.isfinite(acceleration).any() else None,
+            "Pelvic_Lateral_Tilt_Avg": _finite_mean(pelvic_tilt),
+            "Thorax_Rotation_Avg": _finite_mean(thorax_rotation),
+        }
+    return series, clip_metrics
+
+
+def pose_risk_score(metric_values):
+    """0-5 risk from the same criteria the Gemini prompt gives the model (missing metrics add nothing)."""
+    value = lambda key: metric_values.get(key) if metric_values.get(key) is not None else np.nan
+    points = sum(1.0 for key in ("Right_Knee_Angle_Avg", "Left_Knee_Angle_Avg") if value(key) > 145 or value(key) < 110)
+    points += 1.0 if value("Asymmetry_Avg_Percent") > 15 else 0.5 if value("Asymmetry_Avg_Percent") > 10 else 0.0
+    points += 1.0 if value("Step_Frequency") < 1.5 or value("Step_Frequency") > 3 else 0.0
+    points += 1.0 if value("Hip_Flexion_Avg") > 35 else 0.0
+    points += 1.0 if value("Trunk_Lean_Avg") > 15 else 0.0
+    return min(5, int(round(points)))
@@ -0,0 +1,425 @@
+"""
+Evaluation deadlines, cancellation and fair-share admission for Gemini calls.
+
+Every session of the Streamlit app shares one API key. Calls are admitted here by
+priority and per-session fair share, within a per-minute quota and a concurrency cap,
+and every wait observes its evaluation's deadline and cancellation token.
+Importable without Streamlit: app.py creates the process-wide scheduler.
+"""
+import time
+import heapq
+import logging
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SCHEDULER_PRIORITY_INTERACTIVE = 0 # Single-skill checks and the single-video Star analysis
+SCHEDULER_PRIORITY_BULK = 1 # All-skills runs, video queues and leaderboards
+SCHEDULER_PRIORITIES = (SCHEDULER_PRIORITY_INTERACTIVE, SCHEDULER_PRIORITY_BULK) # Served strictly in this order
+DEFAULT_QUOTA_COOLDOWN_S = 20.0
+DEADLINE_HEARTBEAT_S = 1.0 # How often a waiting run checks for cancellation and yields to Streamlit
+DEADLINE_CALL_WORKERS = 32
+
+
+# --- Evaluation Deadlines and Cancellation ---
+class EvaluationStopped(Exception):
+    """An evaluation was stopped before finishing: cancelled, or out of time."""
+
+
+class EvaluationCancelled(EvaluationStopped):
+    pass
+
+
+class EvaluationDeadlineExceeded(EvaluationStopped, TimeoutError):
+    pass
+
+
+class CancellationToken:
+    """
+    Shared by every stage of one evaluation, including its worker threads.
+    cancel() wakes all waiters and runs the registered cleanups once (e.g. deleting an
+    in-flight upload); a cleanup registered after cancellation runs immediately.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._cleanups = {} # handle -> callable
+        self._next_handle = 0
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            cleanups = list(self._cleanups.values())
+            self._cleanups.clear()
+        logging.info(f"Evaluation cancelled ({reason}); running {len(cleanups)} cleanup(s).")
+        for cleanup in cleanups:
+            try:
+                cleanup()
+            except Exception as e:
+                logging.warning(f"Cleanup after cancellation failed: {e}")
+
+    def register(self, cleanup):
+        """Returns a handle for unregister(), or None if the token was already cancelled (cleanup has run)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._next_handle += 1
+                self._cleanups[self._next_handle] = cleanup
+                return self._next_handle
+        cleanup()
+        return None
+
+    def unregister(self, handle):
+        with self._lock:
+            self._cleanups.pop(handle, None)
+
+    def wait(self, seconds):
+        """Sleeps up to seconds; True as soon as the token is cancelled."""
+        return self._event.wait(seconds)
+
+
+class EvaluationDeadline:
+    """
+    One end-to-end time budget for an evaluation, shared by upload, polling and analysis.
+    Each stage asks timeout() for min(its own cap, time left) instead of a fixed timeout.
+    Blocking calls go through run()/wait_for(), which wait in short slices so cancellation or
+    an expired deadline stops the wait; a call already in flight is abandoned (the sync client
+    cannot abort it) and on_abandon(result) cleans up whatever it produces.
+    On the script thread each slice also refreshes a countdown placeholder, which is where
+    Streamlit interrupts a run whose user has moved on.
+    owner and priority identify the session and class of work to the fair-share scheduler.
+    """
+    def __init__(self, budget_s, token=None, countdown=None, owner=None, priority=SCHEDULER_PRIORITY_BULK):
+        self.budget_s = budget_s
+        self.expires_at = time.monotonic() + budget_s
+        self.token = token or CancellationToken()
+        self.owner = owner
+        self.priority = priority
+        self._countdown = countdown
+        self._script_thread = threading.current_thread()
+
+    def child(self, budget_s):
+        """A deadline for one part of the work (one video, one stage): same token, never outlives this one."""
+        child = EvaluationDeadline(min(budget_s, self.remaining()), self.token, self._countdown, self.owner, self.priority)
+        child._script_thread = self._script_thread
+        return child
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage):
+        if self.token.cancelled:
+            raise EvaluationCancelled(f"تم إلغاء التقييم أثناء '{stage}' ({self.token.reason}).")
+        if self.remaining() <= 0:
+            raise EvaluationDeadlineExceeded(f"انتهت المهلة المحددة ({self.budget_s:.0f} ثانية) أثناء '{stage}'.")
+
+    def timeout(self, stage, cap_s):
+        """Timeout for the next call of a stage: its cap, or less if the deadline is closer."""
+        self.check(stage)
+        return min(cap_s, self.remaining())
+
+    def _heartbeat(self):
+        if self._countdown is not None and threading.current_thread() is self._script_thread:
+            self._countdown.caption(f"⏱️ الوقت المتبقي للتقييم: {self.remaining():.0f} ثانية")
+
+    def close(self):
+        if self._countdown is not None:
+            self._countdown.empty()
+
+    def sleep(self, stage, seconds):
+        """Sleeps up to seconds (less if the deadline is closer), waking at once on cancellation."""
+        wake_at = time.monotonic() + min(seconds, self.remaining())
+        while True:
+            left = wake_at - time.monotonic()
+            if left <= 0 or self.token.wait(min(left, DEADLINE_HEARTBEAT_S)):
+                break
+            self._heartbeat()
+        self.check(stage)
+
+    def wait_for(self, stage, future, on_abandon=None, on_wait=None):
+        """Result of future, unless the evaluation is cancelled or out of time first. on_wait runs on every slice."""
+        try:
+            while True:
+                done, _ = wait([future], timeout=min(DEADLINE_HEARTBEAT_S, self.remaining()))
+                if done:
+                    return future.result()
+                if self.token.cancelled or self.remaining() <= 0:
+                    logging.warning(f"Abandoning pending call for '{stage}' ({'cancelled' if self.token.cancelled else 'deadline exceeded'}).")
+                    self.check(stage)
+                self._heartbeat()
+                if on_wait:
+                    on_wait()
+        except BaseException: # Includes Streamlit stopping this run
+            if on_abandon and not future.done() and not future.cancel():
+                def cleanup_abandoned(finished):
+                    if finished.exception() is None and finished.result() is not None:
+                        on_abandon(finished.result())
+                future.add_done_callback(cleanup_abandoned)
+            raise
+
+    def run(self, stage, fn, *args, on_abandon=None, on_wait=None, **kwargs):
+        """Runs a blocking call on the shared call pool and waits for it within the deadline."""
+        self.check(stage)
+        return self.wait_for(stage, get_deadline_call_executor().submit(fn, *args, **kwargs), on_abandon, on_wait)
+
+    def as_completed(self, stage, futures):
+        """Like concurrent.futures.as_completed; on cancellation, calls not yet started are dropped."""
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=min(DEADLINE_HEARTBEAT_S, self.remaining()), return_when=FIRST_COMPLETED)
+                if not done:
+                    self.check(stage)
+                    self._heartbeat()
+                yield from done
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+
+_call_executor = None
+_call_executor_lock = threading.Lock()
+
+
+def get_deadline_call_executor():
+    """One pool per process for blocking Gemini calls waited on under a deadline."""
+    global _call_executor
+    with _call_executor_lock:
+        if _call_executor is None:
+            _call_executor = ThreadPoolExecutor(max_workers=DEADLINE_CALL_WORKERS, thread_name_prefix="scout_call")
+        return _call_executor
+
+
+# --- Fair-Share Scheduler ---
+def is_quota_error(error):
+    """True for the API's "quota exhausted" answer (HTTP 429 / ResourceExhausted)."""
+    return getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted"
+
+
+class _SchedulerTicket:
+    """One queued Gemini call; its future resolves when the scheduler admits it."""
+    def __init__(self, owner, priority, finish_tag, seq):
+        self.owner = owner
+        self.priority = priority
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self.future = Future()
+        self.started = False # The call itself has begun and will release its own slot
+        self.released = False
+
+
+class FairShareScheduler:
+    """
+    Process-wide admission control for Gemini analysis calls, which all share one API key.
+    Calls wait in one queue per priority, and interactive calls are always admitted ahead
+    of bulk ones. Within a priority, sessions are served by self-clocked weighted fair
+    queuing: each call is tagged max(virtual time, the session's last tag) + 1 / weight and
+    the lowest tag goes first, so a scout with fifty queued calls cannot starve a second
+    scout with one. A call is admitted while fewer than max_concurrent are in flight and a
+    per-minute token bucket has a token; a quota error empties the bucket and pauses
+    admission for a cooldown. Waiting callers see their queue position instead of failing.
+    A streamed call keeps its slot until its stream is drained or closed (call_stream).
+    """
+    def __init__(self, max_concurrent, requests_per_minute, burst, quota_cooldown_s=DEFAULT_QUOTA_COOLDOWN_S):
+        self.max_concurrent = max_concurrent
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.quota_cooldown_s = quota_cooldown_s
+        self._cond = threading.Condition()
+        self._queues = {priority: [] for priority in SCHEDULER_PRIORITIES} # Heaps of (finish tag, seq, ticket)
+        self._virtual_time = {priority: 0.0 for priority in SCHEDULER_PRIORITIES}
+        self._last_tags = {} # (priority, owner) -> finish tag of that session's last queued call
+        self._queued_counts = {} # (priority, owner) -> tickets still in the heap; at 0 both entries are dropped
+        self._seq = itertools.count()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self.counters = {"admitted": 0, "waited": 0, "quota_errors": 0, "max_wait_s": 0.0}
+        threading.Thread(target=self._dispatch_loop, name="scout_scheduler", daemon=True).start()
+
+    # --- Dispatcher ---
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.requests_per_minute / 60.0)
+        self._refilled_at = now
+
+    def _pop(self, priority):
+        """Removes the head ticket of a queue; a session with nothing left queued loses its tag history."""
+        _, _, ticket = heapq.heappop(self._queues[priority])
+        key = (ticket.priority, ticket.owner)
+        self._queued_counts[key] -= 1
+        if not self._queued_counts[key]:
+            del self._queued_counts[key]
+            self._last_tags.pop(key, None) # Idle sessions restart from the virtual time, as a new one would
+        return ticket
+
+    def _head(self):
+        """Next ticket to admit (dropping ones whose caller gave up), or None."""
+        for priority in SCHEDULER_PRIORITIES:
+            queue = self._queues[priority]
+            while queue and queue[0][2].future.cancelled():
+                self._pop(priority)
+            if queue:
+                return queue[0][2]
+        return None
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait_s = None
+                while self._in_flight < self.max_concurrent and (ticket := self._head()) is not None:
+                    if now < self._paused_until:
+                        wait_s = self._paused_until - now
+                        break
+                    if self._tokens < 1:
+                        wait_s = (1 - self._tokens) * 60.0 / self.requests_per_minute
+                        break
+                    self._pop(ticket.priority)
+                    if not ticket.future.set_running_or_notify_cancel():
+                        continue # Cancelled between _head() and here
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    self._virtual_time[ticket.priority] = ticket.finish_tag
+                    waited_s = now - ticket.queued_at
+                    self.counters["admitted"] += 1
+                    self.counters["max_wait_s"] = max(self.counters["max_wait_s"], waited_s)
+                    if waited_s > 1.0:
+                        self.counters["waited"] += 1
+                    ticket.future.set_result(ticket)
+                self._cond.wait(wait_s)
+
+    # --- Callers ---
+    def position(self, ticket):
+        """1-based place of a waiting ticket in the admission order (0 once admitted)."""
+        with self._cond:
+            if ticket.future.done():
+                return 0
+            ahead = sum(1 for priority in SCHEDULER_PRIORITIES if priority < ticket.priority
+                        for _, _, other in self._queues[priority] if not other.future.cancelled())
+            ahead += sum(1 for tag, seq, other in self._queues[ticket.priority]
+                         if (tag, seq) < (ticket.finish_tag, ticket.seq) and not other.future.cancelled())
+            return ahead + 1
+
+    def admit(self, deadline, stage, weight=1.0, on_queued=None):
+        """
+        Waits (within the deadline) until a call of deadline.owner may start; returns its ticket.
+        on_queued(position) is called on every wait slice while the call is still queued.
+        """
+        with self._cond:
+            key = (deadline.priority, deadline.owner)
+            finish_tag = max(self._virtual_time[deadline.priority], self._last_tags.get(key, 0.0)) + 1.0 / weight
+            self._last_tags[key] = finish_tag
+            self._queued_counts[key] = self._queued_counts.get(key, 0) + 1
+            ticket = _SchedulerTicket(deadline.owner, deadline.priority, finish_tag, next(self._seq))
+            heapq.heappush(self._queues[deadline.priority], (finish_tag, ticket.seq, ticket))
+            self._cond.notify_all()
+        try:
+            return deadline.wait_for(stage, ticket.future, on_wait=(lambda: on_queued(self.position(ticket))) if on_queued else None)
+        except BaseException:
+            if not ticket.future.cancel(): # Admitted just as the caller gave up
+                self.release(ticket)
+            raise
+
+    def _start(self, ticket):
+        with self._cond:
+            if ticket.released:
+                raise EvaluationCancelled("تم التخلي عن الطلب قبل بدئه.")
+            ticket.started = True
+
+    def call(self, ticket, fn, *args, **kwargs):
+        """Runs an admitted call (on a worker thread); its slot is freed when it returns, even if abandoned."""
+        self._start(ticket)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if is_quota_error(e):
+                self.throttle()
+            raise
+        finally:
+            self.release(ticket)
+
+    def call_stream(self, ticket, fn, *args, **kwargs):
+        """
+        Like call() for a call returning a stream of chunks: the slot is held until the
+        returned stream is exhausted, fails, or is closed, not just until fn returns.
+        """
+        self._start(ticket)
+        try:
+            return _ScheduledStream(self, ticket, iter(fn(*args, **kwargs)))
+        except Exception as e:
+            if is_quota_error(e):
+                self.throttle()
+            self.release(ticket)
+            raise
+
+    def release(self, ticket):
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def release_unless_started(self, ticket):
+        """Frees the slot of a call that never reached call() (the caller stopped before it ran)."""
+        with self._cond:
+            if not ticket.started:
+                self.release(ticket)
+
+    def throttle(self):
+        with self._cond:
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + self.quota_cooldown_s)
+            self.counters["quota_errors"] += 1
+            logging.warning(f"Gemini quota exhausted: pausing admissions for {self.quota_cooldown_s:.0f}s.")
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self.counters, "in_flight": self._in_flight, "tokens": self._tokens,
+                "queued": {priority: sum(1 for _, _, ticket in queue if not ticket.future.cancelled()) for priority, queue in self._queues.items()},
+            }
+
+
+class _ScheduledStream:
+    """A streamed response holding its scheduler slot until it is drained, fails or is closed."""
+    def __init__(self, scheduler, ticket, chunks):
+        self._scheduler = scheduler
+        self._ticket = ticket
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            if is_quota_error(e):
+                self._scheduler.throttle()
+            self.close()
+            raise
+
+    def close(self):
+        """Frees the slot (idempotent); an unfinished generator stream is closed too."""
+        if hasattr(self._chunks, "close"):
+            self._chunks.close()
+        self._scheduler.release(self._ticket)
+
+    def __del__(self): # Dropped by a caller that stopped reading: do not leak the slot
+        self.close()
@@ -0,0 +1,316 @@
+"""
+Concurrent-session load test for the Scout Eye Streamlit app.
+
+Simulates N scouts running the Legend "all skills" flow and/or the Star biomechanics
+flow at the same time. Each scout is a Streamlit AppTest session running app.py in this
+process, so all sessions share the app's process-wide pools and stores the way they do on
+a real server. The app's Gemini backend is given FakeGeminiService (below) through
+SCOUT_EYE_GEMINI_SERVICE: a local stand-in for the Gemini API with log-normal latency
+and a configurable error rate, so no network or quota is used.
+
+Reports throughput, p50/p95/p99 latency per stage, errors, and peak memory.
+
+Usage:
+    python load_test.py --users 8 --iterations 2 --flows legend,star \
+        --upload-latency 3 0.5 --generate-latency 6 0.6 --error-rate 0.02
+"""
+import os
+import sys
+import json
+import time
+import math
+import random
+import hashlib
+import argparse
+import logging
+import resource
+import threading
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from biomechanics import BIOMECHANICS_LABELS_AR, BIOMECHANICS_METRICS_EN
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+FLOW_LEGEND = "legend"
+FLOW_STAR = "star"
+# Ordered (stage name, button to click) steps per flow, after the initial page load
+FLOW_STEPS = {
+    FLOW_LEGEND: [("legend_open", "btn_legend"), ("legend_all_skills", "start_legend_eval")],
+    FLOW_STAR: [("star_open", "btn_star"), ("star_biomechanics", "start_star_eval")],
+}
+
+FAKE_SKILL_SCORES = range(0, 6) # 0..MAX_SCORE_PER_SKILL in app.py
+# Fake service profile: log-normal latency (median seconds, sigma) per call kind and the share of calls that fail.
+# Overridden by the JSON in SCOUT_EYE_FAKE_GEMINI, which main() fills from the command line.
+FAKE_PROFILE_DEFAULT = {
+    "upload_file": [3.0, 0.5], "generate_content": [6.0, 0.6], "stream_chunks": 4,
+    "upload_chunk_mb": 8, "error_rate": 0.0, "seed": None,
+}
+
+
+class _FakeFile:
+    """Stand-in for a genai File (always ACTIVE)."""
+    def __init__(self, name, display_name):
+        self.name = name
+        self.display_name = display_name
+        self.uri = f"fake://{name}"
+        self.state = SimpleNamespace(name="ACTIVE")
+
+
+class _FakeResponse:
+    """Stand-in for a GenerateContentResponse (or one streamed chunk)."""
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))] if text else []
+        self.usage_metadata = None
+        self.prompt_feedback = None
+
+
+class FakeGeminiService:
+    """
+    Stand-in for the Gemini API, injected into the app's GeminiBackend with
+    SCOUT_EYE_GEMINI_SERVICE=load_test:FakeGeminiService. Synthesizes plausible skill scores
+    and biomechanics answers with latency and errors drawn from the profile.
+    """
+    def __init__(self, profile=None):
+        if profile is None:
+            profile = json.loads(os.environ.get("SCOUT_EYE_FAKE_GEMINI", "{}"))
+        self.profile = {**FAKE_PROFILE_DEFAULT, **profile}
+        self._random = random.Random(self.profile.get("seed"))
+        self._lock = threading.Lock()
+
+    def _call(self, kind, wait_fraction=1.0):
+        """Draws a latency from the profile and sleeps wait_fraction of it; fails with the configured probability."""
+        median_s, sigma = self.profile[kind]
+        with self._lock:
+            latency_s = self._random.lognormvariate(math.log(max(median_s, 1e-3)), sigma)
+            failed = self._random.random() < self.profile["error_rate"]
+        time.sleep(latency_s * wait_fraction)
+        if failed:
+            raise ConnectionError(f"Fake Gemini error injected for {kind} after {latency_s * wait_fraction:.2f}s")
+        return latency_s
+
+    def _text(self, contents):
+        prompt_text = " ".join(part for part in (contents if isinstance(contents, list) else [contents]) if isinstance(part, str))
+        with self._lock:
+            if '"steps"' in prompt_text: # Per-step prompt: alternating feet with a slight fatigue drift in knee angle
+                step_count, cadence, knee_base = self._random.randint(10, 40), self._random.uniform(1.2, 3.5), self._random.uniform(120, 150)
+                steps = [{
+                    "t": round(i / cadence + self._random.gauss(0, 0.02), 2), "side": "RL"[i % 2],
+                    "knee": round(knee_base - 0.2 * i + self._random.gauss(0, 4), 1), "contact": round(self._random.uniform(10, 40), 1),
+                    "trunk": round(self._random.uniform(0, 25), 1), "hip": round(self._random.uniform(15, 45), 1),
+                } for i in range(step_count)]
+                return json.dumps({
+                    "steps": steps, "Max_Acceleration": self._random.randint(100000, 600000),
+                    "Pelvic_Tilt_Avg": round(self._random.uniform(-10, 10), 1), "Thorax_Rotation_Avg": round(self._random.uniform(-40, 40), 1),
+                    "Risk_Level": self._random.choice(["منخفض", "متوسط", "مرتفع"]), "Risk_Score": self._random.randint(0, 5),
+                }, ensure_ascii=False)
+            if BIOMECHANICS_LABELS_AR["Right_Knee_Angle_Avg"].split('(')[0].strip() not in prompt_text:
+                return str(self._random.choice(FAKE_SKILL_SCORES)) # Skill score prompt
+            values = {
+                "Right_Knee_Angle_Avg": f"{self._random.uniform(100, 160):.1f}", "Left_Knee_Angle_Avg": f"{self._random.uniform(100, 160):.1f}",
+                "Asymmetry_Avg_Percent": f"{self._random.uniform(0, 20):.1f}%", "Contact_Angle_Avg": f"{self._random.uniform(10, 40):.1f}",
+                "Max_Acceleration": str(self._random.randint(100000, 600000)), "Steps_Count": str(self._random.randint(10, 60)),
+                "Step_Frequency": f"{self._random.uniform(1.2, 3.5):.1f}", "Hip_Flexion_Avg": f"{self._random.uniform(15, 45):.1f}",
+                "Trunk_Lean_Avg": f"{self._random.uniform(0, 25):.1f}", "Pelvic_Tilt_Avg": f"{self._random.uniform(-10, 10):.1f}",
+                "Thorax_Rotation_Avg": f"{self._random.uniform(-40, 40):.1f}", "Risk_Level": self._random.choice(["منخفض", "متوسط", "مرتفع"]),
+                "Risk_Score": str(self._random.randint(0, 5)),
+            }
+        return "\n".join(f"{i}. {BIOMECHANICS_LABELS_AR[key].split('(')[0].strip()}: {values[key]}" for i, key in enumerate(BIOMECHANICS_METRICS_EN, start=1))
+
+    def _stream(self, text, remaining_s):
+        """Yields the text in line-aligned chunks spread evenly over the remaining latency."""
+        lines = text.split("\n")
+        chunk_count = max(1, min(len(lines), self.profile["stream_chunks"]))
+        per_chunk = -(-len(lines) // chunk_count)
+        for i in range(0, len(lines), per_chunk):
+            if i:
+                time.sleep(remaining_s / chunk_count)
+            yield _FakeResponse("\n".join(lines[i:i + per_chunk]) + ("\n" if i + per_chunk < len(lines) else ""))
+
+    # --- The calls GeminiBackend makes on an injected service ---
+    def upload_file(self, path, display_name, on_progress=None, should_stop=None):
+        """Reports chunk-by-chunk progress spread evenly over the drawn upload latency."""
+        latency_s = self._call("upload_file", wait_fraction=0.0)
+        size = os.path.getsize(path)
+        chunk_size = int(self.profile["upload_chunk_mb"] * 1024 ** 2)
+        chunk_count = max(1, -(-size // chunk_size))
+        for i in range(1, chunk_count + 1):
+            if should_stop and should_stop():
+                raise ConnectionError(f"Fake upload of '{display_name}' stopped at chunk {i}/{chunk_count}")
+            time.sleep(latency_s / chunk_count)
+            if on_progress:
+                on_progress(min(size, i * chunk_size), size)
+        with open(path, "rb") as f:
+            return _FakeFile(f"files/fake-{hashlib.sha256(f.read()).hexdigest()[:16]}", display_name)
+
+    def get_file(self, name):
+        return _FakeFile(name, name)
+
+    def delete_file(self, name):
+        pass
+
+    def generate_content(self, gemini_model, contents, stream=False, request_options=None):
+        first_chunk_fraction = 0.5 if stream else 1.0 # Streaming: first chunk halfway, the rest spread out
+        latency_s = self._call("generate_content", first_chunk_fraction)
+        text = self._text(contents)
+        return self._stream(text, latency_s * (1 - first_chunk_fraction)) if stream else _FakeResponse(text)
+
+
+class _LoadTestUploadedFile:
+    """Minimal stand-in for Streamlit's UploadedFile (AppTest cannot drive file_uploader)."""
+    def __init__(self, name, data):
+        self.name = name
+        self.size = len(data)
+        self.type = "video/mp4"
+        self.file_id = f"loadtest-{hashlib.sha256(data).hexdigest()[:16]}"
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def install_fake_uploader(uploaded_file):
+    """Makes every st.file_uploader in the app return the load-test video."""
+    import streamlit as st
+
+    def fake_file_uploader(label, *args, accept_multiple_files=False, **kwargs):
+        return [uploaded_file] if accept_multiple_files else uploaded_file
+
+    st.file_uploader = fake_file_uploader
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class LoadTestResults:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list) # stage -> [seconds]
+        self.errors = defaultdict(int) # stage -> count
+        self.flows_completed = 0
+
+    def record(self, stage, seconds, failed):
+        with self._lock:
+            self.latencies[stage].append(seconds)
+            if failed:
+                self.errors[stage] += 1
+
+    def flow_done(self):
+        with self._lock:
+            self.flows_completed += 1
+
+
+def run_stage(app_test, results, stage, button_key=None):
+    start_time = time.perf_counter()
+    if button_key:
+        app_test.button(key=button_key).click()
+    app_test.run()
+    elapsed = time.perf_counter() - start_time
+    failed = bool(app_test.exception) or bool(app_test.error)
+    if app_test.exception:
+        logging.warning(f"Stage '{stage}' raised: {app_test.exception[0].value}")
+    results.record(stage, elapsed, failed)
+    return not app_test.exception
+
+
+def simulate_user(user_index, flows, iterations, timeout_s, results):
+    from streamlit.testing.v1 import AppTest
+    for iteration in range(iterations):
+        for flow in flows:
+            flow_start = time.perf_counter()
+            app_test = AppTest.from_file(APP_PATH, default_timeout=timeout_s)
+            ok = run_stage(app_test, results, "page_load")
+            for stage, button_key in FLOW_STEPS[flow]:
+                if not ok:
+                    break
+                ok = run_stage(app_test, results, stage, button_key)
+            results.record(f"{flow}_end_to_end", time.perf_counter() - flow_start, not ok)
+            results.flow_done()
+            logging.info(f"User {user_index} finished {flow} flow (iteration {iteration + 1}/{iterations}, ok={ok}).")
+
+
+def print_report(results, wall_s, users, peak_traced_bytes):
+    print()
+    print(f"Users: {users}   Wall time: {wall_s:.1f}s   Flows completed: {results.flows_completed}   "
+          f"Throughput: {results.flows_completed / wall_s * 60:.2f} flows/min")
+    print(f"{'stage':<28}{'count':>7}{'errors':>8}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'max s':>9}")
+    for stage in sorted(results.latencies):
+        values = sorted(results.latencies[stage])
+        print(f"{stage:<28}{len(values):>7}{results.errors[stage]:>8}"
+              f"{percentile(values, 50):>9.2f}{percentile(values, 95):>9.2f}{percentile(values, 99):>9.2f}{values[-1]:>9.2f}")
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB   "
+          f"Peak traced Python allocations: {peak_traced_bytes / 1024 ** 2:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app.py against a fake Gemini service.")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent simulated scouts.")
+    parser.add_argument("--iterations", type=int, default=1, help="Flows repeated per user.")
+    parser.add_argument("--flows", default=f"{FLOW_LEGEND},{FLOW_STAR}", help="Comma-separated: legend, star.")
+    parser.add_argument("--video", help="Video file to upload. Default: random bytes of --video-mb.")
+    parser.add_argument("--video-mb", type=float, default=5.0)
+    parser.add_argument("--upload-latency", type=float, nargs=2, metavar=("MEDIAN_S", "SIGMA"), default=[3.0, 0.5])
+    parser.add_argument("--generate-latency", type=float, nargs=2, metavar=("MEDIAN_S", "SIGMA"), default=[6.0, 0.6])
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake Gemini calls that fail.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds between starting consecutive users.")
+    parser.add_argument("--timeout", type=float, default=900.0, help="Per-run AppTest timeout in seconds.")
+    parser.add_argument("--json", help="Also write raw latencies to this JSON file.")
+    args = parser.parse_args(argv)
+
+    flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    unknown = [flow for flow in flows if flow not in FLOW_STEPS]
+    if unknown:
+        parser.error(f"Unknown flows: {unknown}")
+
+    # The app reads these when the first session creates the (process-wide) Gemini backend
+    os.environ["SCOUT_EYE_GEMINI_BACKEND"] = "live"
+    os.environ["SCOUT_EYE_GEMINI_SERVICE"] = "load_test:FakeGeminiService"
+    os.environ["SCOUT_EYE_FAKE_GEMINI"] = json.dumps({
+        "upload_file": args.upload_latency, "generate_content": args.generate_latency,
+        "error_rate": args.error_rate, "seed": args.seed,
+    })
+
+    if args.video:
+        with open(args.video, "rb") as f:
+            video_name, video_bytes = os.path.basename(args.video), f.read()
+    else:
+        video_name, video_bytes = "load_test.mp4", os.urandom(int(args.video_mb * 1024 ** 2))
+    install_fake_uploader(_LoadTestUploadedFile(video_name, video_bytes))
+
+    tracemalloc.start()
+    results = LoadTestResults()
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users, thread_name_prefix="load_user") as executor:
+        futures = []
+        for user_index in range(args.users):
+            futures.append(executor.submit(simulate_user, user_index, flows, args.iterations, args.timeout, results))
+            if args.ramp_up:
+                time.sleep(args.ramp_up)
+        for future in futures:
+            future.result()
+    wall_s = time.perf_counter() - start_time
+    _, peak_traced_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print_report(results, wall_s, args.users, peak_traced_bytes)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"users": args.users, "wall_s": wall_s, "flows_completed": results.flows_completed,
+                       "latencies": results.latencies, "errors": results.errors,
+                       "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       "peak_traced_bytes": peak_traced_bytes}, f, indent=2)
+    return 0 if not any(results.errors.values()) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Persistent player history for the Legend and Star pages: a columnar Parquet store with
+incremental per-player aggregates.
+
+Kept free of Streamlit so it can be imported by tests and tools: app.py owns the one
+store per server process and decides which evaluations are complete enough to record.
+"""
+import copy
+import glob
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# --- Player History Settings ---
+HISTORY_SEASON_START_MONTH = 7 # Seasons run July to June, e.g. "2025-2026"
+HISTORY_COMPACT_AFTER_FILES = 64 # Files of one compaction level merged into one file of the next level
+HISTORY_ROW_GROUP_SIZE = 10_000
+HISTORY_SOURCE_SKILLS = "skills"
+HISTORY_SOURCE_BIOMECHANICS = "biomechanics"
+HISTORY_GRADES = ['ممتاز (A)', 'جيد جداً (B)', 'جيد (C)', 'مقبول (D)', 'ضعيف (F)'] # Full-evaluation grades, best first
+HISTORY_SCHEMA = pa.schema([
+    ("recorded_at", pa.timestamp("ms", tz="UTC")),
+    ("player", pa.string()),
+    ("video", pa.string()),
+    ("source", pa.string()), # HISTORY_SOURCE_SKILLS or HISTORY_SOURCE_BIOMECHANICS
+    ("metric", pa.string()), # Skill key, biomechanics key, "Total_Score" or "Grade"
+    ("value", pa.float64()), # Null for text values ("غير واضح", risk level)
+    ("text", pa.string()), # The value as shown in the app
+])
+# Per-evaluation parts are level 0 ("part-<ts>-<random>.parquet"); a compacted file is "part-<ts>-L<level>.parquet"
+_HISTORY_LEVEL_RE = re.compile(r'-L(\d+)\.parquet$')
+
+
+def _history_number(value_raw):
+    """First number in a raw metric value ('5.6%' -> 5.6), or None for text such as 'غير واضح'."""
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value_raw).replace(',', ''))
+    return float(match.group(0)) if match else None
+
+
+def history_season(moment):
+    """Football season of a datetime, e.g. '2025-2026' for any date from July 2025 to June 2026."""
+    start_year = moment.year if moment.month >= HISTORY_SEASON_START_MONTH else moment.year - 1
+    return f"{start_year}-{start_year + 1}"
+
+
+def _compaction_level(path):
+    """Compaction level of a part file, from its name (0 for a per-evaluation file)."""
+    match = _HISTORY_LEVEL_RE.search(path)
+    return int(match.group(1)) if match else 0
+
+
+class PlayerHistoryStore:
+    """
+    Append-only history of every skill score and biomechanics metric, one row per metric,
+    as Parquet files partitioned by season and age group (hive layout: season=.../age_group=...).
+    Each evaluation is written as a new small file. Compaction is tiered: once a partition holds
+    HISTORY_COMPACT_AFTER_FILES files of one level they are merged, sorted by player, into one
+    file of the next level, so every row is rewritten once per level instead of on every merge.
+    Per-player aggregates (evaluation count, best grade, Risk_Score trend, partitions holding
+    the player's rows) are updated incrementally on every append, so the history view reads
+    only that player's partitions and never rescans the whole store.
+    """
+    def __init__(self, root_dir, age_group_codes=None, compact_after_files=HISTORY_COMPACT_AFTER_FILES):
+        self._records_dir = os.path.join(root_dir, "records")
+        self._aggregates_path = os.path.join(root_dir, "player_aggregates.json")
+        self._age_group_codes = age_group_codes or {} # Age group -> ASCII partition directory name
+        self._compact_after_files = compact_after_files
+        self._lock = threading.Lock()
+        os.makedirs(self._records_dir, exist_ok=True)
+        self._aggregates = {} # player -> running aggregates
+        if os.path.exists(self._aggregates_path):
+            with open(self._aggregates_path, encoding="utf-8") as f:
+                self._aggregates = json.load(f)
+            logging.info(f"Player history loaded aggregates for {len(self._aggregates)} players from {root_dir}")
+
+    def _partition_dir(self, season, age_group):
+        return os.path.join(self._records_dir, f"season={season}", f"age_group={self._age_group_codes.get(age_group, age_group)}")
+
+    @staticmethod
+    def _rows(results, source):
+        """(metric, value, text) rows for one evaluation's results; Total_Score and Grade only for a letter grade."""
+        if source == HISTORY_SOURCE_SKILLS:
+            rows = [(key, float(score), str(score)) for key, score in results.get("scores", {}).items()]
+            if results.get("max_score") and results.get("grade") in HISTORY_GRADES:
+                rows.append(("Total_Score", float(results["total_score"]), f"{results['total_score']}/{results['max_score']}"))
+                rows.append(("Grade", results["total_score"] / results["max_score"] * 100, str(results["grade"])))
+            return rows
+        return [(key, _history_number(value_raw), str(value_raw)) for key, value_raw in results.items()]
+
+    def append(self, player, age_group, video_name, source, results, recorded_at=None):
+        """Writes one evaluation (source: 'skills' or 'biomechanics') and updates the player's aggregates."""
+        recorded_at = recorded_at or datetime.now(timezone.utc)
+        rows = self._rows(results, source)
+        if not rows:
+            return
+        metrics, values, texts = zip(*rows)
+        table = pa.table({
+            "recorded_at": [recorded_at] * len(rows), "player": [player] * len(rows),
+            "video": [video_name] * len(rows), "source": [source] * len(rows),
+            "metric": list(metrics), "value": list(values), "text": list(texts),
+        }, schema=HISTORY_SCHEMA)
+        season = history_season(recorded_at)
+        partition_dir = self._partition_dir(season, age_group)
+        with self._lock:
+            os.makedirs(partition_dir, exist_ok=True)
+            path = os.path.join(partition_dir, f"part-{recorded_at:%Y%m%dT%H%M%S%f}-{os.urandom(4).hex()}.parquet")
+            pq.write_table(table, path + ".tmp")
+            os.replace(path + ".tmp", path) # Readers never see a half-written file
+            self._update_aggregates(player, season, age_group, source, results, recorded_at)
+            self._compact(partition_dir)
+        logging.info(f"Player history: recorded {len(rows)} {source} metrics for '{player}' ({season}, {age_group}).")
+
+    def _update_aggregates(self, player, season, age_group, source, results, recorded_at):
+        aggregates = self._aggregates.setdefault(player, {
+            "evaluations": 0, "first_seen": recorded_at.isoformat(), "last_seen": None, "partitions": [],
+            "best_grade": None, "best_percent": None,
+            "risk": {"n": 0, "sum_t": 0.0, "sum_tt": 0.0, "sum_r": 0.0, "sum_tr": 0.0, "last": None},
+        })
+        aggregates["evaluations"] += 1
+        aggregates["last_seen"] = recorded_at.isoformat()
+        if [season, age_group] not in aggregates["partitions"]:
+            aggregates["partitions"].append([season, age_group])
+        if source == HISTORY_SOURCE_SKILLS and results.get("max_score") and results.get("grade") in HISTORY_GRADES:
+            percent = results["total_score"] / results["max_score"] * 100
+            if aggregates["best_percent"] is None or percent > aggregates["best_percent"]:
+                aggregates["best_percent"], aggregates["best_grade"] = percent, results["grade"]
+        risk_score = _history_number(results.get("Risk_Score")) if source == HISTORY_SOURCE_BIOMECHANICS else None
+        if risk_score is not None:
+            # Running sums for a least-squares trend; t in days since the player was first seen
+            t = (recorded_at - datetime.fromisoformat(aggregates["first_seen"])).total_seconds() / 86400
+            risk = aggregates["risk"]
+            risk["n"] += 1
+            risk["sum_t"] += t
+            risk["sum_tt"] += t * t
+            risk["sum_r"] += risk_score
+            risk["sum_tr"] += t * risk_score
+            risk["last"] = risk_score
+        tmp_path = self._aggregates_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._aggregates, f, ensure_ascii=False)
+        os.replace(tmp_path, self._aggregates_path)
+
+    def _compact(self, partition_dir):
+        """Merges each level that has reached the threshold into one file of the next level (caller holds the lock)."""
+        level = 0
+        while True:
+            parts = sorted(part for part in glob.glob(os.path.join(partition_dir, "part-*.parquet")) if _compaction_level(part) == level)
+            if len(parts) < self._compact_after_files:
+                return
+            table = pa.concat_tables([pq.read_table(part, schema=HISTORY_SCHEMA) for part in parts])
+            table = table.sort_by([("player", "ascending"), ("recorded_at", "ascending")]) # Row-group stats then skip other players
+            compacted_path = os.path.join(partition_dir, f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-L{level + 1}.parquet")
+            pq.write_table(table, compacted_path + ".tmp", row_group_size=HISTORY_ROW_GROUP_SIZE)
+            os.replace(compacted_path + ".tmp", compacted_path)
+            for part in parts:
+                os.remove(part)
+            logging.info(f"Player history: compacted {len(parts)} level-{level} files ({table.num_rows} rows) in {partition_dir}")
+            level += 1
+
+    def players(self):
+        with self._lock:
+            return sorted(self._aggregates)
+
+    def summary(self, player):
+        """The player's running aggregates plus the Risk_Score trend (points per 30 days, None below 2 dated scores)."""
+        with self._lock:
+            aggregates = copy.deepcopy(self._aggregates.get(player)) # Safe to read outside the lock
+        if not aggregates:
+            return None
+        risk = aggregates["risk"]
+        denominator = risk["n"] * risk["sum_tt"] - risk["sum_t"] ** 2
+        aggregates["risk_trend_per_30_days"] = (
+            (risk["n"] * risk["sum_tr"] - risk["sum_t"] * risk["sum_r"]) / denominator * 30
+            if risk["n"] >= 2 and denominator > 1e-9 else None
+        )
+        return aggregates
+
+    def load_player(self, player):
+        """All history rows of one player as a DataFrame, read only from the partitions that hold the player."""
+        summary = self.summary(player)
+        frames = []
+        for season, age_group in (summary["partitions"] if summary else []):
+            partition_dir = self._partition_dir(season, age_group)
+            with self._lock: # Compaction may replace the files between listing and reading
+                parts = glob.glob(os.path.join(partition_dir, "part-*.parquet"))
+                if not parts:
+                    continue
+                table = ds.dataset(parts, format="parquet", schema=HISTORY_SCHEMA).to_table(filter=ds.field("player") == player)
+            frame = table.to_pandas()
+            frame["season"], frame["age_group"] = season, age_group
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=HISTORY_SCHEMA.names + ["season", "age_group"])
+        return pd.concat(frames, ignore_index=True).sort_values("recorded_at", ignore_index=True)
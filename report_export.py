@@ -0,0 +1,204 @@
+"""
+Bulk report rendering for scouting sessions (per-player PNG/PDF and a combined squad PDF).
+
+Runs inside worker processes, so it must stay importable without Streamlit:
+app.py builds plain-data jobs and calls export_squad_reports().
+"""
+import os
+import logging
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use("Agg") # Headless rendering in worker processes
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+import arabic_reshaper
+from bidi.algorithm import get_display
+
+REPORT_FORMATS = ("png", "pdf")
+REPORT_PAGE_SIZE = (8.27, 11.69) # A4 portrait, inches
+SQUAD_REPORT_NAME = "squad_report.pdf"
+REPORT_PNG_DPI = 150 # Player PNGs are also the squad report's pages, so they are rendered sharp enough to print
+
+# One figure per worker process, cleared and redrawn for every report
+_worker_figure = None
+_worker_axes = None
+
+
+def _ar(text):
+    """Reshapes Arabic text for matplotlib (right-to-left, joined letters)."""
+    return get_display(arabic_reshaper.reshape(str(text)))
+
+
+def _init_worker():
+    """Process-pool initializer: builds the figure template once per worker."""
+    global _worker_figure, _worker_axes
+    _worker_figure, (chart_ax, table_ax) = plt.subplots(
+        2, 1, figsize=REPORT_PAGE_SIZE, gridspec_kw={"height_ratios": [3, 2]}
+    )
+    _worker_axes = (chart_ax, table_ax)
+
+
+def _template():
+    if _worker_figure is None: # Called without the pool initializer (e.g. directly in-process)
+        _init_worker()
+    for ax in _worker_axes:
+        ax.clear()
+        ax.axis("on")
+    return _worker_figure, _worker_axes
+
+
+def _draw_skill_chart(ax, evaluation, skills_labels_ar, max_score_per_skill):
+    scores_dict = evaluation.get("scores", {})
+    keys = [key for key in scores_dict if key in skills_labels_ar]
+    if not keys:
+        ax.text(0.5, 0.5, _ar("لا توجد بيانات لعرضها"), ha="center", va="center")
+        ax.axis("off")
+        return
+    scores = [scores_dict[key] for key in keys]
+    bars = ax.bar([_ar(skills_labels_ar[key]) for key in keys], scores)
+    for bar, score in zip(bars, scores):
+        bar.set_color("#2ca02c" if score >= 4 else "#ff7f0e" if score >= 2.5 else "#d62728")
+        ax.text(bar.get_x() + bar.get_width() / 2.0, score + 0.1, f"{score}", ha="center", va="bottom", fontweight="bold")
+    ax.set_ylim(0, max_score_per_skill + 0.5)
+    ax.set_ylabel(_ar(f"الدرجة (من {max_score_per_skill})"))
+    ax.set_title(_ar(f"التقدير: {evaluation.get('grade', 'N/A')} ({evaluation.get('total_score', 0)}/{evaluation.get('max_score', 0)})"))
+    ax.grid(axis="y", linestyle="--", alpha=0.6)
+    ax.tick_params(axis="x", rotation=15)
+
+
+def _draw_table(ax, rows, col_labels):
+    ax.axis("off")
+    if not rows:
+        return
+    table = ax.table(cellText=rows, colLabels=col_labels, loc="upper center", cellLoc="left")
+    table.auto_set_font_size(False)
+    table.set_fontsize(9)
+    table.scale(1, 1.3)
+
+
+def _draw_player_page(job, max_score_per_skill):
+    fig, (chart_ax, table_ax) = _template()
+    fig.suptitle(_ar(f"تقرير اللاعب: {job['player']}"), fontsize=14, fontweight="bold")
+    if job.get("evaluation"):
+        _draw_skill_chart(chart_ax, job["evaluation"], job["skills_labels_ar"], max_score_per_skill)
+    else:
+        chart_ax.axis("off")
+    if job.get("biomechanics"):
+        _draw_table(table_ax, [[label, value] for label, value in job["biomechanics"]], ["Metric", "Value"])
+    else:
+        table_ax.axis("off")
+    return fig
+
+
+def render_player_report(job, output_dir, formats=REPORT_FORMATS, max_score_per_skill=5):
+    """
+    Worker task: renders one player's report into output_dir, one file per format.
+    job: {"player": str, "file_stem": str, "evaluation": dict|None,
+          "skills_labels_ar": dict, "biomechanics": [(label, value), ...]|None}
+    """
+    fig = _draw_player_page(job, max_score_per_skill)
+    paths = []
+    for fmt in formats:
+        path = os.path.join(output_dir, f"{job['file_stem']}.{fmt}")
+        fig.savefig(path, format=fmt, dpi=REPORT_PNG_DPI if fmt == "png" else None)
+        paths.append(path)
+    return paths
+
+
+def render_squad_report(jobs, player_pages, output_dir):
+    """
+    Worker task: renders the combined squad PDF, a summary page followed by the players'
+    already rendered PNG pages (placed as images, so no player page is drawn twice).
+    """
+    path = os.path.join(output_dir, SQUAD_REPORT_NAME)
+    with PdfPages(path) as pdf:
+        fig, (chart_ax, table_ax) = _template()
+        fig.suptitle(_ar("تقرير الفريق"), fontsize=14, fontweight="bold")
+        graded = [job for job in jobs if job.get("evaluation")]
+        if graded:
+            chart_ax.barh([_ar(job["player"]) for job in graded], [job["evaluation"]["total_score"] for job in graded])
+            chart_ax.invert_yaxis()
+            chart_ax.set_xlabel(_ar("مجموع النقاط"))
+        else:
+            chart_ax.axis("off")
+        _draw_table(
+            table_ax,
+            [[_ar(job["player"]),
+              f"{job['evaluation']['total_score']}/{job['evaluation']['max_score']}" if job.get("evaluation") else "-",
+              _ar(job["evaluation"]["grade"]) if job.get("evaluation") else "-"]
+             for job in jobs],
+            ["Player", "Total", "Grade"]
+        )
+        pdf.savefig(fig)
+        page = plt.figure(figsize=REPORT_PAGE_SIZE)
+        try:
+            page_ax = page.add_axes([0, 0, 1, 1])
+            for player_page in player_pages:
+                page_ax.clear()
+                page_ax.axis("off")
+                page_ax.imshow(plt.imread(player_page))
+                pdf.savefig(page, dpi=REPORT_PNG_DPI)
+        finally:
+            plt.close(page)
+    return [path]
+
+
+def create_report_pool(workers=2):
+    """A process pool for export_squad_reports, meant to be kept for the life of the server process."""
+    # "spawn": the Streamlit server is multi-threaded, so forking it is unsafe
+    return ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker)
+
+
+def export_squad_reports(jobs, output_dir, executor=None, workers=2, zip_path=None, formats=REPORT_FORMATS, max_score_per_skill=5):
+    """
+    Renders every player's report in a process pool (the given long-lived executor, or a
+    pool of `workers` made for this call), then the squad report from the players' PNG pages.
+    Files are written to output_dir as they finish; with zip_path they are moved
+    into that zip archive one by one instead. Returns the written paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    own_executor = executor is None
+    executor = create_report_pool(workers) if own_executor else executor
+    render_formats = tuple(formats) + (() if "png" in formats else ("png",)) # The squad report is built from the PNGs
+    written = []
+    archive = zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) if zip_path else None
+
+    def collect(path):
+        if not path.endswith(tuple(f".{fmt}" for fmt in formats)):
+            return
+        if archive:
+            archive.write(path, arcname=os.path.basename(path))
+        else:
+            written.append(path)
+
+    try:
+        futures = {executor.submit(render_player_report, job, output_dir, render_formats, max_score_per_skill): job["file_stem"] for job in jobs}
+        player_pages = {}
+        for future in as_completed(futures):
+            for path in future.result():
+                collect(path)
+                if path.endswith(".png"):
+                    player_pages[futures[future]] = path
+                elif archive:
+                    os.remove(path)
+        squad_pages = [player_pages[job["file_stem"]] for job in jobs]
+        for path in executor.submit(render_squad_report, jobs, squad_pages, output_dir).result():
+            collect(path)
+            if archive:
+                os.remove(path)
+        for path in squad_pages:
+            if archive or "png" not in formats:
+                os.remove(path)
+    finally:
+        if archive:
+            archive.close()
+        if own_executor:
+            executor.shutdown()
+    if zip_path:
+        written = [zip_path]
+    logging.info(f"Exported {len(jobs)} player reports plus squad report to {written[0] if zip_path else output_dir}")
+    return written
@@ -0,0 +1,159 @@
+"""
+Resumable, chunked uploads to the Gemini File API (Google's resumable upload protocol).
+
+The file is sent in fixed-size chunks over a keep-alive connection (one per uploading thread). After a dropped
+connection, a timeout or a 5xx, the uploader asks the server how many bytes it has
+committed and continues from there, so a failure late in a large clip does not restart
+it from zero. Importable without Streamlit; upload_server.py is a local stand-in server
+to exercise it against.
+"""
+import os
+import time
+import threading
+import logging
+import mimetypes
+
+import requests
+
+GEMINI_UPLOAD_BASE_URL = "https://generativelanguage.googleapis.com"
+UPLOAD_CHUNK_GRANULARITY = 256 * 1024 # Every chunk but the last must be a multiple of this
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class ResumableUploadError(Exception):
+    """The upload could not be completed: rejected by the server, stopped, or out of retries."""
+
+
+class ResumableUploader:
+    """
+    upload() returns the File resource dict of the finished upload ({"name": "files/...", ...}).
+    Progress is reported after every committed chunk, and should_stop() is checked between
+    chunks so an abandoned upload also cancels its server-side session.
+    """
+    def __init__(self, base_url=GEMINI_UPLOAD_BASE_URL, api_key=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_retries=8, backoff_s=1.0, timeout_s=60.0):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.timeout_s = timeout_s
+        self._local = threading.local() # requests.Session is not thread-safe: one per uploading thread
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, chunk_size):
+        if chunk_size < UPLOAD_CHUNK_GRANULARITY or chunk_size % UPLOAD_CHUNK_GRANULARITY:
+            raise ValueError(f"Chunk size must be a positive multiple of {UPLOAD_CHUNK_GRANULARITY} bytes, got {chunk_size}.")
+        self._chunk_size = chunk_size
+
+    def _session(self):
+        """This thread's keep-alive session, reused across its chunks and uploads."""
+        session = getattr(self._local, "http", None)
+        if session is None:
+            session = self._local.http = requests.Session()
+        return session
+
+    # --- Protocol commands ---
+    def _post(self, url, headers, **kwargs):
+        response = self._session().post(url, headers=headers, timeout=self.timeout_s, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def start(self, size, mime_type, display_name):
+        """Opens an upload session; returns its upload URL."""
+        response = self._post(
+            f"{self.base_url}/upload/v1beta/files", params={"key": self.api_key} if self.api_key else None,
+            headers={
+                "X-Goog-Upload-Protocol": "resumable", "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(size), "X-Goog-Upload-Header-Content-Type": mime_type,
+            },
+            json={"file": {"display_name": display_name}},
+        )
+        upload_url = response.headers.get("X-Goog-Upload-URL")
+        if not upload_url:
+            raise ResumableUploadError("The upload server did not return an upload URL.")
+        return upload_url
+
+    def query(self, upload_url):
+        """(bytes committed, File resource if the upload is already final, else None)."""
+        response = self._post(upload_url, headers={"X-Goog-Upload-Command": "query"})
+        if response.headers.get("X-Goog-Upload-Status") == "final":
+            return int(response.headers.get("X-Goog-Upload-Size-Received", 0)), response.json()["file"]
+        return int(response.headers.get("X-Goog-Upload-Size-Received", 0)), None
+
+    def cancel(self, upload_url):
+        try:
+            self._post(upload_url, headers={"X-Goog-Upload-Command": "cancel"})
+        except requests.RequestException as e:
+            logging.warning(f"Could not cancel upload session: {e}")
+
+    def _send_chunk(self, upload_url, data, offset, is_last):
+        return self._post(upload_url, data=data, headers={
+            "X-Goog-Upload-Command": "upload, finalize" if is_last else "upload",
+            "X-Goog-Upload-Offset": str(offset),
+        })
+
+    # --- Upload with resume ---
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and (error.response.status_code >= 500 or error.response.status_code == 429)
+        return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+    def _backoff(self, failures, error, what):
+        if not self._is_retryable(error) or failures > self.max_retries:
+            raise ResumableUploadError(f"Upload failed during {what} after {failures - 1} retries: {error}") from error
+        delay_s = self.backoff_s * 2 ** (failures - 1)
+        logging.warning(f"Upload {what} failed ({error}); retry {failures}/{self.max_retries} in {delay_s:.1f}s.")
+        time.sleep(delay_s)
+
+    def upload(self, path, display_name, mime_type=None, on_progress=None, should_stop=None):
+        """
+        Uploads path in chunk_size pieces; on_progress(bytes_committed, total_bytes) after each chunk.
+        A failed chunk is resent from the offset the server reports as committed.
+        """
+        size = os.path.getsize(path)
+        mime_type = mime_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        failures = 0
+        while True:
+            try:
+                upload_url = self.start(size, mime_type, display_name)
+                break
+            except requests.RequestException as e:
+                failures += 1
+                self._backoff(failures, e, "start")
+
+        start_time = time.time()
+        offset, failures, resync = 0, 0, False
+        with open(path, "rb") as f:
+            while True:
+                if should_stop and should_stop():
+                    self.cancel(upload_url)
+                    raise ResumableUploadError(f"Upload of '{display_name}' stopped at {offset}/{size} bytes.")
+                try:
+                    if resync: # After a failure, trust only what the server has committed
+                        offset, final_file = self.query(upload_url)
+                        resync = False
+                        if final_file:
+                            return final_file
+                    f.seek(offset)
+                    data = f.read(self.chunk_size)
+                    is_last = offset + len(data) >= size
+                    response = self._send_chunk(upload_url, data, offset, is_last)
+                except requests.RequestException as e:
+                    failures += 1
+                    resync = True
+                    self._backoff(failures, e, f"at offset {offset}/{size}")
+                    continue
+                failures = 0
+                offset += len(data)
+                if on_progress:
+                    on_progress(offset, size)
+                if is_last:
+                    elapsed_s = time.time() - start_time
+                    logging.info(f"Uploaded '{display_name}' ({size} bytes) in {elapsed_s:.1f}s ({size / max(elapsed_s, 1e-6) / 1024 ** 2:.1f} MB/s).")
+                    return response.json()["file"]
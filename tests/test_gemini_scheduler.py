@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+from gemini_scheduler import (
+    SCHEDULER_PRIORITY_BULK, SCHEDULER_PRIORITY_INTERACTIVE, CancellationToken, EvaluationCancelled,
+    EvaluationDeadline, FairShareScheduler,
+)
+
+
+def _deadline(owner, priority=SCHEDULER_PRIORITY_BULK, token=None):
+    return EvaluationDeadline(30.0, token=token, owner=owner, priority=priority)
+
+
+def _wait_until(condition, timeout_s=5.0):
+    stop_at = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < stop_at, "timed out"
+        time.sleep(0.005)
+
+
+class AdmissionRecorder:
+    """Queues calls behind one held slot, then records the order the scheduler admits them in."""
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.order = []
+        self._threads = []
+        self._lock = threading.Lock()
+        self._held = scheduler.admit(_deadline("holder"), "hold")
+
+    def queue(self, label, owner, priority=SCHEDULER_PRIORITY_BULK):
+        queued_before = sum(self.scheduler.stats()["queued"].values())
+
+        def admit_and_release():
+            ticket = self.scheduler.admit(_deadline(owner, priority), label)
+            with self._lock:
+                self.order.append(label)
+            self.scheduler.release(ticket)
+
+        thread = threading.Thread(target=admit_and_release)
+        thread.start()
+        self._threads.append(thread)
+        _wait_until(lambda: sum(self.scheduler.stats()["queued"].values()) == queued_before + 1)
+
+    def run(self):
+        self.scheduler.release(self._held)
+        for thread in self._threads:
+            thread.join(5.0)
+        return self.order
+
+
+@pytest.fixture
+def scheduler():
+    return FairShareScheduler(max_concurrent=1, requests_per_minute=60000, burst=100)
+
+
+def test_sessions_share_admissions_fairly(scheduler):
+    recorder = AdmissionRecorder(scheduler)
+    for i in range(1, 4):
+        recorder.queue(f"a{i}", "scout_a")
+    recorder.queue("b1", "scout_b")
+    recorder.queue("b2", "scout_b")
+    assert recorder.run() == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_interactive_calls_go_before_bulk(scheduler):
+    recorder = AdmissionRecorder(scheduler)
+    recorder.queue("bulk1", "scout_a")
+    recorder.queue("bulk2", "scout_b")
+    recorder.queue("interactive", "scout_c", SCHEDULER_PRIORITY_INTERACTIVE)
+    assert recorder.run() == ["interactive", "bulk1", "bulk2"]
+
+
+def test_idle_sessions_are_forgotten(scheduler):
+    recorder = AdmissionRecorder(scheduler)
+    for owner in ("scout_a", "scout_b", "scout_c"):
+        recorder.queue(owner, owner)
+    recorder.run()
+    assert scheduler._last_tags == {} and scheduler._queued_counts == {}
+
+
+def test_cancelled_caller_leaves_the_queue(scheduler):
+    held = scheduler.admit(_deadline("holder"), "hold")
+    token = CancellationToken()
+    errors = []
+
+    def admit():
+        try:
+            scheduler.admit(_deadline("scout_a", token=token), "skill")
+        except EvaluationCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=admit)
+    thread.start()
+    _wait_until(lambda: scheduler.stats()["queued"][SCHEDULER_PRIORITY_BULK] == 1)
+    token.cancel("scout left")
+    thread.join(5.0)
+    assert len(errors) == 1
+    assert scheduler.stats()["queued"][SCHEDULER_PRIORITY_BULK] == 0
+    scheduler.release(held)
+    assert scheduler.admit(_deadline("scout_b"), "skill") is not None # The slot was not lost
+
+
+def test_call_frees_the_slot_when_it_returns(scheduler):
+    ticket = scheduler.admit(_deadline("scout_a"), "skill")
+    assert scheduler.call(ticket, lambda: "score") == "score"
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_stream_holds_the_slot_until_drained(scheduler):
+    ticket = scheduler.admit(_deadline("scout_a"), "biomechanics")
+    stream = scheduler.call_stream(ticket, lambda: iter(["chunk1", "chunk2"]))
+    assert scheduler.stats()["in_flight"] == 1
+    assert next(stream) == "chunk1"
+    assert scheduler.stats()["in_flight"] == 1
+    assert list(stream) == ["chunk2"]
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_closing_a_stream_early_frees_the_slot(scheduler):
+    def chunks():
+        yield "chunk1"
+        yield "chunk2"
+
+    ticket = scheduler.admit(_deadline("scout_a"), "biomechanics")
+    stream = scheduler.call_stream(ticket, chunks)
+    next(stream)
+    stream.close()
+    stream.close() # Idempotent
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_quota_error_while_streaming_pauses_admission(scheduler):
+    class ResourceExhausted(Exception):
+        pass
+
+    def chunks():
+        yield "chunk1"
+        raise ResourceExhausted("429")
+
+    ticket = scheduler.admit(_deadline("scout_a"), "biomechanics")
+    stream = scheduler.call_stream(ticket, chunks)
+    next(stream)
+    with pytest.raises(ResourceExhausted):
+        next(stream)
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0 and stats["quota_errors"] == 1 and stats["tokens"] == 0
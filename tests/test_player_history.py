@@ -0,0 +1,86 @@
+import glob
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from player_history import HISTORY_SOURCE_BIOMECHANICS, HISTORY_SOURCE_SKILLS, PlayerHistoryStore, history_season
+
+START = datetime(2025, 9, 1, tzinfo=timezone.utc)
+AGE_GROUP = "age 8+"
+
+
+def _skills(total, grade, max_score=25):
+    return {"scores": {"Jumping": total}, "total_score": total, "max_score": max_score, "grade": grade}
+
+
+def _parts(store_dir):
+    return sorted(os.path.basename(p) for p in glob.glob(os.path.join(str(store_dir), "records", "*", "*", "part-*.parquet")))
+
+
+def test_season_runs_july_to_june():
+    assert history_season(datetime(2025, 7, 1)) == "2025-2026"
+    assert history_season(datetime(2026, 6, 30)) == "2025-2026"
+    assert history_season(datetime(2026, 7, 1)) == "2026-2027"
+
+
+def test_aggregates_track_best_grade_and_partitions(tmp_path):
+    store = PlayerHistoryStore(str(tmp_path), {AGE_GROUP: "8-plus"})
+    store.append("Ali", AGE_GROUP, "a.mp4", HISTORY_SOURCE_SKILLS, _skills(15, 'جيد (C)'), recorded_at=START)
+    store.append("Ali", AGE_GROUP, "b.mp4", HISTORY_SOURCE_SKILLS, _skills(22, 'ممتاز (A)'), recorded_at=START + timedelta(days=1))
+    store.append("Ali", AGE_GROUP, "c.mp4", HISTORY_SOURCE_SKILLS, _skills(18, 'جيد جداً (B)'), recorded_at=datetime(2026, 8, 1, tzinfo=timezone.utc))
+    summary = store.summary("Ali")
+    assert summary["evaluations"] == 3
+    assert summary["best_grade"] == 'ممتاز (A)'
+    assert summary["best_percent"] == pytest.approx(88.0)
+    assert summary["partitions"] == [["2025-2026", AGE_GROUP], ["2026-2027", AGE_GROUP]]
+    assert store.players() == ["Ali"]
+    assert store.summary("Omar") is None
+    assert os.path.isdir(tmp_path / "records" / "season=2025-2026" / "age_group=8-plus")
+
+
+def test_grade_rows_only_for_letter_grades(tmp_path):
+    store = PlayerHistoryStore(str(tmp_path))
+    store.append("Ali", AGE_GROUP, "one.mp4", HISTORY_SOURCE_SKILLS, _skills(4, "N/A", max_score=5), recorded_at=START)
+    store.append("Ali", AGE_GROUP, "part.mp4", HISTORY_SOURCE_SKILLS, _skills(20, "غير مكتمل"), recorded_at=START + timedelta(hours=1))
+    store.append("Ali", AGE_GROUP, "full.mp4", HISTORY_SOURCE_SKILLS, _skills(12, 'مقبول (D)'), recorded_at=START + timedelta(hours=2))
+    frame = store.load_player("Ali")
+    assert list(frame.loc[frame["metric"] == "Grade", "video"]) == ["full.mp4"]
+    assert list(frame.loc[frame["metric"] == "Total_Score", "video"]) == ["full.mp4"]
+    assert len(frame.loc[frame["metric"] == "Jumping"]) == 3
+    assert store.summary("Ali")["best_grade"] == 'مقبول (D)'
+
+
+def test_risk_trend_and_text_values(tmp_path):
+    store = PlayerHistoryStore(str(tmp_path))
+    for day, risk in enumerate([1, 2, 3]):
+        results = {"Risk_Score": str(risk), "Risk_Level": "منخفض", "Asymmetry_Avg_Percent": "5.6%"}
+        store.append("Ali", AGE_GROUP, f"{day}.mp4", HISTORY_SOURCE_BIOMECHANICS, results, recorded_at=START + timedelta(days=day))
+    summary = store.summary("Ali")
+    assert summary["risk"]["last"] == 3
+    assert summary["risk_trend_per_30_days"] == pytest.approx(30.0)
+    frame = store.load_player("Ali")
+    assert frame.loc[frame["metric"] == "Asymmetry_Avg_Percent", "value"].tolist() == [5.6] * 3
+    assert frame.loc[frame["metric"] == "Risk_Level", "value"].isna().all()
+
+
+def test_aggregates_survive_restart(tmp_path):
+    store = PlayerHistoryStore(str(tmp_path))
+    store.append("Ali", AGE_GROUP, "a.mp4", HISTORY_SOURCE_SKILLS, _skills(22, 'ممتاز (A)'), recorded_at=START)
+    reopened = PlayerHistoryStore(str(tmp_path))
+    assert reopened.summary("Ali")["best_grade"] == 'ممتاز (A)'
+    assert len(reopened.load_player("Ali")) == 3
+
+
+def test_compaction_is_tiered(tmp_path):
+    store = PlayerHistoryStore(str(tmp_path), compact_after_files=3)
+    for i in range(9):
+        store.append(f"P{i % 2}", AGE_GROUP, f"{i}.mp4", HISTORY_SOURCE_SKILLS, _skills(i, 'ضعيف (F)'), recorded_at=START + timedelta(minutes=i))
+        parts = _parts(tmp_path)
+        level_one = [p for p in parts if p.endswith("-L1.parquet")]
+        # A level-1 file must not be merged again with the next small parts
+        assert len(parts) - len(level_one) < 3
+    parts = _parts(tmp_path)
+    assert len(parts) == 1 and parts[0].endswith("-L2.parquet")
+    frame = store.load_player("P0")
+    assert frame["video"].tolist() == [f"{i}.mp4" for i in range(0, 9, 2) for _ in range(3)]
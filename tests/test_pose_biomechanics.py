@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from biomechanics import (
+    POSE_EXTRA_METRICS_EN, POSE_LANDMARKS, POSE_MIN_VISIBILITY, STEP_SIDE_LEFT, STEP_SIDE_RIGHT,
+    compute_pose_biomechanics, pose_risk_score,
+)
+
+FPS = 30.0
+STEP_PERIOD_S = 2 / 3 # Each foot strikes every 2/3 s, so 3 steps/s in total
+CONTACT_DEG = 10.0
+PELVIC_TILT_DEG = 5.0
+THORAX_ROTATION_DEG = 20.0
+
+
+def _runner(seconds=4.0, scale=1.0, hip_sway=0.0):
+    """Synthetic side-on runner facing the right of the frame: (times, image_keypoints, world_keypoints)."""
+    times = np.arange(int(seconds * FPS)) / FPS
+    image = np.zeros((times.size, 33, 3))
+    image[..., 2] = 1.0 # Fully visible
+    sway = hip_sway * np.sin(2 * np.pi * times)
+    for side, phase in ((STEP_SIDE_RIGHT, 0.0), (STEP_SIDE_LEFT, STEP_PERIOD_S / 2)):
+        heel_y = 0.9 - 0.05 * np.maximum(0.0, np.sin(2 * np.pi * (times + phase) / STEP_PERIOD_S))
+        points = {
+            "shoulder": (0.5, 0.3), "hip": (0.5 + sway, 0.55), "knee": (0.55, 0.7), "ankle": (0.5, 0.85),
+            "heel": (0.48, heel_y), "toe": (0.56, heel_y - 0.08 * np.tan(np.radians(CONTACT_DEG))),
+        }
+        for name, (x, y) in points.items():
+            image[:, POSE_LANDMARKS[name][side], 0] = x
+            image[:, POSE_LANDMARKS[name][side], 1] = y
+    image[..., :2] *= scale
+
+    world = np.zeros((times.size, 33, 3))
+    tilt, rotation = np.radians(PELVIC_TILT_DEG), np.radians(THORAX_ROTATION_DEG)
+    world[:, POSE_LANDMARKS["hip"][0]] = (-0.1, 0.1 * np.tan(tilt), 0.0) # Right hip lower (world y points down)
+    world[:, POSE_LANDMARKS["hip"][1]] = (0.1, -0.1 * np.tan(tilt), 0.0)
+    world[:, POSE_LANDMARKS["shoulder"][0]] = (-0.2 * np.cos(rotation), -0.5, -0.2 * np.sin(rotation))
+    world[:, POSE_LANDMARKS["shoulder"][1]] = (0.2 * np.cos(rotation), -0.5, 0.2 * np.sin(rotation))
+    return times, image, world
+
+
+def test_steps_alternate_at_the_stride_rate():
+    series, _ = compute_pose_biomechanics(*_runner())
+    assert series.size >= 8
+    assert np.all(series["side"][1:] != series["side"][:-1])
+    assert np.diff(series["time_s"]) == pytest.approx(np.full(series.size - 1, STEP_PERIOD_S / 2), abs=0.05)
+
+
+def test_joint_angles_match_the_pose():
+    series, _ = compute_pose_biomechanics(*_runner())
+    thigh, shank = np.array([-0.05, -0.15]), np.array([-0.05, 0.15]) # Knee to hip, knee to ankle
+    knee = np.degrees(np.arccos(thigh @ shank / np.linalg.norm(thigh) / np.linalg.norm(shank)))
+    assert series["knee_angle"] == pytest.approx(np.full(series.size, knee), abs=0.01)
+    assert series["contact_angle"] == pytest.approx(np.full(series.size, CONTACT_DEG), abs=0.01)
+    assert series["trunk_lean"] == pytest.approx(np.zeros(series.size), abs=0.01)
+
+
+def test_clip_metrics_use_their_own_keys():
+    _, clip_metrics = compute_pose_biomechanics(*_runner())
+    assert set(clip_metrics) == set(POSE_EXTRA_METRICS_EN) | {"Thorax_Rotation_Avg"}
+    assert clip_metrics["Pelvic_Lateral_Tilt_Avg"] == pytest.approx(PELVIC_TILT_DEG)
+    assert clip_metrics["Thorax_Rotation_Avg"] == pytest.approx(THORAX_ROTATION_DEG)
+    assert clip_metrics["Hip_Peak_Acceleration_BL"] == pytest.approx(0.0, abs=1e-9) # Hips do not move
+
+
+def test_hip_acceleration_is_in_body_lengths():
+    _, small = compute_pose_biomechanics(*_runner(hip_sway=0.02))
+    _, large = compute_pose_biomechanics(*_runner(hip_sway=0.02, scale=1.5)) # Same motion, player closer to the camera
+    assert small["Hip_Peak_Acceleration_BL"] > 0
+    assert large["Hip_Peak_Acceleration_BL"] == pytest.approx(small["Hip_Peak_Acceleration_BL"])
+
+
+def test_invisible_landmarks_give_no_steps_or_metrics():
+    times, image, world = _runner()
+    image[..., 2] = POSE_MIN_VISIBILITY / 2
+    series, clip_metrics = compute_pose_biomechanics(times, image, world)
+    assert series.size == 0
+    assert all(value is None for value in clip_metrics.values())
+
+
+def test_risk_score_counts_prompt_criteria():
+    assert pose_risk_score({}) == 0
+    assert pose_risk_score({"Right_Knee_Angle_Avg": 130, "Left_Knee_Angle_Avg": 130, "Step_Frequency": 2.0}) == 0
+    risky = {"Right_Knee_Angle_Avg": 160, "Left_Knee_Angle_Avg": 100, "Asymmetry_Avg_Percent": 20,
+             "Step_Frequency": 1.0, "Hip_Flexion_Avg": 40, "Trunk_Lean_Avg": 20}
+    assert pose_risk_score(risky) == 5
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from resumable_upload import UPLOAD_CHUNK_GRANULARITY, ResumableUploader, ResumableUploadError
+from upload_server import StandInUploadServer
+
+CHUNK_SIZE = UPLOAD_CHUNK_GRANULARITY * 4 # 1 MiB
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    servers = []
+
+    def start(drop_rate=0.0, error_rate=0.0, seed=7):
+        server = StandInUploadServer(("127.0.0.1", 0), drop_rate, error_rate, seed, storage_dir=str(tmp_path / f"server{len(servers)}"))
+        os.makedirs(server.storage_dir)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _uploader(server, **kwargs):
+    return ResumableUploader(f"http://127.0.0.1:{server.server_address[1]}", chunk_size=CHUNK_SIZE,
+                             backoff_s=0.01, timeout_s=10, **kwargs)
+
+
+def _clip(tmp_path, name="clip.mp4", size=CHUNK_SIZE * 5 + 12345):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path), hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_upload_in_chunks_reports_progress(start_server, tmp_path):
+    server = start_server()
+    path, expected_sha = _clip(tmp_path)
+    progress = []
+    resource = _uploader(server).upload(path, "clip.mp4", on_progress=lambda sent, total: progress.append((sent, total)))
+    size = os.path.getsize(path)
+    assert resource["sha256Hash"] == expected_sha
+    assert resource["displayName"] == "clip.mp4"
+    assert progress == [(min(size, i * CHUNK_SIZE), size) for i in range(1, 7)]
+    assert server.counters["chunks"] == 6 and server.counters["queries"] == 0
+
+
+def test_resyncs_from_committed_offset_after_drops_and_errors(start_server, tmp_path):
+    server = start_server(drop_rate=0.3, error_rate=0.2, seed=3)
+    path, expected_sha = _clip(tmp_path, size=CHUNK_SIZE * 12)
+    resource = _uploader(server, max_retries=30).upload(path, "clip.mp4")
+    assert resource["sha256Hash"] == expected_sha
+    assert server.counters["drops"] + server.counters["errors"] > 0
+    assert server.counters["queries"] >= server.counters["drops"] + server.counters["errors"] # One resync per failed chunk
+
+
+def test_gives_up_after_max_retries(start_server, tmp_path):
+    server = start_server(error_rate=1.0)
+    path, _ = _clip(tmp_path)
+    with pytest.raises(ResumableUploadError):
+        _uploader(server, max_retries=2).upload(path, "clip.mp4")
+    assert server.counters["errors"] == 3
+
+
+def test_should_stop_cancels_the_server_session(start_server, tmp_path):
+    server = start_server()
+    path, _ = _clip(tmp_path)
+    progress = []
+    with pytest.raises(ResumableUploadError):
+        _uploader(server).upload(path, "clip.mp4", on_progress=lambda sent, total: progress.append(sent),
+                                 should_stop=lambda: len(progress) >= 2)
+    assert len(progress) == 2
+    assert server.sessions == {}
+
+
+def test_concurrent_uploads_use_one_session_per_thread(start_server, tmp_path):
+    server = start_server(drop_rate=0.1, seed=11)
+    uploader = _uploader(server, max_retries=30)
+    clips = [_clip(tmp_path, name=f"clip{i}.mp4") for i in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        resources = list(executor.map(lambda clip: uploader.upload(clip[0], os.path.basename(clip[0])), clips))
+        sessions = set(executor.map(lambda _: id(uploader._session()), range(4)))
+    assert [resource["sha256Hash"] for resource in resources] == [sha for _, sha in clips]
+    assert id(uploader._session()) not in sessions
+
+
+@pytest.mark.parametrize("chunk_size", [0, UPLOAD_CHUNK_GRANULARITY - 1, UPLOAD_CHUNK_GRANULARITY + 1])
+def test_chunk_size_must_be_granularity_multiple(chunk_size):
+    with pytest.raises(ValueError):
+        ResumableUploader(chunk_size=chunk_size)
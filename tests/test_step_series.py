@@ -0,0 +1,90 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from biomechanics import (
+    NOT_CLEAR_AR, STEP_SERIES_DTYPE, STEP_SIDE_LEFT, STEP_SIDE_RIGHT, STEP_SIDE_UNKNOWN,
+    derive_step_metrics, parse_step_series_response, step_series_to_bytes,
+)
+
+
+def _response(steps, **clip_fields):
+    return "Here is the analysis:\n" + json.dumps({"steps": steps, **clip_fields}) + "\nDone."
+
+
+def _series(rows):
+    return np.array(rows, dtype=STEP_SERIES_DTYPE)
+
+
+def test_parse_sorts_by_time_and_maps_sides():
+    text = _response([
+        {"t": 1.0, "side": "L", "knee": 140, "contact": 20, "trunk": 10, "hip": 30},
+        {"t": 0.5, "side": "right", "knee": 150, "contact": 22, "trunk": 12, "hip": 32},
+        {"t": 1.5, "side": "?", "knee": 145, "contact": 21, "trunk": 11, "hip": 31},
+    ], Max_Acceleration=250000, Risk_Level="منخفض")
+    series, model_metrics = parse_step_series_response(text)
+    assert series.dtype == STEP_SERIES_DTYPE
+    assert series["time_s"].tolist() == [0.5, 1.0, 1.5]
+    assert series["side"].tolist() == [STEP_SIDE_RIGHT, STEP_SIDE_LEFT, STEP_SIDE_UNKNOWN]
+    assert model_metrics == {"Max_Acceleration": 250000, "Risk_Level": "منخفض"}
+
+
+def test_parse_keeps_unclear_values_as_nan():
+    series, _ = parse_step_series_response(_response([
+        {"t": 0.2, "side": "R", "knee": None, "contact": "unclear", "trunk": 5, "hip": 20},
+        "not a step",
+    ]))
+    assert series.size == 1
+    assert np.isnan(series["knee_angle"][0]) and np.isnan(series["contact_angle"][0])
+    assert series["trunk_lean"][0] == 5
+
+
+def test_parse_drops_empty_clip_fields():
+    _, model_metrics = parse_step_series_response(_response([], Pelvic_Tilt_Avg="", Risk_Score=None, Thorax_Rotation_Avg=12.5))
+    assert model_metrics == {"Thorax_Rotation_Avg": 12.5}
+
+
+@pytest.mark.parametrize("text", ["no json here", '{"steps": "many"}', "{ broken"])
+def test_parse_rejects_answers_without_a_steps_list(text):
+    with pytest.raises(ValueError):
+        parse_step_series_response(text)
+
+
+def test_derive_averages_asymmetry_and_frequency():
+    series = _series([
+        (0.0, STEP_SIDE_RIGHT, 150, 20, 10, 30),
+        (0.5, STEP_SIDE_LEFT, 130, 24, 12, 34),
+        (1.0, STEP_SIDE_RIGHT, 150, 20, 14, 30),
+        (1.5, STEP_SIDE_LEFT, 130, 24, 16, 34),
+    ])
+    derived = derive_step_metrics(series)
+    assert derived["Right_Knee_Angle_Avg"] == "150.0"
+    assert derived["Left_Knee_Angle_Avg"] == "130.0"
+    assert derived["Asymmetry_Avg_Percent"] == "14.3%" # |150 - 130| / 140
+    assert derived["Contact_Angle_Avg"] == "22.0"
+    assert derived["Steps_Count"] == "4"
+    assert derived["Step_Frequency"] == "2.00"
+    assert derived["Step_Interval_CV_Percent"] == "0.0%"
+    assert derived["Knee_Angle_Trend"] == "-480.0" # Falls 20° over each second between feet
+    assert derived["Trunk_Lean_Drift"] == "+5.0"
+
+
+def test_derive_selected_keys_only():
+    series = _series([(0.0, STEP_SIDE_RIGHT, 150, 20, 10, 30)])
+    assert derive_step_metrics(series, ["Right_Knee_Angle_Avg", "Left_Knee_Angle_Avg"]) == {
+        "Right_Knee_Angle_Avg": "150.0", "Left_Knee_Angle_Avg": NOT_CLEAR_AR,
+    }
+
+
+def test_derive_empty_series_is_not_clear():
+    derived = derive_step_metrics(_series([]))
+    assert set(derived.values()) == {NOT_CLEAR_AR}
+
+
+def test_series_bytes_round_trip():
+    series = _series([(0.0, STEP_SIDE_RIGHT, 150, 20, 10, 30), (0.4, STEP_SIDE_LEFT, np.nan, 21, 11, 31)])
+    loaded = np.load(io.BytesIO(step_series_to_bytes(series)), allow_pickle=False)
+    assert loaded.dtype == STEP_SERIES_DTYPE
+    assert loaded.tobytes() == series.tobytes() # Byte-exact, NaN included
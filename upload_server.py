@@ -0,0 +1,199 @@
+"""
+Local stand-in for the Gemini resumable upload endpoint, for exercising resumable_upload.py
+without network or quota.
+
+Implements the part of Google's resumable upload protocol the uploader uses (start, upload,
+upload + finalize, query, cancel). It can inject failures: connections dropped part-way
+through a chunk (after committing some of it, like a real server) and 503 responses, so
+resuming from the committed offset can be watched under a flaky pitch-side link.
+
+Usage:
+    python upload_server.py --port 8765 --drop-rate 0.2
+    python upload_server.py --self-test clip.mp4 --chunk-mb 1 --drop-rate 0.3 --error-rate 0.1
+"""
+import os
+import sys
+import json
+import uuid
+import random
+import hashlib
+import argparse
+import logging
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from resumable_upload import ResumableUploader, UPLOAD_CHUNK_GRANULARITY
+
+
+class UploadSession:
+    def __init__(self, size, mime_type, display_name, storage_dir):
+        self.id = uuid.uuid4().hex
+        self.size = size
+        self.mime_type = mime_type
+        self.display_name = display_name
+        self.path = os.path.join(storage_dir, self.id)
+        self.committed = 0
+        self.resource = None # Set once finalized
+        open(self.path, "wb").close()
+
+    def commit(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.committed += len(data)
+
+    def finalize(self):
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        self.resource = {
+            "name": f"files/{self.id}", "displayName": self.display_name, "mimeType": self.mime_type,
+            "sizeBytes": str(self.committed), "sha256Hash": digest.hexdigest(), "state": "ACTIVE",
+        }
+
+
+class StandInUploadServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, drop_rate=0.0, error_rate=0.0, seed=None, storage_dir=None):
+        super().__init__(address, UploadHandler)
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.storage_dir = storage_dir or tempfile.mkdtemp(prefix="upload_server_")
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.counters = {"chunks": 0, "drops": 0, "errors": 0, "queries": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real endpoint
+
+    def log_message(self, format, *args):
+        logging.debug(f"upload_server: {format % args}")
+
+    def _reply(self, status, headers=None, body=None):
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _status_headers(self, session):
+        return {"X-Goog-Upload-Status": "final" if session.resource else "active",
+                "X-Goog-Upload-Size-Received": str(session.committed)}
+
+    def do_POST(self):
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if self.path.startswith("/upload/v1beta/files") and command == "start":
+            metadata = json.loads(self._body() or b"{}").get("file", {})
+            session = UploadSession(int(self.headers["X-Goog-Upload-Header-Content-Length"]),
+                                    self.headers.get("X-Goog-Upload-Header-Content-Type", "application/octet-stream"),
+                                    metadata.get("display_name", ""), self.server.storage_dir)
+            with self.server.lock:
+                self.server.sessions[session.id] = session
+            host, port = self.server.server_address[:2]
+            return self._reply(200, {"X-Goog-Upload-Status": "active", "X-Goog-Upload-URL": f"http://{host}:{port}/upload/session/{session.id}"})
+
+        session = self.server.sessions.get(self.path.rsplit("/", 1)[-1]) if self.path.startswith("/upload/session/") else None
+        if not session:
+            self._body()
+            return self._reply(404, body={"error": {"message": "Unknown upload session"}})
+        if command == "query":
+            self.server.count("queries")
+            return self._reply(200, self._status_headers(session), {"file": session.resource} if session.resource else None)
+        if command == "cancel":
+            with self.server.lock:
+                self.server.sessions.pop(session.id, None)
+            os.remove(session.path)
+            return self._reply(200, {"X-Goog-Upload-Status": "cancelled"})
+        if not command.startswith("upload"):
+            self._body()
+            return self._reply(400, body={"error": {"message": f"Unsupported command '{command}'"}})
+
+        offset = int(self.headers.get("X-Goog-Upload-Offset", -1))
+        data = self._body()
+        self.server.count("chunks")
+        if offset != session.committed:
+            return self._reply(400, self._status_headers(session), {"error": {"message": f"Offset {offset} != committed {session.committed}"}})
+        with self.server.lock:
+            fate = self.server.random.random()
+        if fate < self.server.drop_rate:
+            # Keep a granularity-aligned prefix, then drop the connection without replying
+            kept = self.server.random.randrange(0, len(data) + 1) // UPLOAD_CHUNK_GRANULARITY * UPLOAD_CHUNK_GRANULARITY
+            session.commit(data[:kept])
+            self.server.count("drops")
+            self.close_connection = True
+            return
+        if fate < self.server.drop_rate + self.server.error_rate:
+            self.server.count("errors")
+            return self._reply(503, self._status_headers(session), {"error": {"message": "Injected 503"}})
+        session.commit(data)
+        if "finalize" in command:
+            if session.committed != session.size:
+                return self._reply(400, self._status_headers(session), {"error": {"message": "Finalized before all bytes were sent"}})
+            session.finalize()
+            return self._reply(200, self._status_headers(session), {"file": session.resource})
+        return self._reply(200, self._status_headers(session))
+
+
+def self_test(args):
+    """Uploads a file through ResumableUploader against an in-process stand-in server and checks the bytes."""
+    server = StandInUploadServer(("127.0.0.1", 0), args.drop_rate, args.error_rate, args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    path = args.self_test
+    if path == "-":
+        fd, path = tempfile.mkstemp(suffix=".mp4")
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(int(args.size_mb * 1024 ** 2)))
+    uploader = ResumableUploader(f"http://127.0.0.1:{server.server_address[1]}", chunk_size=int(args.chunk_mb * 1024 ** 2),
+                                 max_retries=args.max_retries, backoff_s=0.05, timeout_s=10)
+    progress = []
+    resource = uploader.upload(path, os.path.basename(path), on_progress=lambda sent, total: progress.append(sent))
+    with open(path, "rb") as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    server.shutdown()
+    ok = resource["sha256Hash"] == expected and progress and progress[-1] == os.path.getsize(path)
+    print(f"{'OK' if ok else 'FAILED'}: {resource['sizeBytes']} bytes as {resource['name']}, sha256 {'matches' if resource['sha256Hash'] == expected else 'DIFFERS'}; "
+          f"{len(progress)} progress updates; server counters: {server.counters}")
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini resumable upload endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of chunks whose connection is dropped part-way.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of chunks answered with 503.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--self-test", metavar="FILE", help="Upload FILE (or '-' for random bytes) against an in-process server and exit.")
+    parser.add_argument("--size-mb", type=float, default=20.0, help="Size of the random file for --self-test -.")
+    parser.add_argument("--chunk-mb", type=float, default=1.0, help="Uploader chunk size for --self-test (multiple of 0.25).")
+    parser.add_argument("--max-retries", type=int, default=20)
+    args = parser.parse_args(argv)
+    if args.self_test:
+        return self_test(args)
+    server = StandInUploadServer((args.host, args.port), args.drop_rate, args.error_rate, args.seed)
+    logging.info(f"Stand-in upload server on http://{args.host}:{args.port} (storage: {server.storage_dir}). "
+                 f"Set SCOUT_EYE_UPLOAD_BASE_URL to this address to send the app's chunks here.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())